@@ -24,11 +24,20 @@
 #
 
 from threading import Thread, Lock, Event
+from array import array
+from bisect import bisect_left, bisect_right
 import logging
 import idaapi
 import os
 import idc
 import json
+import struct
+import mmap
+import hashlib
+import heapq
+import shutil
+import time
+import re
 
 
 #  ----------------------------------------- Globals -----------------------------------------
@@ -36,67 +45,345 @@ DAP_VERSION = "0.2"
 DAP_NAME = "DebugAutoPatch"
 DAP_CONFIG_FILE_PATH = os.path.join(idc.GetIdaDirectory(), 'cfg', 'DebugAutoPatch.cfg')
 DAP_WEBSITE = "https://github.com/scottmudge/DebugAutoPatch"
+DAP_CACHE_SAVE_INTERVAL = 10.0  # Minimum seconds between patch cache writes while patches are changing
+DAP_ADDR_MASK = 0xFFFFFFFFFFFFFFFF
+DAP_PAGE_SIZE = 0x1000
+DAP_MONITOR_INTERVAL = 0.7  # Seconds between patch monitor cycles while busy (and always, when polling)
+DAP_MONITOR_MAX_INTERVAL = 30.0  # Seconds between patch monitor cycles once idle, when tracking patch events
+DAP_MEMORY_REFRESH_INTERVAL = 1.0  # Minimum seconds between memory layout checks on suspend, while patches are pending
+DAP_PLAN_CACHE_SIZE = 8  # Write plans kept for reuse, e.g. by processes loading the patched module at the same base
+DAP_WRITE_BATCH_SIZE = 0x10000  # Maximum bytes written per dispatch to the main thread, when executing a write plan
+# Extensions of modules which are loaded by a host process, rather than started as the process itself
+DAP_LIBRARY_EXTENSIONS = (".dll", ".so", ".dylib", ".sys", ".ocx", ".cpl", ".drv")
 DEBUG_MESSAGE_LEVEL = logging.INFO
+DAP_LOG_RATE_INTERVAL = 5.0  # Seconds over which repeats of the same message are limited
+DAP_LOG_RATE_BURST = 3  # Repeats of the same message shown within each interval, before the rest are suppressed
+DAP_FAST_START = True  # Load the configuration and patch buffer in the background, rather than while IDA starts
+DAP_STARTUP_WAIT_TIMEOUT = 30.0  # Maximum seconds a debugger event waits for background startup to finish
 DAP_INITIALIZED = False
 DAP_INSTANCE = None
 #  ---------------------------------------------------------------------------------------------
 
 
 #  ----------------------------------------- Utilities -----------------------------------------
-def dap_msg(string):
-    print("[{}]: {}".format(DAP_NAME, string))
+class DapOutputFormatter(logging.Formatter):
+    """Formats messages for IDA's output window, e.g. "[DebugAutoPatch | WARNING]: message"."""
+    def format(self, record):
+        if record.levelno == logging.INFO:
+            return "[{}]: {}".format(DAP_NAME, record.getMessage())
+        return "[{} | {}]: {}".format(DAP_NAME, record.levelname, record.getMessage())
 
 
-def dap_warn(string, details = None):
-    if details:
-        print("[{} | WARNING]: {}\n\t> Details: {}".format(DAP_NAME, string, details))
-    else:
-        print("[{} | WARNING]: {}".format(DAP_NAME, string))
+class DapOutputHandler(logging.StreamHandler):
+    """Writes messages to IDA's output window, i.e. whatever sys.stdout currently is."""
+    def __init__(self):
+        logging.StreamHandler.__init__(self)
+        self.setFormatter(DapOutputFormatter())
 
+    def emit(self, record):
+        try:
+            print(self.format(record))
+        except Exception:
+            self.handleError(record)
+
+
+class DapRateLimitFilter(logging.Filter):
+    """Limits repeats of the same message to a few per interval, so a message raised in a loop or on every monitor
+    cycle cannot flood the output window. The number of suppressed repeats is reported with the next one shown.
+
+    Only messages logged with a key (the "dap_key" record attribute) are limited, so one-off messages such as the
+    result of a menu action always show. Messages which can repeat pass a key shared by all their repeats, e.g.
+    one which leaves out the address the message includes.
+    """
+    MAX_KEYS = 1024
+
+    def __init__(self, interval=DAP_LOG_RATE_INTERVAL, burst=DAP_LOG_RATE_BURST):
+        logging.Filter.__init__(self)
+        self.interval = interval
+        self.burst = burst
+        # Maps key to [window start, messages shown in window, messages suppressed]
+        self.windows = {}
+        self._lock = Lock()
+
+    def filter(self, record):
+        key = getattr(record, "dap_key", None)
+        if key is None:
+            return True
+        now = dap_clock()
+        with self._lock:
+            window = self.windows.get(key)
+            if window is not None and now - window[0] < self.interval:
+                if window[1] >= self.burst:
+                    window[2] += 1
+                    return False
+                window[1] += 1
+                return True
+            if window is None and len(self.windows) >= self.MAX_KEYS:
+                self.windows = dict((k, w) for k, w in self.windows.items() if now - w[0] < self.interval)
+            self.windows[key] = [now, 1, 0]
+        if window is not None and window[2]:
+            record.msg = "{} ([{}] similar messages suppressed)".format(record.msg, window[2])
+        return True
+
+
+def _create_logger():
+    logger = logging.getLogger(DAP_NAME)
+    # Replace the handlers of a previously loaded copy of the plugin, if any
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    for log_filter in list(logger.filters):
+        logger.removeFilter(log_filter)
+    logger.addHandler(DapOutputHandler())
+    logger.addFilter(DapRateLimitFilter())
+    logger.setLevel(DEBUG_MESSAGE_LEVEL)
+    # Keep messages out of IDA's (or any other) root logger configuration
+    logger.propagate = False
+    return logger
+
+
+DAP_LOGGER = _create_logger()
+
+
+def _details(string, details):
+    return "{}\n\t> Details: {}".format(string, details) if details else string
+
+
+def dap_debug(string, *args, **kwargs):
+    """Logs a debug message. The message is only formatted, with str.format(*args), if debug messages are enabled,
+    so debug messages cost next to nothing on hot paths otherwise."""
+    if DAP_LOGGER.isEnabledFor(logging.DEBUG):
+        DAP_LOGGER.debug(string.format(*args) if args else string, extra={"dap_key": kwargs.get("key")})
+
+
+def dap_msg(string, key=None):
+    DAP_LOGGER.info(string, extra={"dap_key": key})
+
+
+def dap_warn(string, details = None, key=None):
+    DAP_LOGGER.warning(_details(string, details), extra={"dap_key": key})
+
+
+def dap_err(string, details = None, key=None):
+    DAP_LOGGER.error(_details(string, details), extra={"dap_key": key})
+
+
+def configure_logging(level=DEBUG_MESSAGE_LEVEL, log_file=None):
+    """Sets the level of messages shown, and the file messages are also written to, if any.
+
+    Args:
+        level (int): Logging level, e.g. logging.DEBUG.
+        log_file (str): Path of the log file, or None to only write messages to the output window.
+    """
+    DAP_LOGGER.setLevel(level)
+    for handler in list(DAP_LOGGER.handlers):
+        if isinstance(handler, logging.FileHandler):
+            DAP_LOGGER.removeHandler(handler)
+            handler.close()
+    if log_file:
+        try:
+            handler = logging.FileHandler(log_file)
+        except (IOError, OSError) as e:
+            dap_warn("Could not open log file: {}".format(log_file), str(e))
+            return
+        handler.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] %(message)s"))
+        DAP_LOGGER.addHandler(handler)
+
+
+# High resolution clock where available (Python 3.3+)
+dap_clock = getattr(time, "perf_counter", time.time)
 
-def dap_err(string, details = None):
-    if details:
-        print("[{} | ERROR]: {}\n\t> Details: {}".format(DAP_NAME, string, details))
-    else:
-        print("[{} | ERROR]: {}".format(DAP_NAME, string))
+
+class _NullTimer(object):
+    """Timer context used when statistics are disabled -- does nothing."""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _StatsTimer(object):
+    """Timer context which records its elapsed time in a DapStats instance."""
+    def __init__(self, stats, name, phases):
+        self.stats = stats
+        self.name = name
+        self.phases = phases
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = dap_clock()
+        return self
+
+    def __exit__(self, *args):
+        elapsed = dap_clock() - self.start
+        self.stats.add_time(self.name, elapsed)
+        if self.phases is not None:
+            self.phases[self.name] = self.phases.get(self.name, 0.0) + elapsed
+        return False
+
+
+class DapStats(object):
+    """Timing and counters for the plugin's hot paths.
+
+    Timers record call count, total and maximum duration under a name. Per debug session phase durations are kept
+    separately, keyed by PID. When disabled, timer() returns a shared no-op context and count() returns immediately,
+    so instrumented code costs next to nothing.
+    """
+    def __init__(self):
+        self.enabled = False
+        self._lock = Lock()
+        self.timers = {}
+        self.counters = {}
+        self.sessions = {}
+
+    def reset(self):
+        with self._lock:
+            self.timers = {}
+            self.counters = {}
+            self.sessions = {}
+
+    def timer(self, name, phases=None):
+        """Returns a context which times its body.
+
+        Args:
+            name (str): Timer name.
+            phases (dict): Optional per-session dict to also accumulate the elapsed time into, under name.
+        """
+        if not self.enabled:
+            return _NULL_TIMER
+        return _StatsTimer(self, name, phases)
+
+    def add_time(self, name, seconds):
+        with self._lock:
+            entry = self.timers.get(name)
+            if entry is None:
+                self.timers[name] = [1, seconds, seconds]
+            else:
+                entry[0] += 1
+                entry[1] += seconds
+                entry[2] = max(entry[2], seconds)
+
+    def count(self, name, amount=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def new_phases(self):
+        """Returns a dict to accumulate per-session phase times into, or None when disabled."""
+        return {} if self.enabled else None
+
+    def record_session(self, pid, **values):
+        """Records values for a debug session."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self.sessions.setdefault(pid, {}).update(values)
+
+    def get(self):
+        """Returns all statistics as a JSON serializable dict, with times in milliseconds."""
+        with self._lock:
+            timers = {}
+            for name, (count, total, maximum) in self.timers.items():
+                timers[name] = {
+                    "count": count,
+                    "total_ms": total * 1000.0,
+                    "mean_ms": total * 1000.0 / count,
+                    "max_ms": maximum * 1000.0,
+                }
+            sessions = {}
+            for pid, values in self.sessions.items():
+                sessions[str(pid)] = dict(values)
+            return {
+                "enabled": self.enabled,
+                "timers": timers,
+                "counters": dict(self.counters),
+                "sessions": sessions,
+            }
+
+    def dump_session(self, pid, directory):
+        """Writes statistics for a debug session, along with the overall statistics, to a JSON file.
+
+        Returns:
+            str: Path of the written file.
+        """
+        stats = self.get()
+        stats["session"] = stats["sessions"].get(str(pid), {})
+        path = os.path.join(directory, "DebugAutoPatch_stats_{}_{}.json".format(
+            pid, time.strftime("%Y%m%d_%H%M%S")))
+        with open(path, "wt") as f:
+            json.dump(stats, f, indent=2, sort_keys=True)
+        return path
 
 
 class KillableThread(Thread):
-    """Wraps a killable thread that loops at a preset interval. Runs supplied
+    """Wraps a killable thread that loops at an adaptive interval. Runs supplied
     target function.
+
+    If the target returns True (it found work to do), the interval drops back to
+    sleep_interval. Otherwise it backs off exponentially up to max_interval. The
+    loop can be woken immediately with trigger(), and paused with suspend().
     """
     def __del__(self):
         self.kill()
 
-    def __init__(self, name, target, sleep_interval):
+    def __init__(self, name, target, sleep_interval, max_interval=None, backoff=2.0):
         """
         Args:
             name: Name of the thread, used for logging.
             target (function): Target function
-            sleep_interval (float): Sleep interval seconds between loops.
+            sleep_interval (float): Minimum sleep interval seconds between loops.
+            max_interval (float): Maximum sleep interval seconds while idle. Defaults to sleep_interval (no backoff).
+            backoff (float): Factor the interval grows by after each idle loop.
         """
         super(KillableThread, self).__init__(group=None, target=target, name=name)
         self._trigger = Event()
+        self._min_interval = sleep_interval
+        self._max_interval = max(max_interval or sleep_interval, sleep_interval)
+        self._backoff = backoff
         self._interval = sleep_interval
         self._target = target
         self._name = name
         self._kill = False
+        self._suspended = False
         self.setDaemon(True)
 
+    @property
+    def interval(self):
+        """Current effective sleep interval in seconds, or None while suspended."""
+        return None if self._suspended else self._interval
+
     def trigger(self):
         """Triggers loop, but does not kill it."""
         self._kill = False
+        self._interval = self._min_interval
         self._trigger.set()
 
+    def suspend(self):
+        """Stops running the target until resume() is called."""
+        self._suspended = True
+
+    def resume(self):
+        """Resumes running the target, immediately."""
+        self._suspended = False
+        self.trigger()
+
     def run(self):
         """Runs the thread."""
         while True:
             try:
-                self._target()
-                # If no kill signal is set, sleep for the interval,
+                if not self._suspended:
+                    if self._target():
+                        self._interval = self._min_interval
+                    else:
+                        self._interval = min(self._interval * self._backoff, self._max_interval)
+                # If no kill signal is set, sleep for the interval (or until resumed, if suspended),
                 # If kill signal comes in while sleeping, immediately
                 #  wake up and handle
-                is_triggerer = self._trigger.wait(timeout=self._interval)
+                is_triggerer = self._trigger.wait(timeout=None if self._suspended else self._interval)
                 if is_triggerer:
                     if self._kill:
                         break
@@ -115,348 +402,3951 @@ class KillableThread(Thread):
 #  ---------------------------------------------------------------------------------------------
 
 
-class DapCfg:
-    def __init__(self):
+#  --------------------------------------- Patch Storage ---------------------------------------
+class _Int64Array(object):
+    """Array of 64-bit integers for Python builds whose array module has none -- Python 2 on Windows, where 'L' and
+    'l' are 32-bit. Items are packed into a bytearray in native byte order, the layout of array('Q') and
+    array('q'), so cache and journal files stay readable by either kind of build. Implements only the parts of the
+    array interface the patch stores use.
+    """
+    itemsize = 8
+
+    def __init__(self, typecode, items=()):
+        self.typecode = typecode
+        self.item = struct.Struct("=" + typecode)
+        self.raw = bytearray()
+        self.extend(items)
+
+    def __len__(self):
+        return len(self.raw) // self.itemsize
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return _Int64Array(self.typecode, [self[i] for i in range(start, stop, step)])
+            result = _Int64Array(self.typecode)
+            result.raw = self.raw[start * self.itemsize:max(start, stop) * self.itemsize]
+            return result
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("array index out of range")
+        return self.item.unpack_from(self.raw, index * self.itemsize)[0]
+
+    def __getslice__(self, start, stop):
+        # Python 2 passes simple slices here rather than to __getitem__
+        return self.__getitem__(slice(start, stop))
+
+    def __setitem__(self, index, value):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("array assignment index out of range")
+        self.item.pack_into(self.raw, index * self.itemsize, value)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __eq__(self, other):
+        return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __mul__(self, count):
+        result = _Int64Array(self.typecode)
+        result.raw = self.raw * count
+        return result
+
+    def append(self, value):
+        self.raw += self.item.pack(value)
+
+    def extend(self, items):
+        if isinstance(items, _Int64Array):
+            self.raw += items.raw
+        else:
+            for item in items:
+                self.append(item)
+
+    def frombytes(self, data):
+        self.raw += data
+
+    def tofile(self, f):
+        f.write(self.raw)
+
+
+def _typed_array(typecode, fallback, items=()):
+    """Creates a typed array of 64-bit integers. Python 2 has no 'Q' or 'q' typecode, so the fallback typecode
+    is used where it is 64-bit too, and an _Int64Array where it is not (Windows, where longs are 32-bit).
+
+    Args:
+        typecode (str): 'Q' or 'q'.
+        fallback (str): 'L' or 'l', of the same signedness.
+        items (iterable): Initial items.
+    """
+    try:
+        return array(typecode, items)
+    except ValueError:
         pass
+    if array(fallback).itemsize >= 8:
+        return array(fallback, items)
+    return _Int64Array(typecode, items)
 
-    Enabled = "enabled"
-    PrimaryPatchAddr = "primary_patch_addr"
 
+def _array_buffer(items):
+    """Returns an object exposing the raw bytes of a typed array to the buffer protocol, without copying."""
+    return items.raw if isinstance(items, _Int64Array) else items
 
-# About form
-class DAPAboutForm(idaapi.Form):
+
+def _array_from_bytes(items, data):
+    """Appends raw native-order items to a typed array -- array.frombytes(), or fromstring() on Python 2."""
+    if hasattr(items, "frombytes"):
+        items.frombytes(data)
+    else:
+        items.fromstring(bytes(data))
+
+
+def _replace_file(src, dst):
+    """Renames src to dst, replacing dst atomically. Python 2 has no os.replace(), and its os.rename() only
+    replaces an existing file on POSIX, so the file is removed first on Windows."""
+    if hasattr(os, "replace"):
+        os.replace(src, dst)
+        return
+    if os.name == "nt" and os.path.exists(dst):
+        os.remove(dst)
+    os.rename(src, dst)
+
+
+class PatchStore(object):
+    """Compact store of patched bytes, sorted by address.
+
+    Backed by parallel typed arrays rather than a Python object per byte, so hundreds of thousands of patched
+    bytes cost a few bytes each and produce no garbage for the collector. Lookups use bisection on the address
+    array, and contiguous runs are found without visiting every byte.
+    """
     def __init__(self):
-        # create About form
-        super(DAPAboutForm, self).__init__(
-            r"""STARTITEM 0
-BUTTON YES* Open DebugAutoPatch Website
-DebugAutoPatch - About
+        self.addrs = _typed_array('Q', 'L')
+        self.fpos = _typed_array('q', 'l')
+        self.orig = bytearray()
+        self.patched = bytearray()
+        self._sorted = True
 
-           {FormChangeCb}
-           DebugAutoPatch IDA plugin v%s.
-           (c) Scott Mudge, 2019.
+    def append(self, ea, fpos, orig, patched):
+        """Appends a patched byte. Appending out of order is allowed, but finalize() must be called after."""
+        if self._sorted and len(self.addrs) and ea <= self.addrs[-1]:
+            self._sorted = False
+        self.addrs.append(ea)
+        self.fpos.append(fpos)
+        self.orig.append(orig)
+        self.patched.append(patched)
 
-           DebugAutoPatch is released under the GPL v3.
-           Find more info at %s
-           """ % (DAP_VERSION, DAP_WEBSITE), {
-                'FormChangeCb': self.FormChangeCb(self.OnFormChange),
-            })
+    def finalize(self):
+        """Sorts the store by address if needed, removing duplicate addresses (last one wins)."""
+        if self._sorted:
+            return self
+        addrs = self.addrs
+        order = sorted(range(len(addrs)), key=addrs.__getitem__)
+        store = PatchStore()
+        for i in order:
+            if len(store.addrs) and store.addrs[-1] == addrs[i]:
+                store.fpos[-1] = self.fpos[i]
+                store.orig[-1] = self.orig[i]
+                store.patched[-1] = self.patched[i]
+            else:
+                store.append(addrs[i], self.fpos[i], self.orig[i], self.patched[i])
+        self.addrs, self.fpos, self.orig, self.patched = store.addrs, store.fpos, store.orig, store.patched
+        self._sorted = True
+        return self
 
-        self.Compile()
+    def __len__(self):
+        return len(self.addrs)
+
+    def __iter__(self):
+        """Yields (ea, fpos, orig, patched) tuples. Prefer iter_runs() on hot paths."""
+        for i in range(len(self.addrs)):
+            yield self.addrs[i], self.fpos[i], self.orig[i], self.patched[i]
+
+    def find(self, ea):
+        """Returns the index of the patched byte at ea, or -1 if ea is not patched."""
+        i = bisect_left(self.addrs, ea)
+        if i < len(self.addrs) and self.addrs[i] == ea:
+            return i
+        return -1
+
+    def index_range(self, start, end):
+        """Returns the (lo, hi) index range of patched bytes within [start, end)."""
+        return bisect_left(self.addrs, start), bisect_left(self.addrs, end)
+
+    def slice(self, start, end):
+        """Returns a new store holding only the patched bytes within [start, end)."""
+        lo, hi = self.index_range(start, end)
+        store = PatchStore()
+        store.addrs = self.addrs[lo:hi]
+        store.fpos = self.fpos[lo:hi]
+        store.orig = self.orig[lo:hi]
+        store.patched = self.patched[lo:hi]
+        return store
+
+    def __eq__(self, other):
+        if not isinstance(other, PatchStore):
+            return NotImplemented
+        return (self.addrs == other.addrs and self.patched == other.patched and self.orig == other.orig and
+                self.fpos == other.fpos)
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    __hash__ = None
+
+    def extend_from(self, other, lo, hi):
+        """Appends the patched bytes at indices [lo, hi) of another store in bulk. They must sort after this
+        store's last address."""
+        self.addrs.extend(other.addrs[lo:hi])
+        self.fpos.extend(other.fpos[lo:hi])
+        self.orig.extend(other.orig[lo:hi])
+        self.patched.extend(other.patched[lo:hi])
+
+    def extend_run(self, start, fpos, orig, patched):
+        """Appends a contiguous run of patched bytes in bulk. Appending out of order is allowed, but finalize()
+        must be called after.
+
+        Args:
+            start (int): Address of the first byte.
+            fpos (int): File offset of the first byte, or -1 if the run is not backed by the input file.
+            orig (bytearray): Original bytes.
+            patched (bytearray): Patched bytes, of the same length.
+        """
+        size = len(patched)
+        if not size:
+            return
+        if self._sorted and len(self.addrs) and start <= self.addrs[-1]:
+            self._sorted = False
+        self.addrs.extend(range(start, start + size))
+        if fpos < 0:
+            self.fpos.extend(_typed_array('q', 'l', [-1]) * size)
+        else:
+            self.fpos.extend(range(fpos, fpos + size))
+        self.orig.extend(orig)
+        self.patched.extend(patched)
+
+    def merged(self, deltas):
+        """Returns a new store with a set of changes applied. Unchanged spans between the changed addresses are
+        copied in bulk, so the cost is one pass of array copies plus O(k log n) for k changes.
+
+        Args:
+            deltas (dict): Maps ea to a (fpos, orig, patched) tuple for new or modified patches, or to None for
+                reverted patches.
+        """
+        store = PatchStore()
+        prev = 0
+        for ea in sorted(deltas):
+            i = bisect_left(self.addrs, ea, prev)
+            store.extend_from(self, prev, i)
+            # Skip over the existing entry, if any -- it is either replaced or removed
+            prev = i + 1 if i < len(self.addrs) and self.addrs[i] == ea else i
+            delta = deltas[ea]
+            if delta is not None:
+                fpos, orig, patched = delta
+                store.append(ea, fpos, orig, patched)
+        store.extend_from(self, prev, len(self.addrs))
+        return store
+
+    def overlaid(self, other):
+        """Returns a store holding this store's patches, plus another store's patches at the addresses this store
+        does not patch. Both stores are walked run by run, copying each span in bulk.
+        """
+        if not len(other):
+            return self
+        if not len(self):
+            return other
+        store = PatchStore()
+        addrs, other_addrs = self.addrs, other.addrs
+        i = j = 0
+        while i < len(addrs) and j < len(other_addrs):
+            if addrs[i] < other_addrs[j]:
+                k = bisect_left(addrs, other_addrs[j], i)
+                store.extend_from(self, i, k)
+                i = k
+            elif other_addrs[j] < addrs[i]:
+                k = bisect_left(other_addrs, addrs[i], j)
+                store.extend_from(other, j, k)
+                j = k
+            else:
+                # Both patch this address -- take this store's whole run, and skip the other's bytes under it
+                k = self.run_end(i)
+                j = bisect_right(other_addrs, addrs[k - 1], j)
+                store.extend_from(self, i, k)
+                i = k
+        store.extend_from(self, i, len(addrs))
+        store.extend_from(other, j, len(other_addrs))
+        return store
+
+    def excluding(self, other):
+        """Returns a new store holding this store's patches at the addresses another store does not patch."""
+        store = PatchStore()
+        for i in range(len(self.addrs)):
+            if other.find(self.addrs[i]) < 0:
+                store.append(self.addrs[i], self.fpos[i], self.orig[i], self.patched[i])
+        return store
+
+    def intersecting(self, other):
+        """Returns a new store holding this store's patches at the addresses another store also patches."""
+        store = PatchStore()
+        for i in range(len(self.addrs)):
+            if other.find(self.addrs[i]) >= 0:
+                store.append(self.addrs[i], self.fpos[i], self.orig[i], self.patched[i])
+        return store
+
+    def run_end(self, lo, hi=None):
+        """Returns the index one past the end of the contiguous run of addresses beginning at index lo."""
+        addrs = self.addrs
+        if hi is None:
+            hi = len(addrs)
+        # Addresses are sorted and unique, so [lo, i] is contiguous if and only if addrs[i] - i == addrs[lo] - lo.
+        # This allows galloping over long runs rather than stepping through every byte.
+        base = addrs[lo] - lo
+        good = lo
+        step = 1
+        while good + step < hi and addrs[good + step] - (good + step) == base:
+            good += step
+            step <<= 1
+        bad = min(good + step, hi)
+        while bad - good > 1:
+            mid = (good + bad) // 2
+            if addrs[mid] - mid == base:
+                good = mid
+            else:
+                bad = mid
+        return good + 1
+
+    def iter_runs(self, lo=0, hi=None):
+        """Yields (start address, lo index, hi index) for each run of contiguous patched addresses."""
+        if hi is None:
+            hi = len(self.addrs)
+        while lo < hi:
+            end = self.run_end(lo, hi)
+            yield self.addrs[lo], lo, end
+            lo = end
+
+    def iter_file_runs(self, lo=0, hi=None):
+        """Yields (start, fpos, orig, patched) for each run contiguous both in memory and in the input file, with
+        fpos -1 for runs not backed by the input file."""
+        fpos = self.fpos
+        for start, a, b in self.iter_runs(lo, hi):
+            if fpos[a] >= 0 and fpos[a:b] == _typed_array('q', 'l', range(fpos[a], fpos[a] + b - a)):
+                yield start, fpos[a], self.orig[a:b], self.patched[a:b]
+                continue
+            # Rare -- the run crosses a section boundary, so split it where the file offsets jump
+            i = a
+            for k in range(a + 1, b + 1):
+                if k < b and (fpos[k] == fpos[k - 1] + 1 if fpos[k - 1] >= 0 else fpos[k] < 0):
+                    continue
+                yield start + i - a, max(fpos[i], -1), self.orig[i:k], self.patched[i:k]
+                i = k
+
+
+def database_key(input_md5, idb_path):
+    """Returns a hash identifying a database by its input file hash and path, for naming per-database files."""
+    key = hashlib.md5()
+    key.update(input_md5 if isinstance(input_md5, bytes) else input_md5.encode("utf-8"))
+    key.update(idb_path.encode("utf-8"))
+    return key
+
+
+class PatchCache(object):
+    """Compact binary on-disk cache of the patch buffer, stored next to the configuration file.
+
+    The cache is keyed by the input file hash and the database path, so it is only ever loaded for the database
+    it was saved from. Arrays are stored raw in native byte order and loaded through mmap, so even very large patch
+    sets are loaded with a handful of bulk copies instead of a walk of the "Patched bytes" database.
+    """
+    MAGIC = b"DAPC"
+    FORMAT_VERSION = 2
+    # magic, format version, address item size, fpos item size, patched byte count, cache key
+    HEADER = struct.Struct("<4sIBBxxQ16s")
+
+    def __init__(self, directory, input_md5, idb_path):
+        """
+        Args:
+            directory (str): Directory to store the cache file in.
+            input_md5 (bytes): Hash of the input file.
+            idb_path (str): Path of the database, identifying it among databases of the same input file.
+        """
+        key = database_key(input_md5, idb_path)
+        self.key = key.digest()
+        self.path = os.path.join(directory, "DebugAutoPatch_{}.cache".format(key.hexdigest()[:16]))
+
+    def load(self):
+        """Loads the cached patch store.
+
+        Returns:
+            PatchStore: The cached patches, or None if there is no valid cache for this database.
+        """
+        if not os.path.isfile(self.path):
+            return None
+        with open(self.path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < self.HEADER.size:
+                return None
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                magic, fmt, addr_size, fpos_size, count, key = self.HEADER.unpack_from(mm, 0)
+                store = PatchStore()
+                if (magic != self.MAGIC or fmt != self.FORMAT_VERSION or key != self.key or
+                        addr_size != store.addrs.itemsize or fpos_size != store.fpos.itemsize or
+                        size != self.HEADER.size + count * (addr_size + fpos_size + 2)):
+                    return None
+                try:
+                    view = memoryview(mm)
+                except TypeError:
+                    # Python 2's mmap has no buffer interface -- slicing it copies
+                    view = mm
+                try:
+                    offset = self.HEADER.size
+                    _array_from_bytes(store.addrs, view[offset:offset + count * addr_size])
+                    offset += count * addr_size
+                    _array_from_bytes(store.fpos, view[offset:offset + count * fpos_size])
+                    offset += count * fpos_size
+                    store.orig = bytearray(view[offset:offset + count])
+                    offset += count
+                    store.patched = bytearray(view[offset:offset + count])
+                finally:
+                    if view is not mm:
+                        view.release()
+                return store
+            finally:
+                mm.close()
+
+    def save(self, store):
+        """Writes a patch store to the cache, replacing the previous cache file atomically."""
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(self.HEADER.pack(self.MAGIC, self.FORMAT_VERSION, store.addrs.itemsize, store.fpos.itemsize,
+                                     len(store), self.key))
+            store.addrs.tofile(f)
+            store.fpos.tofile(f)
+            f.write(store.orig)
+            f.write(store.patched)
+        _replace_file(tmp_path, self.path)
+
+
+class PatchSnapshot(object):
+    """Immutable, versioned view of the patch buffer.
+
+    Writers never modify a published snapshot. They build a new PatchStore and publish a new snapshot by swapping a
+    single reference, which is atomic, so readers (e.g. the process start hook) can take the latest snapshot without
+    waiting on the monitor thread.
+
+    Patches are stored relative to the module they belong to (module, RVA), so they can be applied wherever the
+    module is loaded in the debugged process. Only bytes backed by the input file are tracked, so every patch belongs
+    to the database's own module.
+    """
+    def __init__(self, version, store, module="", link_base=0):
+        """
+        Args:
+            version (int): Version counter, incremented each time the patch set changes.
+            store (PatchStore): Finalized patch store, addressed by RVA. Must not be modified after publishing.
+            module (str): Name of the module the patches belong to.
+            link_base (int): Image base of the module in the database.
+        """
+        self.version = version
+        self.store = store
+        self.module = module
+        self.link_base = link_base
+
+    def __len__(self):
+        return len(self.store)
+
+    def same_patches(self, store, module, link_base):
+        """Returns whether this snapshot already holds the given patches."""
+        return self.module == module and self.link_base == link_base and self.store == store
+#  ---------------------------------------------------------------------------------------------
+
+
+#  ---------------------------------------- Patch Files ----------------------------------------
+# Spans of at least this many identical bytes are stored once, as a fill
+DAP_MIN_FILL = 8
+_FILL_PATTERN = re.compile(br"(.)\1{%d,}" % (DAP_MIN_FILL - 1), re.DOTALL)
+
+
+def split_fill_spans(data):
+    """Splits a run into literal spans and fill spans (a single repeated byte, e.g. NOP sleds).
+
+    Yields:
+        tuple: (offset, length, is fill) for each span, in order.
+    """
+    pos = 0
+    for match in _FILL_PATTERN.finditer(data):
+        if match.start() > pos:
+            yield pos, match.start() - pos, False
+        yield match.start(), match.end() - match.start(), True
+        pos = match.end()
+    if pos < len(data):
+        yield pos, len(data) - pos, False
+
+
+class PatchFileFormat(object):
+    """Base class of patch set file formats.
+
+    Patch sets are streamed to and from files as runs of (RVA, file offset, original bytes, patched bytes), so
+    neither side ever holds a Python object per patched byte. Formats which address patches by file offset read
+    runs with an RVA of None, and original bytes of None where the format does not record them.
+    """
+    name = None
+    extension = None
+    binary = True
+
+    def __init__(self, module="", link_base=0, original_byte=None):
+        """
+        Args:
+            module (str): Name of the module the patches belong to.
+            link_base (int): Image base of the module in the database.
+            original_byte (callable): Returns the input file's original byte at a file offset, or None if unknown.
+                Used by formats which write unpatched bytes next to the patches.
+        """
+        self.module = module
+        self.link_base = link_base
+        self.original_byte = original_byte
+
+    def write(self, f, runs):
+        """Writes runs to a file.
+
+        Args:
+            f (file): File opened for writing, in binary mode if the format is binary.
+            runs (iterable): (RVA, file offset, original bytes, patched bytes) runs, sorted by RVA. File offset is
+                -1 for runs not backed by the input file.
+
+        Returns:
+            tuple: (bytes written, bytes which cannot be represented in this format and were skipped)
+        """
+        raise NotImplementedError
+
+    def read(self, f):
+        """Reads the header of a file, and returns an iterator over its (RVA, file offset, original bytes, patched
+        bytes) runs."""
+        raise NotImplementedError
 
-    # callback to be executed when any form control changed
     @staticmethod
-    def OnFormChange(fid):
-        if fid == -2:  # Goto homepage
-            import webbrowser
-            # open Keypatch homepage in a new tab, if possible
-            webbrowser.open(DAP_WEBSITE, new=2)
+    def read_exact(f, size):
+        data = f.read(size)
+        if len(data) != size:
+            raise ValueError("Unexpected end of patch file.")
+        return data
 
-        return 1
 
+class DapPatchFormat(PatchFileFormat):
+    """Compact binary run-length patch set format.
 
-# Create menu handlers for IDA >= 700
-try:
-    # noinspection PyBroadException
-    class DapMenuContext(idaapi.action_handler_t):
-        label = None
+    A header holding the module name and link base is followed by one record per run, addressed by RVA so the set
+    can be applied to any database or process of the module. Spans of a single repeated byte are stored as fills.
+    """
+    name = "DebugAutoPatch patch set"
+    extension = ".dap"
+    MAGIC = b"DAPP"
+    FORMAT_VERSION = 1
+    # Each record is followed by its original bytes
+    FLAG_ORIGINALS = 0x1
+    # magic, format version, flags, link base, module name length
+    HEADER = struct.Struct("<4sHHQH")
+    # record kind, RVA, file offset, length
+    RECORD = struct.Struct("<BQqI")
+    RECORD_BYTES = 0
+    RECORD_FILL = 1
+    RECORD_END = 0xFF
 
-        @classmethod
-        def get_name(self):
-            return self.__name__
+    def write(self, f, runs):
+        module = self.module.encode("utf-8")
+        f.write(self.HEADER.pack(self.MAGIC, self.FORMAT_VERSION, self.FLAG_ORIGINALS, self.link_base, len(module)))
+        f.write(module)
+        written = 0
+        for start, fpos, orig, patched in runs:
+            for offset, length, fill in split_fill_spans(patched):
+                f.write(self.RECORD.pack(self.RECORD_FILL if fill else self.RECORD_BYTES, start + offset,
+                                         fpos + offset if fpos >= 0 else -1, length))
+                f.write(patched[offset:offset + 1] if fill else patched[offset:offset + length])
+                f.write(orig[offset:offset + length])
+            written += len(patched)
+        f.write(self.RECORD.pack(self.RECORD_END, 0, -1, 0))
+        return written, 0
 
-        @classmethod
-        def get_label(self):
-            return self.label
+    def read(self, f):
+        magic, fmt, flags, link_base, name_size = self.HEADER.unpack(self.read_exact(f, self.HEADER.size))
+        if magic != self.MAGIC:
+            raise ValueError("Not a DebugAutoPatch patch set.")
+        if fmt != self.FORMAT_VERSION:
+            raise ValueError("Unsupported patch set format version ({}).".format(fmt))
+        self.module = self.read_exact(f, name_size).decode("utf-8")
+        self.link_base = link_base
+        return self._records(f, flags & self.FLAG_ORIGINALS)
 
-        @classmethod
-        def register(self, plugin, label):
-            self.plugin = plugin
-            self.label = label
-            instance = self()
-            return idaapi.register_action(idaapi.action_desc_t(
-                self.get_name(),  # Name. Acts as an ID. Must be unique.
-                instance.get_label(),  # Label. That's what users see.
-                instance  # Handler. Called when activated, and for updating
-            ))
+    def _records(self, f, originals):
+        while True:
+            kind, start, fpos, length = self.RECORD.unpack(self.read_exact(f, self.RECORD.size))
+            if kind == self.RECORD_END:
+                return
+            if kind == self.RECORD_FILL:
+                patched = bytearray(self.read_exact(f, 1)) * length
+            elif kind == self.RECORD_BYTES:
+                patched = bytearray(self.read_exact(f, length))
+            else:
+                raise ValueError("Unknown patch set record ({}).".format(kind))
+            orig = bytearray(self.read_exact(f, length)) if originals else None
+            yield start, fpos, orig, patched
+
+
+class IpsPatchFormat(PatchFileFormat):
+    """International Patching System format, addressed by file offset. Offsets are limited to 24 bits, and
+    records to 64 KiB. Spans of a single repeated byte are stored as RLE records."""
+    name = "IPS patch"
+    extension = ".ips"
+    MAGIC = b"PATCH"
+    FOOTER = b"EOF"
+    # An offset which would read as the footer
+    EOF_OFFSET = 0x454F46
+    MAX_OFFSET = 0x1000000
+    MAX_RECORD = 0xFFFF
+
+    def write(self, f, runs):
+        f.write(self.MAGIC)
+        written = skipped = 0
+        for start, fpos, orig, patched in runs:
+            if fpos < 0 or fpos >= self.MAX_OFFSET:
+                skipped += len(patched)
+                continue
+            if fpos + len(patched) > self.MAX_OFFSET:
+                # Only the part of the run below the 24-bit offset limit can be written
+                skipped += fpos + len(patched) - self.MAX_OFFSET
+                patched = patched[:self.MAX_OFFSET - fpos]
+            for offset, length, fill in split_fill_spans(patched):
+                end = offset + length
+                while offset < end:
+                    size = min(end - offset, self.MAX_RECORD)
+                    if fpos + offset == self.EOF_OFFSET:
+                        # The offset would read as the footer, so start the record a byte earlier, with the byte
+                        # before it as it is in the patched file
+                        if offset:
+                            before = patched[offset - 1]
+                        else:
+                            before = self.original_byte(fpos - 1) if self.original_byte else None
+                        if before is None:
+                            skipped += 1
+                            offset += 1
+                            continue
+                        size = min(size, self.MAX_RECORD - 1)
+                        f.write(struct.pack(">I", self.EOF_OFFSET - 1)[1:])
+                        f.write(struct.pack(">HB", size + 1, before))
+                        f.write(patched[offset:offset + size])
+                        written += size
+                        offset += size
+                        continue
+                    f.write(struct.pack(">I", fpos + offset)[1:])
+                    if fill:
+                        f.write(struct.pack(">HHB", 0, size, patched[offset]))
+                    else:
+                        f.write(struct.pack(">H", size))
+                        f.write(patched[offset:offset + size])
+                    written += size
+                    offset += size
+        f.write(self.FOOTER)
+        return written, skipped
+
+    def read(self, f):
+        if self.read_exact(f, len(self.MAGIC)) != self.MAGIC:
+            raise ValueError("Not an IPS patch.")
+        return self._records(f)
+
+    def _records(self, f):
+        while True:
+            offset = self.read_exact(f, 3)
+            if offset == self.FOOTER:
+                return
+            fpos = struct.unpack(">I", b"\0" + offset)[0]
+            size, = struct.unpack(">H", self.read_exact(f, 2))
+            if size:
+                patched = bytearray(self.read_exact(f, size))
+            else:
+                count, value = struct.unpack(">HB", self.read_exact(f, 3))
+                patched = bytearray([value]) * count
+            yield None, fpos, None, patched
+
+
+class DifPatchFormat(PatchFileFormat):
+    """IDA's difference file text format, as written by "Produce file > Create DIF file". One line per byte,
+    addressed by file offset, with the original and patched values."""
+    name = "IDA difference file"
+    extension = ".dif"
+    binary = False
+    HEADER = "This difference file was created by IDA"
+    LINE_PATTERN = re.compile(r"^\s*([0-9A-Fa-f]+):\s*([0-9A-Fa-f]{2})\s+([0-9A-Fa-f]{2})\s*$")
+
+    def write(self, f, runs):
+        f.write("{}\n\n{}\n".format(self.HEADER, self.module))
+        written = skipped = 0
+        for start, fpos, orig, patched in runs:
+            if fpos < 0:
+                skipped += len(patched)
+                continue
+            f.write("".join("{:08X}: {:02X} {:02X}\n".format(fpos + i, orig[i], patched[i])
+                            for i in range(len(patched))))
+            written += len(patched)
+        return written, skipped
+
+    def read(self, f):
+        return self._records(f)
+
+    def _records(self, f):
+        fpos = -1
+        orig = bytearray()
+        patched = bytearray()
+        for line in f:
+            match = self.LINE_PATTERN.match(line)
+            if not match:
+                if not patched and line.strip() and line.strip() != self.HEADER:
+                    # The line after the header names the input file
+                    self.module = line.strip()
+                continue
+            offset = int(match.group(1), 16)
+            if patched and offset != fpos + len(patched):
+                yield None, fpos, orig, patched
+                orig = bytearray()
+                patched = bytearray()
+            if not patched:
+                fpos = offset
+            orig.append(int(match.group(2), 16))
+            patched.append(int(match.group(3), 16))
+        if patched:
+            yield None, fpos, orig, patched
+
+
+DAP_PATCH_FILE_FORMATS = (DapPatchFormat, IpsPatchFormat, DifPatchFormat)
+
+
+def patch_file_format(path):
+    """Returns the patch file format class for a path, by its extension. Reports an error and returns None if it is
+    not supported."""
+    extension = os.path.splitext(path)[1].lower()
+    for fmt in DAP_PATCH_FILE_FORMATS:
+        if fmt.extension == extension:
+            return fmt
+    dap_err("Unsupported patch set file: {}".format(path), "expected one of: {}".format(
+        ", ".join(known.extension for known in DAP_PATCH_FILE_FORMATS)))
+    return None
+#  ---------------------------------------------------------------------------------------------
+
+
+#  ---------------------------------------- Patch Groups ---------------------------------------
+DAP_DEFAULT_GROUP = "default"
+
+
+def merge_ranges(ranges):
+    """Sorts (start, end) ranges and merges overlapping or adjacent ones."""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def subtract_ranges(ranges, removed):
+    """Returns the parts of sorted, disjoint ranges not covered by another set of sorted, disjoint ranges, in a
+    single merge pass."""
+    result = []
+    j = 0
+    for start, end in ranges:
+        while j < len(removed) and removed[j][1] <= start:
+            j += 1
+        k = j
+        while start < end and k < len(removed) and removed[k][0] < end:
+            if removed[k][0] > start:
+                result.append((start, removed[k][0]))
+            start = max(start, removed[k][1])
+            k += 1
+        if start < end:
+            result.append((start, end))
+    return result
+
+
+class PatchGroup(object):
+    """Named set of RVA ranges whose patches are enabled or disabled together.
+
+    Each group is applied when its trigger fires: at process start (trigger None), or when execution reaches the
+    trigger RVA, for code which only exists after e.g. an unpacking stub has run.
+    """
+    def __init__(self, name, ranges=(), enabled=True, trigger=None):
+        self.name = name
+        self.ranges = merge_ranges(ranges)
+        self.enabled = enabled
+        self.trigger = trigger
+
+    def to_config(self):
+        return {"ranges": [[start, end] for start, end in self.ranges], "enabled": self.enabled,
+                "trigger": self.trigger}
+
+    @classmethod
+    def from_config(cls, name, entry):
+        return cls(name, [(start, end) for start, end in entry.get("ranges", [])], entry.get("enabled", True),
+                   entry.get("trigger"))
+
+
+class PatchGroupIndex(object):
+    """Interval index of patch groups.
+
+    Every patch belongs to the groups whose ranges contain it, or to the default group if there are none. A patch is
+    applied if any of its groups is enabled. The applied ranges are kept as a sorted, disjoint list, so a write plan
+    only ever slices the patch store once per range.
+    """
+    def __init__(self):
+        self.groups = {DAP_DEFAULT_GROUP: PatchGroup(DAP_DEFAULT_GROUP)}
+        self._enabled_ranges = None
+
+    def __len__(self):
+        return len(self.groups)
+
+    def __contains__(self, name):
+        return name in self.groups
+
+    def get(self, name):
+        return self.groups.get(name)
+
+    def names(self):
+        """Returns the group names, with the default group first."""
+        return [DAP_DEFAULT_GROUP] + sorted(name for name in self.groups if name != DAP_DEFAULT_GROUP)
+
+    def add_range(self, name, start, end):
+        """Adds an RVA range to a group, creating the group (enabled) if it does not exist yet."""
+        if name == DAP_DEFAULT_GROUP:
+            raise ValueError("The default group holds every patch outside other groups, it cannot be given ranges.")
+        group = self.groups.get(name)
+        if group is None:
+            group = self.groups[name] = PatchGroup(name)
+        group.ranges = merge_ranges(group.ranges + [(start, end)])
+        self._enabled_ranges = None
+        return group
+
+    def set_enabled(self, name, enabled):
+        self.groups[name].enabled = enabled
+        self._enabled_ranges = None
+
+    def set_trigger(self, name, trigger):
+        self.groups[name].trigger = trigger
+
+    def triggers(self):
+        """Returns the trigger RVAs of the enabled groups, excluding process start."""
+        return set(trigger for trigger in (group.trigger for group in self.groups.values() if group.enabled)
+                   if trigger is not None)
+
+    def grouped_ranges(self):
+        """Returns the sorted, disjoint ranges covered by any group other than the default group."""
+        return merge_ranges(r for name, group in self.groups.items() if name != DAP_DEFAULT_GROUP
+                            for r in group.ranges)
+
+    def enabled_ranges(self, triggers=None):
+        """Returns the sorted, disjoint RVA ranges whose patches are applied: the ranges of enabled groups, plus
+        everything outside any group while the default group is enabled.
+
+        Args:
+            triggers (set): Only include groups whose trigger is in this set (None standing for process start), or
+                None for every enabled group.
+        """
+        if triggers is None and self._enabled_ranges is not None:
+            return self._enabled_ranges
+        ranges = []
+        for name, group in self.groups.items():
+            if not group.enabled or (triggers is not None and group.trigger not in triggers):
+                continue
+            if name == DAP_DEFAULT_GROUP:
+                ranges.extend(subtract_ranges([(0, DAP_ADDR_MASK + 1)], self.grouped_ranges()))
+            else:
+                ranges.extend(group.ranges)
+        ranges = merge_ranges(ranges)
+        if triggers is None:
+            self._enabled_ranges = ranges
+        return ranges
+
+    def find_overlaps(self, name=None):
+        """Finds the ranges shared by two groups with a single sort and sweep, in O(n log n + k) for n ranges and
+        k overlaps, rather than comparing every pair of groups.
+
+        Args:
+            name (str): Only report overlaps involving this group, or None for all of them.
+
+        Returns:
+            list: (group name, other group name, start, end) for each overlap, sorted by start.
+        """
+        intervals = sorted((start, end, group_name) for group_name, group in self.groups.items()
+                           for start, end in group.ranges)
+        # Heap of (end, group name) for the intervals overlapping the sweep position
+        active = []
+        overlaps = []
+        for start, end, group_name in intervals:
+            while active and active[0][0] <= start:
+                heapq.heappop(active)
+            for other_end, other_name in active:
+                if name is None or name in (group_name, other_name):
+                    overlaps.append((other_name, group_name, start, min(end, other_end)))
+            heapq.heappush(active, (end, group_name))
+        return overlaps
+
+    def to_config(self):
+        return dict((name, group.to_config()) for name, group in self.groups.items())
+
+    @classmethod
+    def from_config(cls, entries):
+        index = cls()
+        for name, entry in (entries or {}).items():
+            index.groups[name] = PatchGroup.from_config(name, entry)
+        if DAP_DEFAULT_GROUP in index.groups:
+            index.groups[DAP_DEFAULT_GROUP].ranges = []
+        return index
+#  ---------------------------------------------------------------------------------------------
+
+
+#  --------------------------------------- Patch Journal ---------------------------------------
+class JournalSnapshot(object):
+    """Named, immutable snapshot of a patch set in a PatchJournal.
+
+    The patches are split into chunks of one page of RVAs each. Chunks are shared between snapshots wherever their
+    patches are unchanged, so two snapshots can be compared chunk by chunk by identity, and only the chunks which
+    differ need to be compared byte by byte.
+    """
+    def __init__(self, name, index, timestamp, chunks):
+        """
+        Args:
+            name (str): Name of the snapshot.
+            index (int): Position of the snapshot in the journal.
+            timestamp (float): Time the snapshot was recorded.
+            chunks (dict): Maps page number to a finalized PatchStore holding the page's patches.
+        """
+        self.name = name
+        self.index = index
+        self.timestamp = timestamp
+        self.chunks = chunks
+
+    def __len__(self):
+        return sum(len(chunk) for chunk in self.chunks.values())
+
+    def store(self):
+        """Returns the snapshot's patches as a single PatchStore."""
+        return join_chunks(self.chunks)
+
+
+def split_chunks(store, interned=None):
+    """Splits a patch store into chunks of one page of RVAs each.
+
+    Args:
+        store (PatchStore): Finalized patch store.
+        interned (dict): Optional map of chunk digest to an existing chunk. Chunks with the same patches as an
+            existing one are replaced by it, so unchanged chunks are shared.
+
+    Returns:
+        dict: Maps page number to a PatchStore.
+    """
+    chunks = {}
+    addrs = store.addrs
+    lo = 0
+    while lo < len(addrs):
+        page = addrs[lo] // DAP_PAGE_SIZE
+        hi = bisect_left(addrs, (page + 1) * DAP_PAGE_SIZE, lo)
+        chunk = PatchStore()
+        chunk.extend_from(store, lo, hi)
+        if interned is not None:
+            chunk = interned.get(chunk_digest(chunk), chunk)
+        chunks[page] = chunk
+        lo = hi
+    return chunks
+
+
+def join_chunks(chunks):
+    """Concatenates chunks from split_chunks() back into a single PatchStore."""
+    store = PatchStore()
+    for page in sorted(chunks):
+        chunk = chunks[page]
+        store.extend_from(chunk, 0, len(chunk))
+    return store
+
+
+def chunk_digest(chunk):
+    """Returns a digest identifying the patches of a chunk."""
+    digest = hashlib.md5()
+    digest.update(_array_buffer(chunk.addrs))
+    digest.update(_array_buffer(chunk.fpos))
+    digest.update(chunk.orig)
+    digest.update(chunk.patched)
+    return digest.digest()
+
+
+def diff_chunks(current, target):
+    """Computes the patches to apply and revert to go from one chunked patch set to another. Chunks shared by both
+    are skipped by identity, so the cost scales with the number of changed chunks, not the size of the patch sets.
+
+    Args:
+        current (dict): Chunks of the patch set in place, see split_chunks().
+        target (dict): Chunks of the patch set to switch to.
+
+    Returns:
+        tuple: (PatchStore of new or changed patches, as in target, PatchStore of patches to revert, as in current)
+    """
+    applied = PatchStore()
+    reverted = PatchStore()
+    for page in sorted(set(current) | set(target)):
+        old, new = current.get(page), target.get(page)
+        if old is new:
+            continue
+        if old is None:
+            applied.extend_from(new, 0, len(new))
+        elif new is None:
+            reverted.extend_from(old, 0, len(old))
+        elif old != new:
+            i = j = 0
+            while i < len(old) or j < len(new):
+                if j >= len(new) or (i < len(old) and old.addrs[i] < new.addrs[j]):
+                    reverted.append(old.addrs[i], old.fpos[i], old.orig[i], old.patched[i])
+                    i += 1
+                elif i >= len(old) or new.addrs[j] < old.addrs[i]:
+                    applied.append(new.addrs[j], new.fpos[j], new.orig[j], new.patched[j])
+                    j += 1
+                else:
+                    if old.patched[i] != new.patched[j]:
+                        applied.append(new.addrs[j], new.fpos[j], new.orig[j], new.patched[j])
+                    i += 1
+                    j += 1
+    return applied, reverted
+
+
+class PatchJournal(object):
+    """Append-only history of named patch set snapshots for one database, stored next to the configuration file.
+
+    Saving a snapshot under an existing name adds a new snapshot rather than replacing the old one. Chunks are
+    written once and referenced by every snapshot sharing them, so the journal grows with the changes between
+    snapshots rather than their size. A record cut short by an interrupted write is dropped when loading.
+    """
+    MAGIC = b"DAPJ"
+    FORMAT_VERSION = 1
+    # magic, format version, address item size, fpos item size, journal key
+    HEADER = struct.Struct("<4sIBBxx16s")
+    # record type, chunk id, patched byte count -- followed by the chunk's arrays
+    CHUNK = struct.Struct("<BIQ")
+    # record type, timestamp, name length, chunk count -- followed by the name and the chunk ids
+    SNAPSHOT = struct.Struct("<BdHI")
+    CHUNK_RECORD = 1
+    SNAPSHOT_RECORD = 2
+
+    def __init__(self, directory, input_md5, idb_path):
+        """
+        Args:
+            directory (str): Directory to store the journal file in.
+            input_md5 (bytes): Hash of the input file.
+            idb_path (str): Path of the database, identifying it among databases of the same input file.
+        """
+        key = database_key(input_md5, idb_path)
+        self.key = key.digest()
+        self.path = os.path.join(directory, "DebugAutoPatch_{}.journal".format(key.hexdigest()[:16]))
+        self.snapshots = []
+        self.chunks = []
+        # Chunk digest -> chunk, and id(chunk) -> chunk id, for every chunk in the journal
+        self.interned = {}
+        self._chunk_ids = {}
+        # Size of the file up to its last complete record
+        self._valid_size = 0
+
+    def __len__(self):
+        return len(self.snapshots)
+
+    def get(self, name):
+        """Returns the latest snapshot with a name, or None."""
+        for snapshot in reversed(self.snapshots):
+            if snapshot.name == name:
+                return snapshot
+        return None
+
+    def names(self):
+        """Returns the snapshot names, most recently saved first."""
+        names = []
+        for snapshot in reversed(self.snapshots):
+            if snapshot.name not in names:
+                names.append(snapshot.name)
+        return names
+
+    def split(self, store):
+        """Splits a patch store into chunks, sharing the chunks already in the journal, see split_chunks()."""
+        return split_chunks(store, self.interned)
+
+    def record(self, name, chunks, timestamp=None):
+        """Appends a snapshot to the journal, writing only the chunks not already in it.
+
+        Args:
+            name (str): Name of the snapshot.
+            chunks (dict): Chunks of the patch set, see split().
+            timestamp (float): Time of the snapshot, or None for now.
+
+        Returns:
+            JournalSnapshot: The new snapshot.
+        """
+        new_chunks = [chunks[page] for page in sorted(chunks) if id(chunks[page]) not in self._chunk_ids]
+        snapshot = JournalSnapshot(name, len(self.snapshots), time.time() if timestamp is None else timestamp, chunks)
+        # Written first, so the journal is left as it was if the write fails
+        self._append(new_chunks, snapshot)
+        for chunk in new_chunks:
+            self._add_chunk(chunk)
+        self.snapshots.append(snapshot)
+        return snapshot
+
+    def load(self):
+        """Loads the journal file, if any.
+
+        Returns:
+            PatchJournal: self
+        """
+        if not os.path.isfile(self.path):
+            return self
+        with open(self.path, "rb") as f:
+            data = f.read()
+        store = PatchStore()
+        addr_size, fpos_size = store.addrs.itemsize, store.fpos.itemsize
+        try:
+            magic, fmt, file_addr_size, file_fpos_size, key = self.HEADER.unpack_from(data, 0)
+        except struct.error:
+            return self
+        if (magic != self.MAGIC or fmt != self.FORMAT_VERSION or key != self.key or
+                file_addr_size != addr_size or file_fpos_size != fpos_size):
+            dap_warn("Ignoring incompatible patch journal: {}".format(self.path))
+            return self
+        offset = self._valid_size = self.HEADER.size
+        try:
+            while offset < len(data):
+                kind = struct.unpack_from("<B", data, offset)[0]
+                if kind == self.CHUNK_RECORD:
+                    _, chunk_id, count = self.CHUNK.unpack_from(data, offset)
+                    offset += self.CHUNK.size
+                    end = offset + count * (addr_size + fpos_size + 2)
+                    if end > len(data) or chunk_id != len(self.chunks):
+                        break
+                    chunk = PatchStore()
+                    _array_from_bytes(chunk.addrs, data[offset:offset + count * addr_size])
+                    offset += count * addr_size
+                    _array_from_bytes(chunk.fpos, data[offset:offset + count * fpos_size])
+                    offset += count * fpos_size
+                    chunk.orig = bytearray(data[offset:offset + count])
+                    chunk.patched = bytearray(data[offset + count:end])
+                    self._add_chunk(chunk)
+                elif kind == self.SNAPSHOT_RECORD:
+                    _, timestamp, name_size, count = self.SNAPSHOT.unpack_from(data, offset)
+                    offset += self.SNAPSHOT.size
+                    name = data[offset:offset + name_size].decode("utf-8")
+                    chunk_ids = struct.unpack_from("<{}I".format(count), data, offset + name_size)
+                    end = offset + name_size + 4 * count
+                    chunks = dict((self.chunks[i].addrs[0] // DAP_PAGE_SIZE, self.chunks[i]) for i in chunk_ids)
+                    self._add_snapshot(name, timestamp, chunks)
+                else:
+                    break
+                offset = self._valid_size = end
+        except (struct.error, IndexError, UnicodeDecodeError):
+            pass
+        if self._valid_size != len(data):
+            dap_warn("Dropped an incomplete record at the end of the patch journal.")
+        return self
+
+    def _add_chunk(self, chunk):
+        self._chunk_ids[id(chunk)] = len(self.chunks)
+        self.chunks.append(chunk)
+        self.interned[chunk_digest(chunk)] = chunk
+
+    def _add_snapshot(self, name, timestamp, chunks):
+        snapshot = JournalSnapshot(name, len(self.snapshots), timestamp, chunks)
+        self.snapshots.append(snapshot)
+        return snapshot
+
+    def _append(self, new_chunks, snapshot):
+        """Appends the records of a snapshot and its new chunks to the journal file, creating it if needed. The new
+        chunks are given the next chunk ids, in order."""
+        chunk_ids = dict((id(chunk), len(self.chunks) + i) for i, chunk in enumerate(new_chunks))
+        chunk_ids.update(self._chunk_ids)
+        store = PatchStore()
+        with open(self.path, "r+b" if self._valid_size else "wb") as f:
+            if not self._valid_size:
+                f.write(self.HEADER.pack(self.MAGIC, self.FORMAT_VERSION, store.addrs.itemsize, store.fpos.itemsize,
+                                         self.key))
+            else:
+                # Overwrite any incomplete record left by an interrupted write
+                f.seek(self._valid_size)
+                f.truncate()
+            for chunk in new_chunks:
+                f.write(self.CHUNK.pack(self.CHUNK_RECORD, chunk_ids[id(chunk)], len(chunk)))
+                chunk.addrs.tofile(f)
+                chunk.fpos.tofile(f)
+                f.write(chunk.orig)
+                f.write(chunk.patched)
+            name = snapshot.name.encode("utf-8")
+            ids = [chunk_ids[id(snapshot.chunks[page])] for page in sorted(snapshot.chunks)]
+            f.write(self.SNAPSHOT.pack(self.SNAPSHOT_RECORD, snapshot.timestamp, len(name), len(ids)))
+            f.write(name)
+            f.write(struct.pack("<{}I".format(len(ids)), *ids))
+            self._valid_size = f.tell()
+#  ---------------------------------------------------------------------------------------------
+
+
+#  -------------------------------------- Debugger Memory --------------------------------------
+class ModuleIndex(object):
+    """Index of the modules loaded in the debugged process, sorted by base address.
+
+    Modules are looked up by name to resolve a patch RVA to its live address, and by address with a binary search
+    to find the module containing a live address.
+    """
+    def __init__(self):
+        self.bases = []
+        self.modules = []  # (base, size, name), parallel to self.bases
+        self.by_name = {}
+
+    @staticmethod
+    def module_key(name):
+        """Returns the comparison key for a module path -- its lower-case file name, for both path styles."""
+        return re.split(r"[\\/]", name or "")[-1].lower()
+
+    @staticmethod
+    def is_library(name):
+        """Returns whether the named module is a library, which is loaded into a host process."""
+        key = ModuleIndex.module_key(name)
+        return key.endswith(DAP_LIBRARY_EXTENSIONS) or ".so." in key
+
+    def clear(self):
+        self.bases = []
+        self.modules = []
+        self.by_name = {}
+
+    def add(self, name, base, size):
+        self.remove(name)
+        i = bisect_right(self.bases, base)
+        self.bases.insert(i, base)
+        self.modules.insert(i, (base, size, name))
+        self.by_name[self.module_key(name)] = (base, size, name)
+
+    def remove(self, name):
+        """Removes a module, returning its (base, size, name), or None if it was not loaded."""
+        module = self.by_name.pop(self.module_key(name), None)
+        if module is not None:
+            i = self.modules.index(module)
+            del self.bases[i]
+            del self.modules[i]
+        return module
+
+    def base_of(self, name):
+        """Returns the live base address of the named module, or None if it is not loaded."""
+        module = self.by_name.get(self.module_key(name))
+        return module[0] if module is not None else None
+
+    def find(self, ea):
+        """Returns the (base, size, name) of the module containing ea, or None."""
+        i = bisect_right(self.bases, ea) - 1
+        if i >= 0:
+            base, size, name = self.modules[i]
+            if ea < base + size:
+                return self.modules[i]
+        return None
+
+    def __len__(self):
+        return len(self.modules)
+
+
+class MemoryMap(object):
+    """Memory regions of the debugged process, sorted by start address, as listed by the debugger.
+
+    An empty map means the layout is unknown (e.g. the debugger cannot list it), in which case every address is
+    assumed to be mapped and failed writes are left to the caller.
+    """
+    def __init__(self, regions=()):
+        """
+        Args:
+            regions (iterable): (start, end, perm) tuples.
+        """
+        self.regions = sorted(regions)
+        self.starts = [start for start, _, _ in self.regions]
+
+    @classmethod
+    def from_debugger(cls):
+        """Reads the memory layout of the debugged process. Costs a single debugger call."""
+        try:
+            info = idaapi.dbg_get_memory_info()
+        except:
+            info = None
+        if not info:
+            return cls()
+        # (start_ea, end_ea, name, sclass, sbase, bitness, perm)
+        return cls((region[0], region[1], region[6]) for region in info)
+
+    def __len__(self):
+        return len(self.regions)
+
+    def find(self, ea):
+        """Returns the (start, end, perm) of the region containing ea, or None."""
+        i = bisect_right(self.starts, ea) - 1
+        if i >= 0 and ea < self.regions[i][1]:
+            return self.regions[i]
+        return None
+
+    def covers(self, start, end):
+        """Returns whether [start, end) lies within a single region -- always, if the layout is unknown."""
+        if not self.regions:
+            return True
+        region = self.find(start)
+        return region is not None and end <= region[1]
+
+    def split(self, start, data):
+        """Splits a run at region boundaries.
+
+        Yields:
+            tuple: (start, bytearray, mapped) for each piece of the run.
+        """
+        if not self.regions:
+            yield start, data, True
+            return
+        end = start + len(data)
+        pos = start
+        while pos < end:
+            i = bisect_right(self.starts, pos) - 1
+            if i >= 0 and pos < self.regions[i][1]:
+                piece_end = min(end, self.regions[i][1])
+                mapped = True
+            else:
+                piece_end = min(end, self.starts[i + 1]) if i + 1 < len(self.starts) else end
+                mapped = False
+            if pos == start and piece_end == end:
+                yield start, data, mapped
+            else:
+                yield pos, data[pos - start:piece_end - start], mapped
+            pos = piece_end
+
+    def changed_ranges(self, previous):
+        """Returns the (start, end) ranges of regions which are new or have changed since a previous map."""
+        old = set(previous.regions)
+        return [(start, end) for start, end, perm in self.regions if (start, end, perm) not in old]
+
+
+class RunMap(object):
+    """Runs of bytes indexed by address, as (start, bytearray) tuples.
+
+    Runs are non-overlapping and kept sorted by start address, so the runs intersecting a range are found with a
+    binary search, without looking at the rest of the map.
+    """
+    def __init__(self):
+        self.starts = []
+        self.runs = []  # (start, bytearray), parallel to self.starts
+
+    def __len__(self):
+        return len(self.runs)
+
+    def clear(self):
+        self.starts = []
+        self.runs = []
+
+    def insert(self, start, data):
+        """Inserts a run, which must not overlap any run in the map."""
+        i = bisect_left(self.starts, start)
+        self.starts.insert(i, start)
+        self.runs.insert(i, (start, data))
+
+    def first_index(self, ea):
+        """Returns the index of the first run which ends after ea."""
+        i = bisect_right(self.starts, ea) - 1
+        if i < 0 or self.starts[i] + len(self.runs[i][1]) <= ea:
+            i += 1
+        return i
+
+    def index_range(self, start, end):
+        """Returns the (lo, hi) index range of the runs intersecting [start, end)."""
+        lo = self.first_index(start)
+        return lo, max(lo, bisect_left(self.starts, end))
+
+    def pieces(self, start, end):
+        """Yields (start, bytearray) for the parts of the runs within [start, end)."""
+        lo, hi = self.index_range(start, end)
+        for run_start, data in self.runs[lo:hi]:
+            piece_start, piece_end = max(start, run_start), min(end, run_start + len(data))
+            yield piece_start, data[piece_start - run_start:piece_end - run_start]
+
+
+class PendingPatchQueue(RunMap):
+    """Runs which could not be written because their addresses were not mapped yet, indexed by address."""
+    def __init__(self):
+        RunMap.__init__(self)
+        self.byte_count = 0
+
+    def clear(self):
+        RunMap.clear(self)
+        self.byte_count = 0
+
+    def add(self, start, data):
+        i = bisect_left(self.starts, start)
+        if i < len(self.starts) and self.starts[i] == start:
+            self.byte_count -= len(self.runs[i][1])
+            self.runs[i] = (start, data)
+        else:
+            self.starts.insert(i, start)
+            self.runs.insert(i, (start, data))
+        self.byte_count += len(data)
+
+    def take_range(self, start, end):
+        """Removes and returns the runs intersecting [start, end)."""
+        lo, hi = self.index_range(start, end)
+        taken = self.runs[lo:hi]
+        del self.starts[lo:hi]
+        del self.runs[lo:hi]
+        self.byte_count -= sum(len(data) for _, data in taken)
+        return taken
+
+
+class OriginalBytesMap(RunMap):
+    """Original bytes read from process memory before they were first patched, indexed by address.
+
+    Only bytes which were not captured yet are added, so bytes read back after they were patched (e.g. by a later
+    write within an already patched run) never replace the originals captured for them.
+    """
+    def add(self, start, data):
+        """Adds captured bytes, which must not overlap any captured already, see gaps()."""
+        self.insert(start, data)
+
+    def gaps(self, start, end):
+        """Returns the (start, end) ranges within [start, end) whose bytes were not captured."""
+        gaps = []
+        pos = start
+        for piece_start, piece in self.pieces(start, end):
+            if piece_start > pos:
+                gaps.append((pos, piece_start))
+            pos = piece_start + len(piece)
+        if pos < end:
+            gaps.append((pos, end))
+        return gaps
+
+    def overlay(self, runs):
+        """Returns runs with their bytes replaced by the captured ones, wherever they were captured.
+
+        Args:
+            runs (list): (start, bytes) runs, e.g. of the database's original bytes.
+        """
+        result = []
+        for start, data in runs:
+            replaced = None
+            for piece_start, captured in self.pieces(start, start + len(data)):
+                if replaced is None:
+                    replaced = bytearray(data)
+                replaced[piece_start - start:piece_start - start + len(captured)] = captured
+            result.append((start, data if replaced is None else replaced))
+        return result
+
+    def revert_runs(self, fallback):
+        """Returns the runs restoring every captured byte, plus the bytes of the fallback runs which were not
+        captured, sorted by address.
+
+        Args:
+            fallback (list): (start, bytes) runs to use where nothing was captured, e.g. the database's originals.
+        """
+        runs = list(self.runs)
+        for start, data in fallback:
+            for gap_start, gap_end in self.gaps(start, start + len(data)):
+                runs.append((gap_start, data[gap_start - start:gap_end - start]))
+        runs.sort(key=lambda run: run[0])
+        return runs
+
+
+class PatchWatchList(RunMap):
+    """Runs written to the debugged process, checked by the integrity watchdog for being overwritten.
+
+    Pages which are likely to have been overwritten (e.g. recently written, or remapped) are marked dirty and checked
+    first, the rest are checked round-robin from where the previous check stopped, so each check reads a bounded
+    number of bytes however many patches there are.
+    """
+    def __init__(self):
+        RunMap.__init__(self)
+        self.dirty = set()
+        # Address the next round-robin check starts from
+        self.cursor = 0
+
+    def clear(self):
+        RunMap.clear(self)
+        self.dirty = set()
+        self.cursor = 0
+
+    def add(self, start, data):
+        """Watches a written run, replacing any watched bytes it overlaps. Its pages are marked dirty."""
+        self.remove_range(start, start + len(data))
+        self.insert(start, data)
+        self.mark_dirty(start, start + len(data))
+
+    def remove_range(self, start, end):
+        """Stops watching the bytes within [start, end), e.g. once they are reverted."""
+        lo, hi = self.index_range(start, end)
+        if lo >= hi:
+            return
+        kept = []
+        for run_start, data in self.runs[lo:hi]:
+            if run_start < start:
+                kept.append((run_start, data[:start - run_start]))
+            if run_start + len(data) > end:
+                kept.append((end, data[end - run_start:]))
+        self.starts[lo:hi] = [run_start for run_start, _ in kept]
+        self.runs[lo:hi] = kept
+
+    def mark_dirty(self, start, end):
+        """Marks the pages of watched runs within [start, end) to be checked first."""
+        for piece_start, piece in self.pieces(start, end):
+            first = piece_start // DAP_PAGE_SIZE
+            last = (piece_start + len(piece) - 1) // DAP_PAGE_SIZE
+            self.dirty.update(range(first, last + 1))
+
+    def select(self, budget):
+        """Returns the (start, bytearray) pieces to check next, reading at most about budget bytes: the watched bytes
+        on dirty pages first, then the next watched bytes round-robin. Dirty pages are unmarked once selected."""
+        selected = []
+        used = 0
+        for page in sorted(self.dirty):
+            if used >= budget:
+                break
+            self.dirty.discard(page)
+            for piece in self.pieces(page * DAP_PAGE_SIZE, (page + 1) * DAP_PAGE_SIZE):
+                selected.append(piece)
+                used += len(piece[1])
+        first = self.cursor
+        wrapped = False
+        while used < budget and self.runs:
+            i = self.first_index(self.cursor)
+            if i >= len(self.runs):
+                if wrapped:
+                    break
+                wrapped = True
+                self.cursor = 0
+                continue
+            run_start, data = self.runs[i]
+            lo = max(self.cursor, run_start)
+            if wrapped and lo >= first:
+                # Every watched byte was selected
+                break
+            hi = min(run_start + len(data), lo + budget - used)
+            if wrapped:
+                hi = min(hi, first)
+            selected.append((lo, data[lo - run_start:hi - run_start]))
+            used += hi - lo
+            self.cursor = hi
+        return selected
+#  ---------------------------------------------------------------------------------------------
+
+
+#  --------------------------------------- Write Planning --------------------------------------
+class WritePlan(object):
+    """Coalesced set of contiguous byte runs to be written to debugger memory.
+
+    Each run is a (start address, bytearray) tuple, so an entire run can be written with a single
+    debugger memory write, rather than one per byte. Runs are further grouped by the memory pages
+    they touch, so runs sharing pages cost a single memory cache invalidation between them.
+    """
+    def __init__(self, runs=None, page_size=DAP_PAGE_SIZE):
+        """
+        Args:
+            runs (list): List of (start address, bytearray) tuples, sorted by address.
+            page_size (int): Memory page size, a power of two.
+        """
+        self.runs = runs if runs is not None else []
+        self.page_size = page_size
+        self._page_groups = None
+        self._batches = None
+
+    @classmethod
+    def from_store(cls, store, lo=0, hi=None, base=0, original=False):
+        """Merges adjacent patched bytes of a PatchStore into contiguous runs.
+
+        Args:
+            store (PatchStore): Finalized patch store.
+            lo (int): First store index to include.
+            hi (int): One past the last store index to include, or None for the end of the store.
+            base (int): Base address added to each run's start, to rebase RVAs to live addresses.
+            original (bool): Plan the original bytes rather than the patched ones, to revert the patches.
+        """
+        values = store.orig if original else store.patched
+        return cls([((start + base) & DAP_ADDR_MASK, values[a:b]) for start, a, b in store.iter_runs(lo, hi)])
+
+    @classmethod
+    def from_store_ranges(cls, store, ranges, base=0, original=False):
+        """Like from_store(), for the patched bytes within a set of address ranges only. Each range costs two
+        bisections of the store, however many patches lie outside of them.
+
+        Args:
+            ranges (list): Sorted, disjoint (start, end) ranges of store addresses.
+        """
+        values = store.orig if original else store.patched
+        runs = []
+        for range_start, range_end in ranges:
+            lo, hi = store.index_range(range_start, range_end)
+            runs.extend(((start + base) & DAP_ADDR_MASK, values[a:b]) for start, a, b in store.iter_runs(lo, hi))
+        return cls(runs)
+
+    @property
+    def run_count(self):
+        return len(self.runs)
+
+    @property
+    def byte_count(self):
+        return sum(len(data) for _, data in self.runs)
+
+    @property
+    def page_groups(self):
+        """Runs grouped by the pages they touch.
+
+        Returns:
+            list: [page start, page end, runs] for each span of pages touched by one or more runs, sorted by address.
+        """
+        if self._page_groups is None:
+            mask = ~(self.page_size - 1)
+            groups = []
+            for start, data in self.runs:
+                first = start & mask
+                last = (start + len(data) + self.page_size - 1) & mask
+                if groups and first < groups[-1][1]:
+                    # Shares a page with the previous group
+                    groups[-1][1] = max(groups[-1][1], last)
+                    groups[-1][2].append((start, data))
+                else:
+                    groups.append([first, last, [(start, data)]])
+            self._page_groups = groups
+        return self._page_groups
+
+    def batches(self, max_bytes=DAP_WRITE_BATCH_SIZE):
+        """Page groups split into batches of at most max_bytes bytes each, so the plan can be executed in bounded
+        steps. A page group larger than max_bytes is a batch of its own.
+
+        Returns:
+            list: Lists of page groups, see page_groups.
+        """
+        if self._batches is None or self._batches[0] != max_bytes:
+            batches = []
+            size = max_bytes
+            for group in self.page_groups:
+                group_size = sum(len(data) for _, data in group[2])
+                if size + group_size > max_bytes:
+                    batches.append([])
+                    size = 0
+                batches[-1].append(group)
+                size += group_size
+            self._batches = (max_bytes, batches)
+        return self._batches[1]
+
+    @property
+    def page_count(self):
+        """Number of memory pages touched by the plan."""
+        return sum((end - start) // self.page_size for start, end, _ in self.page_groups)
+
+    @property
+    def saved_round_trips(self):
+        """Debugger round-trips saved versus one write and one invalidation per byte."""
+        return 2 * self.byte_count - (self.run_count + len(self.page_groups))
+
+    def __len__(self):
+        return len(self.runs)
+
+    def __iter__(self):
+        return iter(self.runs)
+
+
+def find_mismatched_ranges(start, expected, actual, leaf_size=64):
+    """Finds the ranges where a run read back from memory differs from the expected bytes.
+
+    Matching runs cost a single bytes comparison. Mismatching runs are narrowed down by comparing halves, so only
+    small leaves around the actual differences are compared byte by byte.
+
+    Args:
+        start (int): Address of the run.
+        expected (bytearray): Bytes which were written.
+        actual (bytes): Bytes read back, or None if the run could not be read.
+        leaf_size (int): Size at which to stop halving and compare byte by byte.
+
+    Returns:
+        list: Mismatched (start, end) address ranges, sorted and merged.
+    """
+    if actual is None or len(actual) != len(expected):
+        return [(start, start + len(expected))]
+    expected = memoryview(expected)
+    actual = memoryview(actual)
+    if expected == actual:
+        return []
+
+    ranges = []
+    pending = [(0, len(expected))]
+    while pending:
+        lo, hi = pending.pop()
+        if expected[lo:hi] == actual[lo:hi]:
+            continue
+        if hi - lo > leaf_size:
+            mid = (lo + hi) // 2
+            # Pushed in reverse, so ranges are found in ascending order
+            pending.append((mid, hi))
+            pending.append((lo, mid))
+            continue
+        for i in range(lo, hi):
+            if expected[i] != actual[i]:
+                if ranges and ranges[-1][1] == start + i:
+                    ranges[-1] = (ranges[-1][0], start + i + 1)
+                else:
+                    ranges.append((start + i, start + i + 1))
+    return ranges
+#  ---------------------------------------------------------------------------------------------
+
+
+class DapCfg:
+    def __init__(self):
+        pass
+
+    Enabled = "enabled"
+    PrimaryPatchAddr = "primary_patch_addr"
+    MonitorMode = "monitor_mode"
+    PatchCache = "patch_cache"
+    Stats = "stats"
+    StatsDump = "stats_dump"
+    Verify = "verify"
+    CaptureOriginals = "capture_originals"
+    Watchdog = "watchdog"
+    WatchdogBudget = "watchdog_budget"
+    Groups = "groups"
+    TriggerBreakpoints = "trigger_breakpoints"
+    LogLevel = "log_level"
+    LogFile = "log_file"
+
+
+class DapMonitorMode:
+    def __init__(self):
+        pass
+
+    # Track patches incrementally from database change notifications
+    Events = "events"
+    # Rescan the entire "Patched bytes" database on every monitor cycle
+    Polling = "polling"
+
+
+# About form
+class DAPAboutForm(idaapi.Form):
+    def __init__(self):
+        # create About form
+        super(DAPAboutForm, self).__init__(
+            r"""STARTITEM 0
+BUTTON YES* Open DebugAutoPatch Website
+DebugAutoPatch - About
+
+           {FormChangeCb}
+           DebugAutoPatch IDA plugin v%s.
+           (c) Scott Mudge, 2019.
+
+           DebugAutoPatch is released under the GPL v3.
+           Find more info at %s
+           """ % (DAP_VERSION, DAP_WEBSITE), {
+                'FormChangeCb': self.FormChangeCb(self.OnFormChange),
+            })
+
+        self.Compile()
+
+    # callback to be executed when any form control changed
+    @staticmethod
+    def OnFormChange(fid):
+        if fid == -2:  # Goto homepage
+            import webbrowser
+            # open Keypatch homepage in a new tab, if possible
+            webbrowser.open(DAP_WEBSITE, new=2)
+
+        return 1
+
+
+# Create menu handlers for IDA >= 700
+try:
+    # noinspection PyBroadException
+    class DapMenuContext(idaapi.action_handler_t):
+        label = None
+
+        @classmethod
+        def get_name(self):
+            return self.__name__
+
+        @classmethod
+        def get_label(self):
+            return self.label
+
+        @classmethod
+        def register(self, plugin, label):
+            self.plugin = plugin
+            self.label = label
+            instance = self()
+            return idaapi.register_action(idaapi.action_desc_t(
+                self.get_name(),  # Name. Acts as an ID. Must be unique.
+                instance.get_label(),  # Label. That's what users see.
+                instance  # Handler. Called when activated, and for updating
+            ))
+
+        @classmethod
+        def unregister(self):
+            """Unregister the action.
+            After unregistering the class cannot be used.
+            """
+            idaapi.unregister_action(self.get_name())
+
+        @classmethod
+        def activate(self, ctx):
+            # dummy method
+            return 1
+
+        @classmethod
+        def update(self, ctx):
+            try:
+                if ctx.form_type == idaapi.BWN_DISASM:
+                    return idaapi.AST_ENABLE_FOR_FORM
+                else:
+                    return idaapi.AST_DISABLE_FOR_FORM
+            except:
+                # Add exception for main menu on >= IDA 7.0
+                return idaapi.AST_ENABLE_ALWAYS
+
+
+    class DapMCEnable(DapMenuContext):
+        def activate(self, ctx):
+            self.plugin.enable_patching()
+            return 1
+
+
+    class DapMCDisable(DapMenuContext):
+        def activate(self, ctx):
+            self.plugin.disable_patching()
+            return 1
+
+
+    class DapMCCheckUpdate(DapMenuContext):
+        def activate(self, ctx):
+            self.plugin.check_update()
+            return 1
+
+
+    class DapMCAbout(DapMenuContext):
+        def activate(self, ctx):
+            self.plugin.about()
+            return 1
+
+
+    class DapMCApplyPatch(DapMenuContext):
+        def activate(self, ctx):
+            self.plugin.apply_patch_to_memory()
+            return 1
+
+
+    class DapMCApplyPatchesToProc(DapMenuContext):
+        def activate(self, ctx):
+            self.plugin.apply_patches_to_current_proc()
+            return 1
+
+
+    class DapMCVerifyPatches(DapMenuContext):
+        def activate(self, ctx):
+            self.plugin.verify_patches_in_current_proc()
+            return 1
+
+
+    class DapMCExportPatches(DapMenuContext):
+        def activate(self, ctx):
+            self.plugin.export_patches()
+            return 1
+
+
+    class DapMCImportPatches(DapMenuContext):
+        def activate(self, ctx):
+            self.plugin.import_patches()
+            return 1
+
+
+    class DapMCClearImportedPatches(DapMenuContext):
+        def activate(self, ctx):
+            self.plugin.clear_imported_patches()
+            return 1
+
+
+    class DapMCExportPatchedBinary(DapMenuContext):
+        def activate(self, ctx):
+            self.plugin.export_patched_binary()
+            return 1
+
+
+    class DapMCCreatePatchGroup(DapMenuContext):
+        def activate(self, ctx):
+            self.plugin.create_patch_group()
+            return 1
+
+
+    class DapMCTogglePatchGroup(DapMenuContext):
+        def activate(self, ctx):
+            self.plugin.toggle_patch_group()
+            return 1
+
+
+    class DapMCTogglePatchGroupTrigger(DapMenuContext):
+        def activate(self, ctx):
+            self.plugin.toggle_patch_group_trigger()
+            return 1
+
+
+    class DapMCSavePatchVariant(DapMenuContext):
+        def activate(self, ctx):
+            self.plugin.save_patch_variant()
+            return 1
+
+
+    class DapMCSwitchPatchVariant(DapMenuContext):
+        def activate(self, ctx):
+            self.plugin.switch_patch_variant()
+            return 1
+
+
+    class DapMCNull(DapMenuContext):
+        def activate(self, ctx):
+            self.plugin.menu_null()
+            return 1
+
+
+    class DapMCNull2(DapMenuContext):
+        def activate(self, ctx):
+            self.plugin.menu_null()
+            return 1
+except:
+    pass
+
+
+class DebugAutoPatchPlugin(idaapi.plugin_t):
+    # This keeps the plugin in memory, important for hooking callbacks
+    flags = idaapi.PLUGIN_KEEP
+    comment = "Plugin for automatic byte patch injection - no binary-file patching needed!"
+    help = "See https://github.com/scottmudge/IDA_DebugAutoPatch/blob/master/readme.md"
+    wanted_name = "DebugAutoPatch"
+    wanted_hotkey = ""
+
+    def __del__(self):
+        self.term()
+
+    def __init__(self):
+        self.old_ida = False
+        self.cfg = None
+        self.debug_hook = None
+        # Latest published patch snapshot. Replaced (never modified) by writers, read without locking.
+        self.snapshot = PatchSnapshot(0, PatchStore())
+        # Patches from the "Patched bytes" database, and patches imported from patch set files, which are overlaid
+        # on them in the published snapshot
+        self.database_patches = PatchStore()
+        self.imported_patches = PatchStore()
+        # Named groups of patch ranges, which can be enabled and disabled separately
+        self.patch_groups = PatchGroupIndex()
+        # Triggers which fired in the current process (None for process start), the unfired ones keyed by live
+        # address, and the temporary breakpoints added for them
+        self.fired_triggers = set()
+        self.trigger_table = {}
+        self.trigger_bpts = set()
+        # Serializes writers only -- readers take self.snapshot directly
+        self.patched_bytes_db_lock = Lock()
+        # Snapshot version applied to each debugged process, and the write plan key it was applied with, keyed by
+        # PID. Plan keys are kept across a detach, so a re-attached process is not patched again.
+        self.applied_versions = {}
+        self.applied_plans = {}
+        # (snapshot version, write plans built for it keyed by write_plan_key()), replaced as a whole so the monitor
+        # thread and the debug hooks can share it, and the base each module was last patched at, keyed by module
+        # key -- the monitor thread prepares the next process start's plan there
+        self.plan_cache = (None, {})
+        self.module_bases = {}
+        # Modules loaded in the current debugged process
+        self.modules = ModuleIndex()
+        # Memory layout of the current debugged process, and patches waiting for their addresses to be mapped
+        self.memory_map = MemoryMap()
+        self.memory_map_time = 0.0
+        self.pending_patches = PendingPatchQueue()
+        # Runs written to the current debugged process, checked by the integrity watchdog
+        self.watch_list = PatchWatchList()
+        self.session_pid = None
+        # Set while the debugger is attached to a process which has not been patched in this session yet
+        self.session_attached = False
+        # Original bytes read from process memory before they were first patched
+        self.live_originals = OriginalBytesMap()
+        self.stats = DapStats()
+        self.monitor_thread = None
+        self.idb_hook = None
+        # Changed database bytes, keyed by address -- made relative to the image base by the monitor thread
+        self.pending_deltas = {}
+        self.pending_deltas_lock = Lock()
+        self.rescan_needed = True
+        # Number of patches skipped by the last visit of the "Patched bytes" database
+        self.skipped_patches = 0
+        self.patch_cache = None
+        self.cache_saved_version = 0
+        self.cache_saved_time = 0.0
+        # Journal of named patch variants, loaded on first use, with the active variant's name. The database's
+        # patches are kept split into journal chunks (of database_chunks_store) while they are unchanged, and
+        # idb_chunks holds the "Patched bytes" database's chunks while it lags behind a variant switched to during
+        # a debug session.
+        self.patch_journal = None
+        self.active_variant = None
+        self.database_chunks = None
+        self.database_chunks_store = None
+        self.idb_chunks = None
+        # Set while the plugin writes to the "Patched bytes" database itself
+        self.suppress_patch_events = False
+        # Background startup: set once the configuration, and then the patch buffer, can be used
+        self.startup_thread = None
+        self.startup_start = None
+        self.startup_times = {}
+        self.config_ready = Event()
+        self.patches_ready = Event()
+
+    class PatchVisitor(object):
+        """Used for visiting patched bytes when debugger is not active. These patches are then stored in a buffer,
+        and are applied when debugger activates."""
+        def __init__(self, base=0):
+            """
+            Args:
+                base (int): Image base of the database -- patches are stored relative to it.
+            """
+            self.skipped = 0
+            self.patched = 0
+            self.base = base
+            self.patched_bytes = PatchStore()
+
+        def __call__(self, ea, fpos, orig, patch_val, cnt=()):
+            try:
+                if fpos == -1:
+                    # Reported once per visit, see visit_patched_bytes()
+                    self.skipped += 1
+                else:
+                    self.patched += 1
+                    self.patched_bytes.append((ea - self.base) & DAP_ADDR_MASK, fpos, orig, patch_val)
+                return 0
+            except:
+                return
+
+    class DebugHook(idaapi.DBG_Hooks):
+        def __init__(self, *args):
+            super(DebugAutoPatchPlugin.DebugHook, self).__init__(*args)
+            self.steps = 0
+
+        def dbg_process_start(self, pid, tid, ea, name, base, size):
+            if not DAP_INSTANCE.wait_until_ready():
+                return
+            DAP_INSTANCE.begin_session(pid)
+            DAP_INSTANCE.on_module_load(pid, name, base, size, process_start=True)
+
+        def dbg_process_attach(self, pid, tid, ea, name, base, size):
+            if not DAP_INSTANCE.wait_until_ready():
+                return
+            DAP_INSTANCE.begin_session(pid, attached=True)
+            DAP_INSTANCE.on_module_load(pid, name, base, size, process_start=True)
+
+        def dbg_library_load(self, pid, tid, ea, name, base, size):
+            if not DAP_INSTANCE.wait_until_ready():
+                return
+            DAP_INSTANCE.on_module_load(pid, name, base, size)
+            DAP_INSTANCE.retry_pending_patches([(base, base + size)])
+            DAP_INSTANCE.check_patch_integrity("library load")
+
+        def dbg_thread_start(self, pid, tid, ea):
+            DAP_INSTANCE.check_memory_layout()
+
+        def dbg_suspend_process(self):
+            DAP_INSTANCE.check_memory_layout(throttle=True)
+            DAP_INSTANCE.check_patch_integrity("suspend")
+
+        def dbg_bpt(self, tid, ea):
+            # Checked first, as firing a trigger may resume the process
+            DAP_INSTANCE.check_patch_integrity("breakpoint", ea)
+            DAP_INSTANCE.fire_trigger(ea)
+            return 0
+
+        def dbg_run_to(self, pid, tid, ea):
+            DAP_INSTANCE.fire_trigger(ea, resume=False)
+
+        def dbg_step_into(self):
+            self.on_step()
+
+        def dbg_step_over(self):
+            self.on_step()
+
+        def dbg_step_until_ret(self):
+            self.on_step()
+
+        @staticmethod
+        def on_step():
+            if DAP_INSTANCE.trigger_table:
+                DAP_INSTANCE.fire_trigger(idaapi.get_ip_val(), resume=False)
+            if DAP_INSTANCE.watch_list:
+                DAP_INSTANCE.check_patch_integrity("step", idaapi.get_ip_val())
+
+        def dbg_library_unload(self, pid, tid, ea, info):
+            module = DAP_INSTANCE.modules.remove(info)
+            if module is not None:
+                DAP_INSTANCE.watch_list.remove_range(module[0], module[0] + module[1])
+
+        def dbg_process_exit(self, pid, tid, ea, exit_code):
+            # Patches made during the session are merged into "Patched bytes", so reconcile once it ends
+            DAP_INSTANCE.request_rescan()
+            DAP_INSTANCE.end_session(pid)
+            # The PID may be reused by another process, which was never patched
+            DAP_INSTANCE.applied_versions.pop(pid, None)
+            DAP_INSTANCE.applied_plans.pop(pid, None)
+
+        def dbg_process_detach(self, pid, tid, ea):
+            DAP_INSTANCE.request_rescan()
+            DAP_INSTANCE.end_session(pid)
+
+    class PatchEventHook(idaapi.IDB_Hooks):
+        """Receives byte patch and revert notifications from the database, so only changed bytes need to be
+        folded into the patch buffer rather than rescanning the whole database."""
+        def byte_patched(self, ea, *args):
+            DAP_INSTANCE.queue_patch_delta(ea)
+            return 0
+
+        def allsegs_moved(self, *args):
+            # Database was rebased -- RVAs are unchanged, but the image base needs refreshing
+            DAP_INSTANCE.request_rescan()
+            return 0
+
+    # Menu actions, in menu order: (action handler class, label, menu path or None if not attached, plugin method).
+    # Separators are shown as "-" on IDA < 7.0.
+    MENU_ACTIONS = (
+        ("DapMCNull", "_________________________", "Edit/Patch program/Null Menu", "menu_null"),
+        ("DapMCEnable", "Enable Auto-Patching", "Edit/Patch program/Enable Auto-Patching", "enable_patching"),
+        ("DapMCDisable", "Disable Auto-Patching", "Edit/Patch program/Disable Auto-Patching", "disable_patching"),
+        ("DapMCVerifyPatches", "Verify Patches in Current Process",
+         "Edit/Patch program/Verify Patches in Current Process", "verify_patches_in_current_proc"),
+        ("DapMCExportPatches", "Export Patch Set...", "Edit/Patch program/Export Patch Set...", "export_patches"),
+        ("DapMCImportPatches", "Import Patch Set...", "Edit/Patch program/Import Patch Set...", "import_patches"),
+        ("DapMCClearImportedPatches", "Clear Imported Patches", "Edit/Patch program/Clear Imported Patches",
+         "clear_imported_patches"),
+        ("DapMCExportPatchedBinary", "Create Patched Binary...", "Edit/Patch program/Create Patched Binary...",
+         "export_patched_binary"),
+        ("DapMCCreatePatchGroup", "Create Patch Group from Selection...",
+         "Edit/Patch program/Create Patch Group from Selection...", "create_patch_group"),
+        ("DapMCTogglePatchGroup", "Toggle Patch Group...", "Edit/Patch program/Toggle Patch Group...",
+         "toggle_patch_group"),
+        ("DapMCTogglePatchGroupTrigger", "Apply Patch Group at Cursor...",
+         "Edit/Patch program/Apply Patch Group at Cursor...", "toggle_patch_group_trigger"),
+        ("DapMCSavePatchVariant", "Save Patch Variant...", "Edit/Patch program/Save Patch Variant...",
+         "save_patch_variant"),
+        ("DapMCSwitchPatchVariant", "Switch Patch Variant...", "Edit/Patch program/Switch Patch Variant...",
+         "switch_patch_variant"),
+        ("DapMCApplyPatch", "Apply Patch to Memory", None, "apply_patch_to_memory"),
+        ("DapMCApplyPatchesToProc", "Apply Patches to Current Process", None, "apply_patches_to_current_proc"),
+        ("DapMCNull2", "_________________________", "Edit/Patch program/Null Menu 2", "menu_null"),
+        ("DapMCCheckUpdate", "Check for DebugAutoPatch Update", None, "check_update"),
+        ("DapMCAbout", "About DebugAutoPatch", "Edit/Patch program/About DebugAutoPatch", "about"),
+    )
+
+    def init(self):
+        """Initialization routine. Only what is needed to catch debugger events and show the menus is done while IDA
+        is loading the database. In fast start mode (DAP_FAST_START), the configuration and the patch buffer are
+        loaded in the background, and debugger events arriving before then wait for them."""
+        global DAP_INITIALIZED
+        start = dap_clock()
+
+        if idaapi.IDA_SDK_VERSION < 700:
+            self.old_ida = True
+
+        # Register the menu handlers shown in the menus now, and the others once IDA is idle
+        self.register_actions(attached=True)
+        if DAP_FAST_START:
+            self.defer_ui(lambda: self.register_actions(attached=False))
+        else:
+            self.register_actions(attached=False)
+
+        self.cfg = None
+
+        if not DAP_INITIALIZED:
+            DAP_INITIALIZED = True
+            self.attach_menus()
+
+            print("=" * 80)
+            print("DebugAutoPatch v{0} Copyright (c) Scott Mudge 2019".format(DAP_VERSION))
+            print("DebugAutoPatch is available from menu \"Edit > Patch program\"")
+            print("Find more information about DebugAutoPatch at the project github repository")
+
+            self.set_debug_hooks()
+            # Installed before the configuration is loaded, so patches made meanwhile are not missed. In polling
+            # mode, the monitor rescans the database anyway.
+            self.set_idb_hooks()
+
+            self.startup_start = start
+            if DAP_FAST_START:
+                self.startup_thread = Thread(target=self.deferred_init, name="DapStartup")
+                self.startup_thread.daemon = True
+                self.startup_thread.start()
+            else:
+                self.deferred_init()
+
+            self.startup_times["init_ms"] = (dap_clock() - start) * 1000.0
+            dap_msg("Plugin initialized in [{:.1f}] ms{}.".format(
+                self.startup_times["init_ms"],
+                " -- loading configuration and patches in the background" if DAP_FAST_START else ""))
+            print("=" * 80)
+        return idaapi.PLUGIN_KEEP
+
+    def deferred_init(self):
+        """Loads the configuration, patch groups and cached patch buffer, then starts the monitor thread, whose first
+        cycle reconciles the buffer against the database. Signals config_ready and patches_ready along the way."""
+        start = dap_clock()
+        try:
+            self.load_configuration()
+            self.load_patch_groups()
+        finally:
+            self.config_ready.set()
+
+        # Use the cached patch buffer right away -- the first monitor cycle reconciles it against the database
+        # in the background
+        if self.load_patch_cache():
+            self.set_patches_ready()
+
+        dap_msg("Starting patch monitoring thread...")
+        # Patch events wake the thread immediately, so it can back off while idle. Polling must keep polling.
+        self.monitor_thread = KillableThread(name="PatchMonitoring", target=self.patch_monitor_func,
+                                             sleep_interval=DAP_MONITOR_INTERVAL,
+                                             max_interval=None if self.is_polling() else DAP_MONITOR_MAX_INTERVAL)
+        self.monitor_thread.start()
+        self.startup_times["background_ms"] = (dap_clock() - start) * 1000.0
+
+    def set_patches_ready(self):
+        """Signals that the patch buffer can be used, recording how long after startup it became available."""
+        if self.patches_ready.is_set():
+            return
+        if self.startup_start is not None:
+            self.startup_times["patches_ready_ms"] = (dap_clock() - self.startup_start) * 1000.0
+            dap_msg("Patch buffer ready [{:.1f}] ms after startup.".format(self.startup_times["patches_ready_ms"]))
+        self.patches_ready.set()
+
+    def wait_until_ready(self, patches=True):
+        """Blocks a debugger event or menu action arriving during startup until the data it needs is loaded: the
+        configuration, and the patch buffer if patches is set. Returns immediately once it is. If no patch buffer
+        was published by the time startup is done, the database is scanned right away.
+
+        Returns:
+            bool: True if ready, False if startup did not finish within DAP_STARTUP_WAIT_TIMEOUT seconds.
+        """
+        event = self.patches_ready if patches else self.config_ready
+        if event.is_set():
+            return self.cfg is not None
+        if not patches and self.startup_thread is None:
+            # Startup was not deferred, so the configuration is either loaded already or never will be
+            return self.cfg is not None
+        start = dap_clock()
+        if patches:
+            # Without a cached patch buffer, it is only filled by the monitor thread's first scan, which does not
+            # run while debugging -- so once startup is done, scan here instead
+            if self.startup_thread is not None:
+                self.startup_thread.join(DAP_STARTUP_WAIT_TIMEOUT)
+            if (self.startup_thread is None or not self.startup_thread.is_alive()) and self.cfg is not None:
+                self.scan_patches_now()
+            ready = event.is_set()
+        else:
+            ready = event.wait(DAP_STARTUP_WAIT_TIMEOUT)
+        waited = (dap_clock() - start) * 1000.0
+        self.stats.add_time("startup.event_wait", waited / 1000.0)
+        if self.startup_thread is None:
+            # Nothing was waited for; the scan reports its own failures
+            pass
+        elif ready:
+            dap_msg("Waited [{:.1f}] ms for startup to finish.".format(waited))
+        else:
+            dap_warn("Startup did not finish within [{}] seconds -- continuing without it.".format(
+                DAP_STARTUP_WAIT_TIMEOUT))
+        return ready and self.cfg is not None
+
+    def scan_patches_now(self):
+        """Scans the "Patched bytes" database on the calling thread and publishes the patch buffer, for a debugger
+        event arriving before the monitor thread's first scan. Does nothing if the buffer is ready by then."""
+        with self.patched_bytes_db_lock:
+            if self.patches_ready.is_set():
+                return
+            module, link_base = self.get_database_module()
+            patches = self.visit_patched_bytes(link_base)
+            if patches is not None:
+                self.publish_patches(patches, module, link_base)
+                self.set_patches_ready()
+
+    def is_polling(self):
+        """Returns whether the monitor rescans the whole "Patched bytes" database on every cycle."""
+        return self.idb_hook is None or self.cfg[DapCfg.MonitorMode] == DapMonitorMode.Polling
+
+    def register_actions(self, attached):
+        """Registers the menu action handlers (IDA >= 7.0).
+
+        Args:
+            attached (bool): Register the actions attached to menus, or the others.
+        """
+        if self.old_ida:
+            return
+        for class_name, label, path, _ in self.MENU_ACTIONS:
+            if (path is not None) != attached:
+                continue
+            try:
+                globals()[class_name].register(self, label)
+            except:
+                pass
+
+    def attach_menus(self):
+        """Adds the menu items to "Edit > Patch program"."""
+        for class_name, label, path, method in self.MENU_ACTIONS:
+            if path is None:
+                continue
+            if not self.old_ida:
+                # Add menu IDA >= 7.0
+                idaapi.attach_action_to_menu(path, globals()[class_name].get_name(), idaapi.SETMENU_APP)
+            else:
+                # Older versions
+                idaapi.add_menu_item("Edit/Patch program/", "-" if class_name.startswith("DapMCNull") else label,
+                                     "", 1, getattr(self, method), None)
+
+    @staticmethod
+    def defer_ui(callback):
+        """Runs a callback on the UI thread once IDA is idle, or right away if timers are unavailable."""
+        def run_once():
+            callback()
+            # Unregisters the timer
+            return -1
+        try:
+            if idaapi.register_timer(0, run_once) is not None:
+                return
+        except:
+            pass
+        callback()
+
+    def patch_monitor_func(self):
+        """Monitors patches and caches patch DB, since IDA has separate DBs for debugged processes and non-debugged
+        processes. In event mode, only queued patch deltas are folded into the buffer, and a full rescan is only
+        done at startup or after a debug session ends.
+
+        Returns:
+            bool: True if the patch buffer changed, so the monitor thread should keep checking frequently.
+        """
+        # Don't collect patches if debugger is on
+        try:
+            if idaapi.is_debugger_on() or idaapi.is_debugger_busy():
+                self.stats.count("monitor.skipped_cycles")
+                return False
+
+            if self.idb_chunks is not None:
+                # A patch variant was switched to during the debug session -- bring the database up to date before
+                # it is rescanned
+                idaapi.execute_sync(self.sync_database_variant, idaapi.MFF_WRITE)
+
+            polling = self.is_polling()
+            if not polling and not self.rescan_needed and not self.pending_deltas:
+                self.stats.count("monitor.idle_cycles")
+                self.prepare_write_plan()
+                self.save_patch_cache()
+                return False
+
+            changed = False
+            if not self.patched_bytes_db_lock.acquire(False):
+                self.stats.count("monitor.skipped_cycles")
+                self.stats.count("patched_bytes_db_lock.contended")
+                return True
+            else:
+                try:
+                    module, link_base = self.get_database_module()
+                    with self.pending_deltas_lock:
+                        deltas = self.pending_deltas
+                        self.pending_deltas = {}
+                    if polling or self.rescan_needed:
+                        # Clear before scanning, so a request arriving mid-scan is not lost
+                        self.rescan_needed = False
+                        with self.stats.timer("monitor.rescan"):
+                            patches = self.visit_patched_bytes(link_base)
+                    else:
+                        with self.stats.timer("monitor.merge_deltas"):
+                            patches = self.database_patches.merged(dict(
+                                ((ea - link_base) & DAP_ADDR_MASK, delta) for ea, delta in deltas.items()))
+                        self.stats.count("monitor.deltas", len(deltas))
+                    if patches is not None:
+                        changed = self.publish_patches(patches, module, link_base)
+                        self.set_patches_ready()
+                finally:
+                    self.patched_bytes_db_lock.release()
+            self.prepare_write_plan()
+            self.save_patch_cache()
+            return changed
+        except:
+            return False
+
+    def prepare_write_plan(self):
+        """Builds the write plan for the next process start ahead of time, on the monitor thread, so the debug hook
+        only has to execute it: sorting, coalescing, rebasing, filtering by group and page grouping are all done
+        here. The plan is rebased to where the patched module was last loaded (or its base in the database), and
+        kept in the write plan cache, see build_write_plan(). Cheap when the plan is already prepared.
+
+        Returns:
+            WritePlan: The prepared plan, or None if there is nothing to apply.
+        """
+        snapshot = self.snapshot
+        if len(snapshot) < 1 or not self.cfg[DapCfg.Enabled]:
+            return None
+        base = self.module_bases.get(ModuleIndex.module_key(snapshot.module), snapshot.link_base)
+        ranges = self.patch_groups.enabled_ranges({None})
+        plan = self.plan_cache[1].get(self.write_plan_key(snapshot, base, ranges=ranges))
+        if plan is not None:
+            return plan
+        with self.stats.timer("monitor.prepare_plan"):
+            return self.build_write_plan(snapshot, base, ranges=ranges)
+
+    def publish_patches(self, database_patches, module, link_base):
+        """Publishes a new snapshot of the database's patches, with any imported patches overlaid on them. Must be
+        called with patched_bytes_db_lock held.
+
+        Returns:
+            bool: True if the published patches changed.
+        """
+        self.database_patches = database_patches
+        patches = database_patches.overlaid(self.imported_patches)
+        current = self.snapshot
+        if current.same_patches(patches, module, link_base):
+            return False
+        self.snapshot = PatchSnapshot(current.version + 1, patches, module, link_base)
+        dap_debug("Published patch snapshot version [{}] with [{}] patched bytes.", current.version + 1, len(patches))
+        if len(patches) > 0 and len(current) < 1:
+            dap_msg("Byte patch buffer populated!")
+        return True
+
+    def open_patch_cache(self):
+        """Creates the on-disk patch cache for the current database, or returns None if it cannot be identified."""
+        return self.open_database_file(PatchCache, "patch cache")
+
+    def open_database_file(self, file_class, description):
+        """Creates a per-database file object (e.g. PatchCache), or returns None if the database cannot be
+        identified.
+
+        Args:
+            file_class (type): Class taking (directory, input file hash, database path).
+            description (str): What the file holds, for the warning shown if the database cannot be identified.
+        """
+        try:
+            identity = self.get_database_identity()
+            if identity is None:
+                return None
+            return file_class(os.path.dirname(DAP_CONFIG_FILE_PATH), *identity)
+        except Exception as e:
+            dap_warn("Could not identify database -- {} disabled.".format(description), str(e))
+        return None
+
+    def get_database_identity(self):
+        """Returns the (input file hash, database path) identifying the current database, see database_key(), or
+        None if either is unknown."""
+        if not self.old_ida:
+            input_md5 = idaapi.retrieve_input_file_md5()
+            idb_path = idaapi.get_path(idaapi.PATH_TYPE_IDB)
+        else:
+            input_md5 = idc.GetInputMD5()
+            idb_path = idc.GetIdbPath()
+        if not input_md5 or not idb_path:
+            return None
+        return input_md5, idb_path
+
+    def load_patch_cache(self):
+        """Loads the cached patch buffer for this database, if any, and publishes it as the initial snapshot.
+
+        Returns:
+            bool: True if the cached patch buffer was loaded.
+        """
+        if not self.cfg[DapCfg.PatchCache]:
+            return False
+        self.patch_cache = self.open_patch_cache()
+        if self.patch_cache is None:
+            return False
+        start = time.time()
+        try:
+            store = self.patch_cache.load()
+        except Exception as e:
+            dap_warn("Failed to load patch cache.", str(e))
+            return False
+        if store is None:
+            return False
+        module, link_base = self.get_database_module()
+        self.database_patches = store
+        self.snapshot = PatchSnapshot(self.snapshot.version + 1, store, module, link_base)
+        self.cache_saved_version = self.snapshot.version
+        self.cache_saved_time = time.time()
+        dap_msg("Loaded [{}] cached patched bytes in [{:.1f}] ms.".format(len(store), (time.time() - start) * 1000.0))
+        return True
+
+    def save_patch_cache(self, force=False):
+        """Saves the database's patches to the on-disk cache if the patch snapshot has changed since the last save.
+        Imported patches are not cached, they only last for the session.
+
+        Args:
+            force (bool): Save now, even if the last save was less than DAP_CACHE_SAVE_INTERVAL seconds ago.
+        """
+        snapshot = self.snapshot
+        if self.patch_cache is None or snapshot.version == self.cache_saved_version:
+            return
+        if not force and time.time() - self.cache_saved_time < DAP_CACHE_SAVE_INTERVAL:
+            return
+        try:
+            self.patch_cache.save(self.database_patches)
+            self.cache_saved_version = snapshot.version
+            self.cache_saved_time = time.time()
+        except Exception as e:
+            dap_warn("Failed to save patch cache.", str(e), key="patch_cache_save")
+
+    def queue_patch_delta(self, ea):
+        """Queues a changed database byte to be folded into the patch buffer by the monitor thread."""
+        if self.suppress_patch_events:
+            return
+        if idaapi.is_debugger_on():
+            # Debugger memory edits land in the database too, these are reconciled once the session ends
+            self.rescan_needed = True
+            return
+        try:
+            orig = idaapi.get_original_byte(ea)
+            patched = idaapi.get_db_byte(ea)
+            fpos = idaapi.get_fileregion_offset(ea)
+        except:
+            self.request_rescan()
+            return
+        delta = None
+        if patched != orig and fpos != -1:
+            delta = (fpos, orig, patched)
+        # Made relative to the image base by the monitor thread, as no snapshot may be published yet to take it from
+        with self.pending_deltas_lock:
+            self.pending_deltas[ea] = delta
+        if self.monitor_thread:
+            self.monitor_thread.trigger()
+
+    def request_rescan(self):
+        """Requests a full rescan of the "Patched bytes" database on the next monitor cycle."""
+        self.rescan_needed = True
+        if self.monitor_thread:
+            self.monitor_thread.trigger()
+
+    def enable_patching(self):
+        """Enables automatic patching. If a process is being debugged, its patches are re-applied right away."""
+        if not self.wait_until_ready(patches=False):
+            return
+        self.cfg[DapCfg.Enabled] = True
+        dap_msg("Automatic patching enabled.")
+        if idaapi.is_debugger_on() and self.session_pid not in self.applied_versions:
+            self.apply_patches_to_current_proc(self.session_pid)
+
+    def disable_patching(self):
+        """Disables automatic patching. If a process is being debugged, its patches are reverted right away."""
+        if not self.wait_until_ready(patches=False):
+            return
+        self.cfg[DapCfg.Enabled] = False
+        dap_msg("Automatic patching disabled.")
+        if idaapi.is_debugger_on() and self.session_pid in self.applied_versions:
+            self.revert_patches_in_current_proc()
+
+    def apply_patch_to_memory(self):
+        """Adds a new patch to database."""
+        # TODO -- Implement
+        pass
+
+    def apply_patches_to_current_proc(self, pid=None, base=None):
+        """Applies patches to current process. Must first suspend process, check debugger is not active, then
+        apply them.
+
+        Args:
+            pid (int): PID of the debugged process, if known. Used to record which snapshot version it received.
+            base (int): Live base address of the patched module, or None to look it up in the module index.
+        """
+        if not self.wait_until_ready():
+            return
+        if not self.cfg[DapCfg.Enabled]:
+            dap_msg("Not applying patches to current process - patching currently disabled.")
+            return
+
+        total_applied = 0
+        phases = self.stats.new_phases()
+        with self.stats.timer("apply.total", phases):
+            with self.stats.timer("apply.suspend", phases):
+                suspended = idaapi.suspend_process()
+            if suspended:
+                # Take the latest published snapshot -- this never waits on the monitor thread
+                with self.stats.timer("apply.snapshot", phases):
+                    snapshot = self.snapshot
+                try:
+                    self.fired_triggers.add(None)
+                    if len(snapshot) < 1:
+                        dap_msg("No patched bytes currently in database, nothing to do!")
+                    else:
+                        if base is None:
+                            base = self.resolve_module_base(snapshot)
+                        self.module_bases[ModuleIndex.module_key(snapshot.module)] = base
+                        with self.stats.timer("apply.plan", phases):
+                            plan = self.build_write_plan(snapshot, base)
+                        if self.is_process_patched(pid, snapshot, base, plan):
+                            dap_msg("Process [{}] already has patch snapshot version [{}] applied -- "
+                                    "not patching it again.".format(pid, snapshot.version))
+                            if self.cfg[DapCfg.Watchdog]:
+                                for start, data in plan.runs:
+                                    self.watch_list.add(start, data)
+                        else:
+                            with self.stats.timer("apply.memory_map", phases):
+                                self.refresh_memory_map()
+                            written_runs = []
+                            total_applied = self.execute_write_plan(plan, phases, written_runs)
+                            dap_msg("[{}] total patches applied in [{}] runs over [{}] pages "
+                                    "([{}] debugger round-trips saved)!".format(
+                                        total_applied, plan.run_count, plan.page_count, plan.saved_round_trips))
+                            if self.pending_patches:
+                                dap_msg("[{}] patched bytes deferred until their addresses are mapped.".format(
+                                    self.pending_patches.byte_count))
+                            self.stats.record_session(pid, runs=plan.run_count, bytes=plan.byte_count,
+                                                      pages=plan.page_count, applied=total_applied)
+                            self.record_pending_stats()
+                            if self.cfg[DapCfg.Verify]:
+                                with self.stats.timer("apply.verify", phases):
+                                    mismatched = self.verify_runs(written_runs)
+                                self.stats.record_session(pid, mismatched_ranges=len(mismatched))
+                    self.applied_versions[pid] = snapshot.version
+                    if len(snapshot) > 0 and not self.pending_patches:
+                        self.applied_plans[pid] = self.write_plan_key(snapshot, base)
+                    dap_msg("Applied patch snapshot version [{}]{}.".format(
+                        snapshot.version, " to process [{}]".format(pid) if pid is not None else ""))
+                except Exception as e:
+                    dap_err("Error encountered while applying patches to current debugged process.", str(e))
+                except:
+                    dap_err("Unknown error encountered while applying patches to current debugged process.")
+            else:
+                dap_err("Could not apply patches, could not suspend process!")
+            with self.stats.timer("apply.resume", phases):
+                idc.resume_process()
+        if phases is not None:
+            self.stats.record_session(pid, version=self.applied_versions.get(pid),
+                                      phases_ms=dict((name, t * 1000.0) for name, t in phases.items()))
+        return total_applied
+
+    def begin_session(self, pid, attached=False):
+        """Resets per-process state when a new debugged process starts, or the debugger attaches to one.
+
+        Args:
+            pid (int): PID of the debugged process.
+            attached (bool): The debugger attached to a running process, which may still be patched from an earlier
+                session.
+        """
+        # The patch buffer is not updated while debugging, so there is no need to wake the monitor until the end
+        if self.monitor_thread:
+            self.monitor_thread.suspend()
+        self.session_pid = pid
+        self.session_attached = attached
+        if not attached:
+            # A new process was started, so nothing recorded for its PID applies to it
+            self.applied_versions.pop(pid, None)
+            self.applied_plans.pop(pid, None)
+        self.modules.clear()
+        self.memory_map = MemoryMap()
+        self.memory_map_time = 0.0
+        self.pending_patches.clear()
+        self.watch_list.clear()
+        self.live_originals.clear()
+        self.fired_triggers = set()
+        self.trigger_table = {}
+
+    def execute_write_plan(self, plan, phases=None, written_runs=None, revert=False):
+        """Writes a write plan to debugger memory in batches of at most DAP_WRITE_BATCH_SIZE bytes, each dispatched
+        to the main thread with execute_sync(), as the debugger memory APIs require. On the main thread, each batch
+        runs right away. The process must be suspended.
+
+        Args:
+            plan (WritePlan): Plan to write, usually prepared by the monitor thread.
+            phases (dict): Optional per-session phase times, see DapStats.timer().
+            written_runs (list): Optional list to append the (start, bytes) pieces which were written to.
+            revert (bool): The plan restores original bytes, see write_page_group().
+
+        Returns:
+            int: Number of bytes written.
+        """
+        written = [0]
+        errors = []
+
+        def dispatch(batch):
+            def write_batch():
+                try:
+                    for page_start, page_end, runs in batch:
+                        written[0] += self.write_page_group(page_start, page_end, runs, phases, written_runs, revert)
+                except Exception as e:
+                    errors.append(e)
+                return 1
+            return write_batch
+
+        for batch in plan.batches():
+            self.stats.count("apply.batches")
+            idaapi.execute_sync(dispatch(batch), idaapi.MFF_WRITE)
+            if errors:
+                # Raised here, as exceptions are not propagated out of execute_sync()
+                raise errors[0]
+        return written[0]
+
+    def write_page_group(self, page_start, page_end, runs, phases=None, written_runs=None, revert=False):
+        """Writes all runs touching a span of pages, then invalidates the debugger memory cache for the span once.
+
+        The debugger backends write through page protection, so pages don't need to be made writable first --
+        the memory layout is only consulted to defer runs on pages which are not mapped yet.
+
+        Args:
+            page_start (int): Start of the first page.
+            page_end (int): End of the last page.
+            runs (list): (start, bytes) runs within the pages.
+            phases (dict): Optional per-session phase times, see DapStats.timer().
+            written_runs (list): Optional list to append the (start, bytes) pieces which were written to.
+            revert (bool): The runs restore original bytes -- parts which are not mapped are skipped rather than
+                deferred, and nothing is captured or watched.
+
+        Returns:
+            int: Number of bytes written.
+        """
+        written = 0
+        # A single memory layout lookup for the group -- runs are only split at region boundaries when they are
+        # not all within one region
+        last_start, last_data = runs[-1]
+        mapped = self.memory_map.covers(runs[0][0], last_start + len(last_data))
+        for start, data in runs:
+            if revert:
+                written += self.restore_run(start, data, phases, mapped)
+            else:
+                written += self.write_or_defer(start, data, phases, written_runs, invalidate=False, mapped=mapped)
+        if written > 0:
+            with self.stats.timer("apply.invalidate", phases):
+                idaapi.invalidate_dbgmem_contents(page_start, page_end - page_start)  # addr, size
+        return written
+
+    def write_or_defer(self, start, data, phases=None, written_runs=None, invalidate=True, mapped=False):
+        """Writes a run to debugger memory. Any part of it which is not mapped yet, or fails to write, is queued to
+        be retried when the memory layout changes.
+
+        Args:
+            start (int): Address of the run.
+            data (bytearray): Bytes to write.
+            phases (dict): Optional per-session phase times, see DapStats.timer().
+            written_runs (list): Optional list to append the (start, bytes) pieces which were written to.
+            invalidate (bool): Invalidate the debugger memory cache for each piece written.
+            mapped (bool): The run is known to be mapped, so the memory layout is not consulted.
+
+        Returns:
+            int: Number of bytes written.
+        """
+        written = 0
+        capture = self.cfg[DapCfg.CaptureOriginals]
+        pieces = [(start, data, True)] if mapped else self.memory_map.split(start, data)
+        for piece_start, piece, mapped in pieces:
+            if mapped and capture:
+                with self.stats.timer("apply.capture", phases):
+                    self.capture_originals(piece_start, len(piece))
+            count = self.apply_run_patch(piece_start, piece, phases, invalidate) if mapped else 0
+            written += count
+            if count != len(piece):
+                dap_debug("Deferring [{}] patched bytes at [{:#x}] ({}).", len(piece) - count, piece_start,
+                          "not mapped" if not mapped else "write failed")
+                self.pending_patches.add(piece_start, piece)
+            else:
+                if self.cfg[DapCfg.Watchdog]:
+                    self.watch_list.add(piece_start, piece)
+                if written_runs is not None:
+                    written_runs.append((piece_start, piece))
+        return written
+
+    def restore_run(self, start, data, phases=None, mapped=False):
+        """Writes original bytes back over the mapped parts of a run, without invalidating the memory cache.
+
+        Args:
+            mapped (bool): The run is known to be mapped, so the memory layout is not consulted.
+
+        Returns:
+            int: Number of bytes written.
+        """
+        restored = 0
+        pieces = [(start, data, True)] if mapped else self.memory_map.split(start, data)
+        for piece_start, piece, mapped in pieces:
+            if mapped:
+                restored += self.apply_run_patch(piece_start, piece, phases, invalidate=False)
+        return restored
+
+    def capture_originals(self, start, size):
+        """Reads the bytes of a run from process memory before they are first patched, so they can be reverted.
+        Bytes captured already are not read again, as they may have been patched since."""
+        for gap_start, gap_end in self.live_originals.gaps(start, start + size):
+            try:
+                data = idaapi.dbg_read_memory(gap_start, gap_end - gap_start)
+            except:
+                data = None
+            if data is not None and len(data) == gap_end - gap_start:
+                self.live_originals.add(gap_start, bytearray(data))
+
+    def revert_patches_in_current_proc(self):
+        """Restores the original bytes of all patches in the current debugged process, one write per run, within a
+        single suspend/resume. Bytes read from process memory before patching are used where they were captured,
+        otherwise the original bytes recorded in the database.
+
+        Returns:
+            int: Number of bytes restored.
+        """
+        if not idaapi.is_debugger_on():
+            dap_warn("Cannot revert patches - debugger is not currently on!")
+            return 0
+        snapshot = self.snapshot
+        runs = self.build_write_plan(snapshot, self.resolve_module_base(snapshot), original=True).runs
+        if self.live_originals:
+            runs = self.live_originals.revert_runs(runs)
+        # Patches which were never applied don't need reverting, nor watching
+        self.pending_patches.clear()
+        self.watch_list.clear()
+
+        total_reverted = 0
+        if idaapi.suspend_process():
+            try:
+                total_reverted = self.execute_write_plan(WritePlan(runs), revert=True)
+                self.applied_versions.pop(self.session_pid, None)
+                self.applied_plans.pop(self.session_pid, None)
+                dap_msg("[{}] patched bytes reverted in [{}] runs.".format(total_reverted, len(runs)))
+            except Exception as e:
+                dap_err("Error encountered while reverting patches in current debugged process.", str(e))
+            except:
+                dap_err("Unknown error encountered while reverting patches in current debugged process.")
+        else:
+            dap_err("Could not revert patches, could not suspend process!")
+        idc.resume_process()
+        return total_reverted
+
+    def verify_runs(self, runs):
+        """Reads back runs from debugger memory, with a single read per run, and compares them against the bytes
+        which should have been written. The process must be suspended.
+
+        Args:
+            runs (iterable): (start, bytes) runs.
+
+        Returns:
+            list: Mismatched (start, end) ranges.
+        """
+        mismatched = []
+        run_count = 0
+        byte_count = 0
+        for start, data in runs:
+            run_count += 1
+            byte_count += len(data)
+            try:
+                with self.stats.timer("verify.read"):
+                    actual = idaapi.dbg_read_memory(start, len(data))
+            except:
+                actual = None
+            mismatched.extend(find_mismatched_ranges(start, data, actual))
+
+        if mismatched:
+            dap_warn("Verified [{}] runs ([{}] bytes) -- [{}] ranges do not match the patches!".format(
+                run_count, byte_count, len(mismatched)))
+            for start, end in mismatched[:20]:
+                dap_warn("  Mismatch at [{:#x} - {:#x}] ([{}] bytes)".format(start, end, end - start))
+            if len(mismatched) > 20:
+                dap_warn("  ... and [{}] more.".format(len(mismatched) - 20))
+        else:
+            dap_msg("Verified [{}] runs ([{}] bytes) -- all patches match.".format(run_count, byte_count))
+        return mismatched
+
+    def verify_patches_in_current_proc(self):
+        """Verifies that all patches are present in the memory of the current debugged process.
+
+        Returns:
+            list: Mismatched (start, end) ranges, or None if the process could not be verified.
+        """
+        if not idaapi.is_debugger_on():
+            dap_warn("Cannot verify patches - debugger is not currently on!")
+            return None
+        snapshot = self.snapshot
+        plan = self.build_write_plan(snapshot, self.resolve_module_base(snapshot))
+        if not idaapi.suspend_process():
+            dap_err("Could not verify patches, could not suspend process!")
+            return None
+        try:
+            # Pieces which are not mapped are still pending, rather than mismatched
+            self.refresh_memory_map()
+            runs = []
+            unmapped = 0
+            for start, data in plan:
+                for piece_start, piece, mapped in self.memory_map.split(start, data):
+                    if mapped:
+                        runs.append((piece_start, piece))
+                    else:
+                        unmapped += len(piece)
+            if unmapped:
+                dap_msg("[{}] patched bytes are not mapped in the current process, skipping them.".format(unmapped))
+            return self.verify_runs(runs)
+        finally:
+            idc.resume_process()
+
+    def refresh_memory_map(self):
+        """Re-reads the memory layout of the debugged process.
+
+        Returns:
+            list: (start, end) ranges which are new or changed since the previous read.
+        """
+        previous = self.memory_map
+        self.memory_map = MemoryMap.from_debugger()
+        self.memory_map_time = time.time()
+        changed = self.memory_map.changed_ranges(previous)
+        # Remapped memory may have lost its patches
+        for start, end in changed:
+            self.watch_list.mark_dirty(start, end)
+        return changed
+
+    def check_memory_layout(self, throttle=False):
+        """Checks for newly mapped memory while patches are pending, and retries those in the new ranges only.
+
+        Args:
+            throttle (bool): Skip the check if the layout was read less than DAP_MEMORY_REFRESH_INTERVAL seconds ago.
+        """
+        if not self.pending_patches:
+            return 0
+        if throttle and time.time() - self.memory_map_time < DAP_MEMORY_REFRESH_INTERVAL:
+            return 0
+        return self.retry_pending_patches(self.refresh_memory_map(), refresh=False)
+
+    def retry_pending_patches(self, ranges, refresh=True):
+        """Retries the pending patches intersecting newly mapped ranges. Called while the process is suspended at a
+        debugger event.
+
+        Args:
+            ranges (list): (start, end) ranges which were newly mapped.
+            refresh (bool): Re-read the memory layout before retrying, if any pending patches are in range.
+
+        Returns:
+            int: Number of bytes written.
+        """
+        if not self.pending_patches or not self.cfg[DapCfg.Enabled]:
+            return 0
+        runs = []
+        for start, end in ranges:
+            runs.extend(self.pending_patches.take_range(start, end))
+        if not runs:
+            return 0
+        if refresh:
+            self.refresh_memory_map()
+        written = 0
+        for start, data in runs:
+            written += self.write_or_defer(start, data)
+        if written:
+            dap_msg("[{}] deferred patched bytes applied, [{}] still pending.".format(
+                written, self.pending_patches.byte_count))
+        self.record_pending_stats()
+        return written
+
+    def check_patch_integrity(self, event, ea=None):
+        """Integrity watchdog, called while the process is suspended at a debugger event. Reads back at most
+        "watchdog_budget" bytes of the runs written to the process -- those on pages marked dirty first, then the
+        rest in turn -- and re-applies any bytes which were overwritten.
+
+        Args:
+            event (str): Debugger event, for the log.
+            ea (int): Address being executed, whose page is checked first, or None.
+
+        Returns:
+            int: Number of overwritten bytes re-applied.
+        """
+        if not self.watch_list or not self.cfg[DapCfg.Watchdog]:
+            return 0
+        if ea is not None:
+            page_start = ea & ~(DAP_PAGE_SIZE - 1)
+            self.watch_list.mark_dirty(page_start, page_start + DAP_PAGE_SIZE)
+        repaired = 0
+        checked = 0
+        with self.stats.timer("watchdog.check"):
+            for start, data in self.watch_list.select(self.cfg[DapCfg.WatchdogBudget]):
+                checked += len(data)
+                try:
+                    actual = idaapi.dbg_read_memory(start, len(data))
+                except:
+                    actual = None
+                if actual is None:
+                    # Not readable (e.g. unmapped), rather than overwritten
+                    continue
+                for lo, hi in find_mismatched_ranges(start, data, actual):
+                    written = self.apply_run_patch(lo, data[lo - start:hi - start])
+                    repaired += written
+                    # Overwritten once, likely to be overwritten again
+                    self.watch_list.mark_dirty(lo, hi)
+                    dap_warn("Patch at [{:#x} - {:#x}] was overwritten (detected at {} on {}) -- {}.".format(
+                        lo, hi, time.strftime("%H:%M:%S"), event,
+                        "re-applied" if written == hi - lo else "could not re-apply it"),
+                        key="watchdog:{:x}".format(lo))
+        self.stats.count("watchdog.checked_bytes", checked)
+        if repaired:
+            self.stats.count("watchdog.repaired_bytes", repaired)
+        return repaired
+
+    def record_pending_stats(self):
+        self.stats.record_session(self.session_pid, pending_runs=len(self.pending_patches),
+                                  pending_bytes=self.pending_patches.byte_count)
+
+    def get_pending_patches(self):
+        """Returns the (start, bytes) runs still waiting for their addresses to be mapped in the current process."""
+        return list(self.pending_patches.runs)
+
+    def on_module_load(self, pid, name, base, size, process_start=False):
+        """Called when the process starts or a library is loaded. Applies patches if the loaded module is the one
+        patched in the database, rebased to where it was loaded. Other modules cost only a name comparison.
+        """
+        self.modules.add(name, base, size)
+        snapshot = self.snapshot
+        if ModuleIndex.module_key(name) != ModuleIndex.module_key(snapshot.module):
+            if not process_start:
+                return 0
+            if ModuleIndex.is_library(snapshot.module):
+                dap_msg("Waiting for module [{}] to load before applying patches...".format(snapshot.module))
+                return 0
+            # The database is the main executable, but it was started under a different name
+        if not base or base == idaapi.BADADDR:
+            base = snapshot.link_base
+        dap_msg("Module [{}] loaded at [{:#x}] -- applying patches...".format(name, base))
+        result = self.apply_patches_to_current_proc(pid, base)
+        if result is not None and result >= 0:
+            dap_msg("Success!")
+        self.arm_triggers(base)
+        return result
+
+    def resolve_module_base(self, snapshot):
+        """Returns the live base address of the patched module, falling back to its base in the database."""
+        base = self.modules.base_of(snapshot.module)
+        return base if base is not None else snapshot.link_base
+
+    def get_database_module(self):
+        """Returns the (name, image base) of the module loaded in the database."""
+        try:
+            return idaapi.get_root_filename(), idaapi.get_imagebase()
+        except:
+            return "", 0
+
+    def get_stats(self):
+        """Returns timing and counter statistics for the monitor thread and patch application.
+
+        Statistics are only collected when enabled with the "stats" (or "stats_dump") configuration key. The
+        monitor thread's current interval in seconds is always included (None while it is suspended), as are the
+        startup times in milliseconds: spent in init(), spent in the background, and until the patch buffer was ready.
+        """
+        stats = self.stats.get()
+        stats["monitor_interval"] = self.monitor_thread.interval if self.monitor_thread else None
+        stats["startup"] = dict(self.startup_times)
+        return stats
+
+    def end_session(self, pid):
+        """Called when a debug session ends. Dumps the session statistics to disk, if enabled."""
+        if self.monitor_thread:
+            self.monitor_thread.resume()
+        self.session_pid = None
+        self.trigger_table = {}
+        for ea in list(self.trigger_bpts):
+            self.remove_trigger_bpt(ea)
+        if self.pending_patches:
+            dap_warn("[{}] patched bytes were never applied -- their addresses were never mapped.".format(
+                self.pending_patches.byte_count))
+            self.pending_patches.clear()
+        if not self.cfg or not self.cfg[DapCfg.StatsDump] or not self.stats.enabled:
+            return
+        try:
+            path = self.stats.dump_session(pid, os.path.dirname(DAP_CONFIG_FILE_PATH))
+            dap_msg("Saved session statistics to: {}".format(path))
+        except Exception as e:
+            dap_warn("Failed to save session statistics.", str(e))
+
+    def get_applied_version(self, pid=None):
+        """Returns the patch snapshot version applied to a debugged process, or None if it was never patched.
+
+        Args:
+            pid (int): PID of the debugged process, or None for patches applied manually from the menu.
+        """
+        return self.applied_versions.get(pid)
+
+    def load_patch_groups(self):
+        """Loads the patch groups of the current database from the configuration."""
+        module, link_base = self.get_database_module()
+        groups = self.cfg[DapCfg.Groups]
+        config = groups.get(self.get_groups_key())
+        if config is None:
+            # Saved under the module name by earlier versions, moved to the database's key on the next save
+            config = groups.get(module)
+        self.patch_groups = PatchGroupIndex.from_config(config)
+        primary = self.cfg[DapCfg.PrimaryPatchAddr]
+        if primary is not None and primary != idaapi.BADADDR and self.is_database_address(primary):
+            # Kept globally by earlier versions, but only meaningful in one database -- moved to the trigger of the
+            # default group of the first database it lies in, unless it has a trigger already
+            if self.patch_groups.get(DAP_DEFAULT_GROUP).trigger is None:
+                self.patch_groups.set_trigger(DAP_DEFAULT_GROUP, (primary - link_base) & DAP_ADDR_MASK)
+                dap_msg("Moved [primary_patch_addr] to the trigger of patch group [{}] of this database.".format(
+                    DAP_DEFAULT_GROUP))
+            self.cfg[DapCfg.PrimaryPatchAddr] = idaapi.BADADDR
+            self.save_patch_groups()
+
+    @staticmethod
+    def is_database_address(ea):
+        """Returns whether an address lies within a segment of the current database."""
+        try:
+            return idaapi.getseg(ea) is not None
+        except:
+            return False
+
+    def save_patch_groups(self):
+        """Saves the patch groups of the current database to the configuration."""
+        self.cfg[DapCfg.Groups][self.get_groups_key()] = self.patch_groups.to_config()
+        self.save_configuration()
+
+    def get_groups_key(self):
+        """Returns the key of the current database's patch groups in the configuration -- the database key its patch
+        cache and journal are named by, so databases of input files with the same name keep separate groups. Falls
+        back to the module name if the database cannot be identified."""
+        try:
+            identity = self.get_database_identity()
+        except:
+            identity = None
+        if identity is None:
+            return self.get_database_module()[0]
+        return database_key(*identity).hexdigest()[:16]
+
+    def build_write_plan(self, snapshot, base, original=False, ranges=None):
+        """Builds the write plan for the patches of enabled groups whose trigger has fired, rebased to base.
+
+        Plans are cached for the latest snapshot version, so processes loading the patched module at the same base
+        share a single plan, e.g. when re-attaching or debugging the same program repeatedly, or when it was
+        prepared by the monitor thread. Plans are never modified once built.
+
+        Args:
+            ranges (list): RVA ranges to include, or None for those of the current process, see get_applied_ranges().
+        """
+        key = self.write_plan_key(snapshot, base, original, ranges)
+        version, plans = self.plan_cache
+        plan = plans.get(key)
+        if plan is not None:
+            self.stats.count("apply.plan_cache_hits")
+            return plan
+        plan = WritePlan.from_store_ranges(snapshot.store, key[3], base, original)
+        # Grouped before it is shared, so readers never group it concurrently
+        plan.batches()
+        plans = dict(plans) if version == snapshot.version and len(plans) < DAP_PLAN_CACHE_SIZE else {}
+        plans[key] = plan
+        # Published with a single assignment, as plans are built on both the monitor thread and the main thread
+        self.plan_cache = (snapshot.version, plans)
+        return plan
+
+    def build_revert_plan(self, store, ranges, base):
+        """Builds the plan restoring the original bytes of the patches of a store within a set of RVA ranges, rebased
+        to base. Bytes read from process memory before they were patched are used where they were captured,
+        otherwise the original bytes recorded in the database."""
+        plan = WritePlan.from_store_ranges(store, ranges, base, original=True)
+        if self.live_originals:
+            plan = WritePlan(self.live_originals.overlay(plan.runs))
+        return plan
+
+    def write_plan_key(self, snapshot, base, original=False, ranges=None):
+        """Returns the key identifying the write plan for a snapshot, rebased to base, with the given (by default,
+        the current process's) applied ranges -- processes with equal keys are patched with identical writes."""
+        if ranges is None:
+            ranges = self.get_applied_ranges()
+        return snapshot.version, snapshot.module, base, tuple(ranges), original
+
+    def is_process_patched(self, pid, snapshot, base, plan):
+        """Checks whether a process the debugger attached to was already patched with the same write plan, e.g.
+        before detaching. Its first and last runs are read back, in case the PID was reused by another process.
+        The process must be suspended.
+
+        Returns:
+            bool: True if the process needs no patching.
+        """
+        if not self.session_attached:
+            return False
+        self.session_attached = False
+        if pid is None or not plan.runs or self.applied_plans.get(pid) != self.write_plan_key(snapshot, base):
+            return False
+        for start, data in plan.runs[:1] + plan.runs[1:][-1:]:
+            try:
+                actual = idaapi.dbg_read_memory(start, len(data))
+            except:
+                actual = None
+            if find_mismatched_ranges(start, data, actual):
+                return False
+        return True
+
+    def get_applied_ranges(self):
+        """Returns the RVA ranges of the enabled groups whose trigger has fired in the current process."""
+        return self.patch_groups.enabled_ranges(self.fired_triggers)
+
+    def create_patch_group(self, name=None, start=None, end=None):
+        """Adds an address range to a named patch group, creating the group if needed. Patches in the range are then
+        enabled and disabled together with the group.
+
+        Args:
+            name (str): Name of the group, or None to ask the user.
+            start (int): Start address, or None to use the current selection.
+            end (int): End address (exclusive).
+
+        Returns:
+            PatchGroup: The group, or None if cancelled.
+        """
+        if not self.wait_until_ready(patches=False):
+            return None
+        if start is None:
+            selection = self.get_selection()
+            if selection is None:
+                dap_warn("Select the range of addresses to group first.")
+                return None
+            start, end = selection
+        name = name or self.ask_str("", "Patch group name")
+        if not name:
+            return None
+        start_rva, end_rva = self.ea_to_rva(start), self.ea_to_rva(end)
+        previous = self.get_applied_ranges()
+        try:
+            group = self.patch_groups.add_range(name, start_rva, end_rva)
+        except ValueError as e:
+            dap_err("Could not create patch group.", str(e))
+            return None
+        self.save_patch_groups()
+        dap_msg("Added [{:#x} - {:#x}] to patch group [{}] ([{}] patched bytes, {}).".format(
+            start, end, name, self.count_group_patches(group), "enabled" if group.enabled else "disabled"))
+        self.report_group_overlaps(name)
+        # Patches moving out of the default group change state if the two groups are not both enabled
+        self.apply_group_changes(previous)
+        self.rearm_triggers()
+        return group
+
+    def set_patch_group_enabled(self, name, enabled):
+        """Enables or disables a patch group. If a process is being debugged, only the patches of the group which
+        change state are applied or reverted in it."""
+        if not self.wait_until_ready(patches=False):
+            return
+        group = self.patch_groups.get(name)
+        if group is None:
+            dap_err("No patch group named [{}].".format(name))
+            return
+        previous = self.get_applied_ranges()
+        self.patch_groups.set_enabled(name, enabled)
+        self.save_patch_groups()
+        dap_msg("Patch group [{}] {} ([{}] patched bytes).".format(
+            name, "enabled" if enabled else "disabled", self.count_group_patches(group)))
+        self.report_group_overlaps(name)
+        self.apply_group_changes(previous)
+        # Triggers of disabled groups are not armed
+        self.rearm_triggers()
+
+    def toggle_patch_group(self, name=None):
+        """Toggles a patch group between enabled and disabled, asking the user for its name if not given."""
+        if not self.wait_until_ready(patches=False):
+            return
+        if name is None:
+            name = self.ask_str("", "Patch group to toggle -- {}".format(", ".join(
+                "{} ({})".format(group_name, "on" if self.patch_groups.get(group_name).enabled else "off")
+                for group_name in self.patch_groups.names())))
+            if not name:
+                return
+        group = self.patch_groups.get(name)
+        if group is None:
+            dap_err("No patch group named [{}].".format(name))
+            return
+        self.set_patch_group_enabled(name, not group.enabled)
+
+    def count_group_patches(self, group):
+        """Returns the number of patched bytes within a group's ranges."""
+        store = self.snapshot.store
+        if group.name == DAP_DEFAULT_GROUP:
+            ranges = subtract_ranges([(0, DAP_ADDR_MASK + 1)], self.patch_groups.grouped_ranges())
+        else:
+            ranges = group.ranges
+        count = 0
+        for start, end in ranges:
+            lo, hi = store.index_range(start, end)
+            count += hi - lo
+        return count
+
+    def report_group_overlaps(self, name):
+        """Warns about ranges a group shares with other groups. Overlaps are conflicts if the groups are not both
+        enabled or both disabled -- the shared patches are applied as long as either group is enabled."""
+        overlaps = self.patch_groups.find_overlaps(name)
+        if not overlaps:
+            return
+        for first, second, start, end in overlaps[:20]:
+            conflict = self.patch_groups.get(first).enabled != self.patch_groups.get(second).enabled
+            dap_warn("Patch groups [{}] and [{}] overlap at RVA [{:#x} - {:#x}]{}.".format(
+                first, second, start, end, " -- conflict, these patches stay enabled" if conflict else ""))
+        if len(overlaps) > 20:
+            dap_warn("  ... and [{}] more.".format(len(overlaps) - 20))
+
+    def apply_group_changes(self, previous, resume=True):
+        """Applies or reverts the patches whose group state changed in the current debugged process, if it was
+        already patched. Only ranges which changed state are touched.
+
+        Args:
+            previous (list): Applied ranges before the change, see get_applied_ranges().
+            resume (bool): Resume the process afterwards. Pass False to leave it suspended, e.g. at a breakpoint.
+        """
+        if not idaapi.is_debugger_on() or self.session_pid not in self.applied_versions:
+            return
+        ranges = self.get_applied_ranges()
+        if previous == ranges:
+            return
+        snapshot = self.snapshot
+        base = self.resolve_module_base(snapshot)
+        removed = subtract_ranges(previous, ranges)
+        apply_plan = WritePlan.from_store_ranges(snapshot.store, subtract_ranges(ranges, previous), base)
+        revert_plan = self.build_revert_plan(snapshot.store, removed, base)
+        try:
+            counts = self.write_live_changes(apply_plan, revert_plan, resume)
+        except Exception as e:
+            dap_err("Error encountered while updating patch groups in current debugged process.", str(e))
+            return
+        if counts is None:
+            dap_err("Could not update patch groups in the current process, could not suspend process!")
+            return
+        dap_msg("[{}] patched bytes applied and [{}] reverted in the current process.".format(*counts))
 
-        @classmethod
-        def unregister(self):
-            """Unregister the action.
-            After unregistering the class cannot be used.
-            """
-            idaapi.unregister_action(self.get_name())
+    def write_live_changes(self, apply_plan, revert_plan, resume=True):
+        """Writes patches and restores original bytes in the current debugged process, within a single
+        suspend/resume. Reverted patches still waiting for their pages to be mapped are dropped from the queue.
 
-        @classmethod
-        def activate(self, ctx):
-            # dummy method
-            return 1
+        Args:
+            apply_plan (WritePlan): Patches to apply.
+            revert_plan (WritePlan): Original bytes to restore.
+            resume (bool): Resume the process afterwards. Pass False to leave it suspended, e.g. at a breakpoint.
 
-        @classmethod
-        def update(self, ctx):
-            try:
-                if ctx.form_type == idaapi.BWN_DISASM:
-                    return idaapi.AST_ENABLE_FOR_FORM
-                else:
-                    return idaapi.AST_DISABLE_FOR_FORM
-            except:
-                # Add exception for main menu on >= IDA 7.0
-                return idaapi.AST_ENABLE_ALWAYS
+        Returns:
+            tuple: (bytes applied, bytes reverted), or None if the process could not be suspended.
+        """
+        if not idaapi.suspend_process():
+            return None
+        # The process no longer matches a plan, so it is patched in full if re-attached
+        self.applied_plans.pop(self.session_pid, None)
+        applied = reverted = 0
+        try:
+            self.refresh_memory_map()
+            applied = self.execute_write_plan(apply_plan)
+            for start, data in revert_plan:
+                # Patches which were never applied don't need applying anymore, and reverted ones need no watching
+                self.pending_patches.take_range(start, (start + len(data)) & DAP_ADDR_MASK)
+                self.watch_list.remove_range(start, start + len(data))
+            reverted = self.execute_write_plan(revert_plan, revert=True)
+        finally:
+            if resume:
+                idc.resume_process()
+        return applied, reverted
 
+    def set_patch_group_trigger(self, name, ea=None):
+        """Binds a patch group to a trigger address, so its patches are applied when execution reaches it rather
+        than at process start, e.g. once an unpacking stub has written the code they patch.
 
-    class DapMCEnable(DapMenuContext):
-        def activate(self, ctx):
-            self.plugin.enable_patching()
-            return 1
+        Args:
+            name (str): Name of the group.
+            ea (int): Trigger address, or None to apply the group at process start.
+        """
+        if not self.wait_until_ready(patches=False):
+            return
+        if self.patch_groups.get(name) is None:
+            dap_err("No patch group named [{}].".format(name))
+            return
+        previous = self.get_applied_ranges()
+        self.patch_groups.set_trigger(name, None if ea is None else self.ea_to_rva(ea))
+        self.save_patch_groups()
+        if ea is None:
+            dap_msg("Patch group [{}] is applied at process start.".format(name))
+        else:
+            dap_msg("Patch group [{}] is applied when execution reaches [{:#x}].".format(name, ea))
+        # A group applied already is reverted until its new trigger fires, and one waiting for a trigger which no
+        # longer applies is applied right away
+        self.apply_group_changes(previous)
+        self.rearm_triggers()
 
+    def toggle_patch_group_trigger(self, name=None, ea=None):
+        """Binds a patch group to the address under the cursor, or back to process start if it is already bound
+        to that address."""
+        if not self.wait_until_ready(patches=False):
+            return
+        if ea is None:
+            ea = self.get_screen_ea()
+            if ea is None or ea == idaapi.BADADDR:
+                return
+        name = name or self.ask_str("", "Patch group to apply at {:#x} -- {}".format(ea, ", ".join(
+            self.patch_groups.names())))
+        if not name:
+            return
+        group = self.patch_groups.get(name)
+        if group is not None and group.trigger == self.ea_to_rva(ea):
+            ea = None
+        self.set_patch_group_trigger(name, ea)
 
-    class DapMCDisable(DapMenuContext):
-        def activate(self, ctx):
-            self.plugin.disable_patching()
-            return 1
+    def arm_triggers(self, base):
+        """Builds the dispatch table of trigger addresses in the current process, keyed by live address, so a
+        debugger event anywhere else costs a single dictionary lookup. A temporary breakpoint is added at each
+        trigger address which has none, if enabled, and removed once it fires.
 
+        Args:
+            base (int): Live base address of the patched module.
+        """
+        table = {}
+        for trigger in self.patch_groups.triggers() - self.fired_triggers:
+            table[(trigger + base) & DAP_ADDR_MASK] = trigger
+            dap_debug("Armed patch group trigger at RVA [{:#x}] (live address [{:#x}]).", trigger,
+                      (trigger + base) & DAP_ADDR_MASK)
+        self.trigger_table = table
+        for ea in list(self.trigger_bpts):
+            if ea not in table:
+                self.remove_trigger_bpt(ea)
+        if self.cfg[DapCfg.TriggerBreakpoints]:
+            for ea in table:
+                if ea in self.trigger_bpts or idaapi.exist_bpt(ea):
+                    continue
+                # Hardware breakpoints, since a software breakpoint's int3 would be overwritten by the code
+                # unpacked at the trigger, or restore a stale byte over it when removed
+                try:
+                    added = idaapi.add_bpt(ea, 1, idaapi.BPT_EXEC)
+                except Exception as e:
+                    dap_warn("Could not add trigger breakpoint at {:#x}.".format(ea), str(e))
+                    continue
+                if added:
+                    self.trigger_bpts.add(ea)
+                else:
+                    dap_warn("Could not add a hardware breakpoint at trigger {:#x} -- the debugger only supports a "
+                             "few. Set a breakpoint there to apply its patch groups.".format(ea))
+        if table:
+            dap_msg("[{}] patch group triggers armed.".format(len(table)))
 
-    class DapMCCheckUpdate(DapMenuContext):
-        def activate(self, ctx):
-            self.plugin.check_update()
-            return 1
+    def rearm_triggers(self):
+        """Rebuilds the trigger dispatch table of the current debugged process after patch groups change, see
+        arm_triggers()."""
+        if idaapi.is_debugger_on() and self.session_pid is not None:
+            self.arm_triggers(self.resolve_module_base(self.snapshot))
 
+    def fire_trigger(self, ea, resume=True):
+        """Called on breakpoint and step events. Applies all patch groups bound to the address within a single
+        suspend, if any.
 
-    class DapMCAbout(DapMenuContext):
-        def activate(self, ctx):
-            self.plugin.about()
-            return 1
+        Args:
+            ea (int): Address execution stopped at.
+            resume (bool): Resume the process afterwards if it stopped at a temporary trigger breakpoint. The
+                process is left suspended at breakpoints set by the user.
 
+        Returns:
+            bool: True if a trigger fired.
+        """
+        trigger = self.trigger_table.pop(ea, None)
+        if trigger is None:
+            return False
+        temporary = ea in self.trigger_bpts
+        if temporary:
+            self.remove_trigger_bpt(ea)
+        resume = resume and temporary
+        self.stats.count("triggers.fired")
+        if not self.cfg[DapCfg.Enabled] or self.session_pid not in self.applied_versions:
+            if resume:
+                idc.resume_process()
+            return True
+        dap_msg("Reached patch group trigger at [{:#x}] -- applying patches...".format(ea))
+        previous = self.get_applied_ranges()
+        self.fired_triggers.add(trigger)
+        try:
+            self.apply_group_changes(previous, resume=False)
+        finally:
+            # Resumed here whatever was applied, since nothing stops at the removed breakpoint anymore
+            if resume:
+                idc.resume_process()
+        return True
 
-    class DapMCApplyPatch(DapMenuContext):
-        def activate(self, ctx):
-            self.plugin.apply_patch_to_memory()
-            return 1
+    def remove_trigger_bpt(self, ea):
+        """Removes a temporary trigger breakpoint."""
+        self.trigger_bpts.discard(ea)
+        try:
+            idaapi.del_bpt(ea)
+        except:
+            pass
 
+    def ea_to_rva(self, ea):
+        """Converts an address of the patched module to an RVA. While debugging, the database is rebased to where
+        the module is loaded, and the module containing the address is looked up to check it is the patched one."""
+        snapshot = self.snapshot
+        if not idaapi.is_debugger_on():
+            return (ea - snapshot.link_base) & DAP_ADDR_MASK
+        module = self.modules.find(ea)
+        if module is None:
+            base = self.resolve_module_base(snapshot)
+        else:
+            base, _, name = module
+            if ModuleIndex.module_key(name) != ModuleIndex.module_key(snapshot.module):
+                dap_warn("Address [{:#x}] lies in module [{}], not in the patched module [{}].".format(
+                    ea, name, snapshot.module))
+                base = self.resolve_module_base(snapshot)
+        return (ea - base) & DAP_ADDR_MASK
 
-    class DapMCApplyPatchesToProc(DapMenuContext):
-        def activate(self, ctx):
-            self.plugin.apply_patches_to_current_proc()
-            return 1
+    def get_screen_ea(self):
+        """Returns the address under the cursor."""
+        try:
+            return idc.get_screen_ea() if not self.old_ida else idc.ScreenEA()
+        except:
+            return None
 
+    def get_selection(self):
+        """Returns the (start, end) of the selected address range, or None if nothing is selected."""
+        try:
+            if not self.old_ida:
+                start, end = idc.read_selection_start(), idc.read_selection_end()
+            else:
+                start, end = idc.SelStart(), idc.SelEnd()
+        except:
+            return None
+        if start == idaapi.BADADDR or end == idaapi.BADADDR or end <= start:
+            return None
+        return start, end
 
-    class DapMCNull(DapMenuContext):
-        def activate(self, ctx):
-            self.plugin.menu_null()
-            return 1
+    def ask_str(self, default, prompt):
+        """Asks the user for a string. Returns it, or None if cancelled."""
+        try:
+            if not self.old_ida:
+                return idaapi.ask_str(default, 0, prompt)
+            return idc.AskStr(default, prompt)
+        except Exception as e:
+            dap_err("Could not ask for a string.", str(e))
+        return None
 
+    def get_patch_journal(self):
+        """Returns the patch variant journal of the current database, loading it on first use, or None if the
+        database cannot be identified or its journal cannot be read."""
+        if self.patch_journal is None:
+            journal = self.open_database_file(PatchJournal, "patch variants")
+            if journal is not None:
+                try:
+                    journal.load()
+                except Exception as e:
+                    # Not used at all, rather than have the next save overwrite what could not be read
+                    dap_err("Failed to load patch journal -- patch variants are unavailable.", str(e))
+                    return None
+            self.patch_journal = journal
+        return self.patch_journal
 
-    class DapMCNull2(DapMenuContext):
-        def activate(self, ctx):
-            self.plugin.menu_null()
-            return 1
-except:
-    pass
+    def get_database_chunks(self):
+        """Returns the database's patches split into journal chunks. The chunks are reused while the database's
+        patches are unchanged, e.g. right after saving or switching a variant. Must be called with
+        patched_bytes_db_lock held, once the journal is loaded."""
+        if self.database_chunks_store is not self.database_patches:
+            self.database_chunks = self.patch_journal.split(self.database_patches)
+            self.database_chunks_store = self.database_patches
+        return self.database_chunks
 
+    def save_patch_variant(self, name=None):
+        """Saves the database's patches as a named variant in the patch journal. Saving under an existing name adds
+        a new snapshot to the journal, earlier ones are kept.
 
-class DebugAutoPatchPlugin(idaapi.plugin_t):
-    # This keeps the plugin in memory, important for hooking callbacks
-    flags = idaapi.PLUGIN_KEEP
-    comment = "Plugin for automatic byte patch injection - no binary-file patching needed!"
-    help = "See https://github.com/scottmudge/IDA_DebugAutoPatch/blob/master/readme.md"
-    wanted_name = "DebugAutoPatch"
-    wanted_hotkey = ""
+        Args:
+            name (str): Name of the variant, or None to ask the user.
 
-    def __del__(self):
-        self.term()
+        Returns:
+            JournalSnapshot: The saved snapshot, or None if cancelled or failed.
+        """
+        if not self.wait_until_ready(patches=False):
+            return None
+        journal = self.get_patch_journal()
+        if journal is None:
+            dap_err("Could not identify database -- patch variants are unavailable.")
+            return None
+        name = name or self.ask_str(self.active_variant or "", "Patch variant name")
+        if not name:
+            return None
+        with self.patched_bytes_db_lock:
+            chunks = self.get_database_chunks()
+            known_chunks = len(journal.chunks)
+            try:
+                snapshot = journal.record(name, chunks)
+            except Exception as e:
+                dap_err("Failed to save patch variant.", str(e))
+                return None
+        self.active_variant = name
+        dap_msg("Saved patch variant [{}] with [{}] patched bytes ([{}] of [{}] pages shared with earlier "
+                "variants).".format(name, len(snapshot), len(chunks) - (len(journal.chunks) - known_chunks),
+                                    len(chunks)))
+        return snapshot
 
-    def __init__(self):
-        self.old_ida = False
-        self.cfg = None
-        self.debug_hook = None
-        self.patched_bytes_db = []
-        self.patched_bytes_db_lock = Lock()
-        self.monitor_thread = None
+    def switch_patch_variant(self, name=None):
+        """Switches the database's patches to a saved variant. Only the patches which differ between the current
+        patches and the variant are written: to the "Patched bytes" database and, if a process is being debugged,
+        to the process. During a debug session, the database is updated once the session ends.
 
-    class PatchedByte:
-        """Container for patched byte type."""
-        def __init__(self, addr, orig, patched):
-            self.addr = addr
-            self.orig = orig
-            self.patched = patched
+        Args:
+            name (str): Name of the variant, or None to ask the user.
 
-    class PatchVisitor(object):
-        """Used for visiting patched bytes when debugger is not active. These patches are then stored in a buffer,
-        and are applied when debugger activates."""
-        def __init__(self):
-            self.skipped = 0
-            self.patched = 0
-            self.patched_bytes = []
+        Returns:
+            bool: True if switched.
+        """
+        if not self.wait_until_ready(patches=False):
+            return False
+        journal = self.get_patch_journal()
+        if journal is None:
+            dap_err("Could not identify database -- patch variants are unavailable.")
+            return False
+        if name is None:
+            names = journal.names()
+            if not names:
+                dap_warn("No patch variants saved yet.")
+                return False
+            name = self.ask_str(names[0], "Patch variant to switch to -- {}".format(", ".join(names)))
+            if not name:
+                return False
+        target = journal.get(name)
+        if target is None:
+            dap_err("No patch variant named [{}].".format(name))
+            return False
 
-        def __call__(self, ea, fpos, orig, patch_val, cnt=()):
-            try:
-                if fpos == -1:
-                    self.skipped += 1
-                    dap_msg("fpos invalid ({}) -- patch skipped".format(fpos))
+        start = dap_clock()
+        live = idaapi.is_debugger_on()
+        with self.stats.timer("variant.switch"):
+            with self.patched_bytes_db_lock:
+                current = self.get_database_chunks()
+                applied, reverted = diff_chunks(current, target.chunks)
+                module, link_base = self.get_database_module()
+                if live:
+                    # Edits to the database during a debug session go to the process instead, so the database is
+                    # updated from the monitor thread once the session ends
+                    if self.idb_chunks is None:
+                        self.idb_chunks = current
                 else:
-                    self.patched += 1
-                    # dap_msg(" ea: %x \\ fpos: %x \\ o: %x \\ v: %x" % (ea, fpos, orig, patch_val))
-                    self.patched_bytes.append(DebugAutoPatchPlugin.PatchedByte(ea, orig, patch_val))
+                    if self.idb_chunks is None:
+                        self.push_database_changes(applied, reverted, link_base)
+                    else:
+                        self.push_database_changes(*diff_chunks(self.idb_chunks, target.chunks), link_base=link_base)
+                        self.idb_chunks = None
+                store = target.store()
+                self.database_chunks, self.database_chunks_store = target.chunks, store
+                self.publish_patches(store, module, link_base)
+            if live:
+                self.apply_variant_changes(applied, reverted)
+        self.active_variant = name
+        self.stats.count("variant.applied_bytes", len(applied))
+        self.stats.count("variant.reverted_bytes", len(reverted))
+        dap_msg("Switched to patch variant [{}] in [{:.1f}] ms: [{}] patched bytes changed and [{}] reverted.".format(
+            name, (dap_clock() - start) * 1000.0, len(applied), len(reverted)))
+        return True
+
+    def apply_variant_changes(self, applied, reverted):
+        """Applies the patches which changed in a variant switch to the current debugged process, if it was already
+        patched. Only patches of enabled groups whose trigger has fired are touched.
+
+        Args:
+            applied (PatchStore): New or changed patches.
+            reverted (PatchStore): Patches to revert.
+        """
+        if self.session_pid not in self.applied_versions:
+            return
+        if len(self.imported_patches):
+            # The database's patches take precedence over imported ones, so where one is reverted, an imported patch
+            # of the same byte takes its place, as in the published snapshot
+            applied = applied.overlaid(self.imported_patches.intersecting(reverted))
+            reverted = reverted.excluding(self.imported_patches)
+        snapshot = self.snapshot
+        base = self.resolve_module_base(snapshot)
+        ranges = self.get_applied_ranges()
+        apply_plan = WritePlan.from_store_ranges(applied, ranges, base)
+        revert_plan = self.build_revert_plan(reverted, ranges, base)
+        try:
+            counts = self.write_live_changes(apply_plan, revert_plan)
+        except Exception as e:
+            dap_err("Error encountered while switching patch variant in current debugged process.", str(e))
+            return
+        if counts is None:
+            dap_err("Could not switch patch variant in the current process, could not suspend process!")
+            return
+        self.applied_versions[self.session_pid] = snapshot.version
+        dap_msg("[{}] patched bytes applied and [{}] reverted in the current process.".format(*counts))
+
+    def sync_database_variant(self):
+        """Writes the patch variant switched to during the last debug session to the "Patched bytes" database.
+        Called on the UI thread, through execute_sync() from the monitor thread."""
+        with self.patched_bytes_db_lock:
+            if self.idb_chunks is None or idaapi.is_debugger_on():
                 return 0
-            except:
-                return
+            applied, reverted = diff_chunks(self.idb_chunks, self.get_database_chunks())
+            self.idb_chunks = None
+            self.push_database_changes(applied, reverted, self.snapshot.link_base)
+        dap_msg("Updated the database to patch variant [{}]: [{}] patched bytes changed and [{}] reverted.".format(
+            self.active_variant, len(applied), len(reverted)))
+        return 1
 
-    class DebugHook(idaapi.DBG_Hooks):
-        def __init__(self, *args):
-            super(DebugAutoPatchPlugin.DebugHook, self).__init__(*args)
-            self.steps = 0
+    def push_database_changes(self, applied, reverted, link_base):
+        """Writes the patches which changed in a variant switch to the "Patched bytes" database, one call per run
+        where possible. The database events they raise are ignored, since the caller publishes the patches itself.
 
-        def dbg_process_start(self, pid, tid, ea, name, base, size):
-            dap_msg("Process start hook snagged -- applying patches...")
-            result = DAP_INSTANCE.apply_patches_to_current_proc()
-            if result >= 0:
-                dap_msg("Success!")
+        Args:
+            applied (PatchStore): New or changed patches.
+            reverted (PatchStore): Patches to revert to their original bytes.
+            link_base (int): Image base of the module in the database.
+        """
+        self.suppress_patch_events = True
+        try:
+            for start, lo, hi in reverted.iter_runs():
+                for i in range(lo, hi):
+                    self.revert_database_byte((start + i - lo + link_base) & DAP_ADDR_MASK, reverted.orig[i])
+            for start, lo, hi in applied.iter_runs():
+                self.patch_database_bytes((start + link_base) & DAP_ADDR_MASK, applied.patched[lo:hi])
+        finally:
+            self.suppress_patch_events = False
 
-    def init(self):
-        """Initialization routine."""
-        global DAP_INITIALIZED
+    def patch_database_bytes(self, ea, data):
+        """Patches a run of bytes in the database."""
+        if not self.old_ida:
+            idaapi.patch_bytes(ea, bytes(data))
+        else:
+            for offset, value in enumerate(data):
+                idc.PatchByte(ea + offset, value)
 
-        if idaapi.IDA_SDK_VERSION < 700:
-            self.old_ida = True
+    def revert_database_byte(self, ea, orig):
+        """Restores a patched byte of the database to its original value."""
+        if not self.old_ida:
+            idaapi.revert_byte(ea)
+        else:
+            idc.PatchByte(ea, orig)
 
-        # register menu handlers
+    def export_patches(self, path=None):
+        """Exports the patch buffer to a patch set file, streaming it run by run. The format is chosen by the file
+        extension -- see DAP_PATCH_FILE_FORMATS.
+
+        Args:
+            path (str): File to export to, or None to ask the user.
+
+        Returns:
+            int: Number of patched bytes exported, or None if the export failed or was cancelled.
+        """
+        path = path or self.ask_patch_file(True, "Export patch set")
+        if not path:
+            return None
+        fmt = patch_file_format(path)
+        if fmt is None:
+            return None
+        snapshot = self.snapshot
+        start = time.time()
         try:
-            DapMCNull.register(self, "_________________________")
-            DapMCNull2.register(self, "_________________________")
-            DapMCEnable.register(self, "Enable Auto-Patching")
-            DapMCDisable.register(self, "Disable Auto-Patching")
-            DapMCApplyPatch.register(self, "Apply Patch to Memory")
-            DapMCApplyPatchesToProc.register(self, "Apply Patches to Current Process")
-            DapMCCheckUpdate.register(self, "Check for DebugAutoPatch Update")
-            DapMCAbout.register(self, "About DebugAutoPatch")
-        except:
-            pass
+            with self.stats.timer("export.total"):
+                with open(path, "wb" if fmt.binary else "wt") as f:
+                    written, skipped = fmt(snapshot.module, snapshot.link_base, self.original_file_byte).write(
+                        f, snapshot.store.iter_file_runs())
+        except Exception as e:
+            dap_err("Failed to export patches.", str(e))
+            return None
+        dap_msg("Exported [{}] patched bytes as {} to: {} ([{}] bytes in [{:.1f}] ms).".format(
+            written, fmt.name, path, os.path.getsize(path), (time.time() - start) * 1000.0))
+        if skipped:
+            dap_warn("[{}] patched bytes cannot be represented as {} and were skipped.".format(skipped, fmt.name))
+        return written
 
-        self.cfg = None
+    def import_patches(self, path=None):
+        """Imports a patch set file, streaming it run by run, and overlays it on the database's patches without
+        writing it into the database. Patches in the database take precedence where both patch the same byte.
+        If the current debugged process was already patched, the imported patches are applied to it right away.
 
-        if not DAP_INITIALIZED:
-            DAP_INITIALIZED = True
+        Args:
+            path (str): File to import, or None to ask the user.
 
-            if not self.old_ida:
-                # Add menu IDA >= 7.0
-                idaapi.attach_action_to_menu("Edit/Patch program/Null Menu", DapMCNull.get_name(), idaapi.SETMENU_APP)
-                idaapi.attach_action_to_menu("Edit/Patch program/Enable Auto-Patching", DapMCEnable.get_name(),
-                                             idaapi.SETMENU_APP)
-                idaapi.attach_action_to_menu("Edit/Patch program/Disable Auto-Patching", DapMCDisable.get_name(),
-                                             idaapi.SETMENU_APP)
-                # idaapi.attach_action_to_menu("Edit/Patch program/Apply Patch to Memory", DapMCApplyPatch.get_name(),
-                #                              idaapi.SETMENU_APP)
-                # idaapi.attach_action_to_menu("Edit/Patch program/Apply Patches to Current Process",
-                #                              DapMCApplyPatchesToProc.get_name(), idaapi.SETMENU_APP)
-                idaapi.attach_action_to_menu("Edit/Patch program/Null Menu 2", DapMCNull2.get_name(),
-                                             idaapi.SETMENU_APP)
-                # idaapi.attach_action_to_menu("Edit/Patch program/Check for DebugAutoPatch Update",
-                #                              DapMCCheckUpdate.get_name(), idaapi.SETMENU_APP)
-                idaapi.attach_action_to_menu("Edit/Patch program/About DebugAutoPatch",
-                                             DapMCAbout.get_name(), idaapi.SETMENU_APP)
-            else:
-                # Older versions
-                idaapi.add_menu_item("Edit/Patch program/", "-", "", 1, self.menu_null, None)
-                idaapi.add_menu_item("Edit/Patch program/", "Enable Auto-Patching", "", 1,
-                                     self.enable_patching, None)
-                idaapi.add_menu_item("Edit/Patch program/", "Disable Auto-Patching", "", 1,
-                                     self.disable_patching, None)
-                # idaapi.add_menu_item("Edit/Patch program/", "Apply Patch to Memory", "", 1,
-                #                      self.apply_patch_to_memory, None)
-                # idaapi.add_menu_item("Edit/Patch program/", "Apply Patches to Current Process", "", 1,
-                #                      self.apply_patches_to_current_proc, None)
-                idaapi.add_menu_item("Edit/Patch program/", "-", "", 1, self.menu_null, None)
-                # idaapi.add_menu_item("Edit/Patch program/", "Check for DebugAutoPatch Update", "", 1,
-                #                      self.check_update, None)
-                idaapi.add_menu_item("Edit/Patch program/", "About DebugAutoPatch", "", 1, self.about, None)
+        Returns:
+            int: Number of patched bytes imported, or None if the import failed or was cancelled.
+        """
+        path = path or self.ask_patch_file(False, "Import patch set")
+        if not path:
+            return None
+        fmt = patch_file_format(path)
+        if fmt is None:
+            return None
+        module, link_base = self.get_database_module()
+        start = time.time()
+        store = PatchStore()
+        unmapped = 0
+        try:
+            with self.stats.timer("import.total"):
+                reader = fmt()
+                with open(path, "rb" if fmt.binary else "rt") as f:
+                    for rva, fpos, orig, patched in reader.read(f):
+                        if rva is None:
+                            runs, missed = self.locate_file_run(fpos, patched, link_base)
+                            unmapped += missed
+                        else:
+                            runs = [(rva, fpos, patched)]
+                        for rva, fpos, piece in runs:
+                            if orig is None or len(orig) != len(piece):
+                                piece_orig = self.read_database_bytes((rva + link_base) & DAP_ADDR_MASK, len(piece))
+                            else:
+                                piece_orig = orig
+                            store.extend_run(rva, fpos, piece_orig if piece_orig is not None else piece, piece)
+                store.finalize()
+        except Exception as e:
+            dap_err("Failed to import patches.", str(e))
+            return None
+        if isinstance(reader, DapPatchFormat) and ModuleIndex.module_key(reader.module) != \
+                ModuleIndex.module_key(module):
+            dap_warn("Patch set was exported from module [{}], importing it into [{}].".format(reader.module, module))
+        if unmapped:
+            dap_warn("[{}] patched bytes are at file offsets not loaded in the database and were skipped.".format(
+                unmapped))
 
-            print("=" * 80)
-            print("DebugAutoPatch v{0} Copyright (c) Scott Mudge 2019".format(DAP_VERSION))
-            print("DebugAutoPatch is available from menu \"Edit > Patch program\"")
-            print("Find more information about DebugAutoPatch at the project github repository")
+        with self.patched_bytes_db_lock:
+            # Later imports take precedence over earlier ones
+            self.imported_patches = store.overlaid(self.imported_patches)
+            self.publish_patches(self.database_patches, module, link_base)
+        self.stats.count("import.bytes", len(store))
+        dap_msg("Imported [{}] patched bytes from {} in [{:.1f}] ms.".format(
+            len(store), path, (time.time() - start) * 1000.0))
+        if idaapi.is_debugger_on() and self.session_pid in self.applied_versions:
+            self.apply_patches_to_current_proc(self.session_pid)
+        return len(store)
 
-            self.load_configuration()
-            self.set_debug_hooks()
+    def clear_imported_patches(self):
+        """Removes all imported patches from the patch buffer. The database's patches are left as they are."""
+        with self.patched_bytes_db_lock:
+            count = len(self.imported_patches)
+            self.imported_patches = PatchStore()
+            snapshot = self.snapshot
+            self.publish_patches(self.database_patches, snapshot.module, snapshot.link_base)
+        dap_msg("Cleared [{}] imported patched bytes.".format(count))
+        if count and idaapi.is_debugger_on() and self.session_pid in self.applied_versions:
+            dap_msg("Imported patches remain in the current process until it is restarted.")
 
-            # Update patch database first
-            self.patch_monitor_func()
+    def export_patched_binary(self, path=None, input_path=None):
+        """Writes a patched copy of the input file, leaving the original untouched. The input file is copied with the
+        operating system's fast file copy (e.g. sendfile), then the copy is memory-mapped and each run of patched
+        bytes contiguous in the file is written at its file offset, so files of any size are never loaded into
+        memory.
 
-            dap_msg("Starting patch monitoring thread...")
-            self.monitor_thread = KillableThread(name="PatchMonitoring", target=self.patch_monitor_func,
-                                                 sleep_interval=0.7)
-            self.monitor_thread.start()
+        Args:
+            path (str): File to write, or None to ask the user.
+            input_path (str): Original input file, or None to use the one the database was created from.
 
-            print("=" * 80)
-        return idaapi.PLUGIN_KEEP
+        Returns:
+            int: Number of patched bytes written, or None if the export failed or was cancelled.
+        """
+        input_path = input_path or self.get_input_file_path()
+        if not input_path or not os.path.isfile(input_path):
+            dap_warn("Input file not found{} -- please locate it.".format(": " + input_path if input_path else ""))
+            input_path = self.ask_file(False, "*", "Locate the original input file")
+            if not input_path:
+                return None
+        path = path or self.ask_file(True, "*", "Save patched binary")
+        if not path:
+            return None
+        if os.path.exists(path) and os.path.realpath(path) == os.path.realpath(input_path):
+            dap_err("Refusing to overwrite the original input file: {}".format(input_path))
+            return None
 
-    def patch_monitor_func(self):
-        """Monitors patches and caches patch DB, since IDA has separate DBs for debugged processes and non-debugged
-        processes."""
-        # Don't collect patches if debugger is on
+        store = self.snapshot.store
+        start = time.time()
+        written = skipped = mismatched = run_count = 0
         try:
-            if idaapi.is_debugger_on() or idaapi.is_debugger_busy():
-                return
+            with self.stats.timer("binary.copy"):
+                shutil.copyfile(input_path, path)
+            copied = time.time()
+            size = os.path.getsize(path)
+            with self.stats.timer("binary.patch"):
+                with open(path, "r+b") as f:
+                    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_WRITE) if size else None
+                    try:
+                        for _, fpos, orig, patched in store.iter_file_runs():
+                            if fpos < 0 or fpos + len(patched) > size:
+                                skipped += len(patched)
+                                continue
+                            if mm[fpos:fpos + len(orig)] != orig:
+                                mismatched += 1
+                            mm[fpos:fpos + len(patched)] = bytes(patched)
+                            written += len(patched)
+                            run_count += 1
+                        if mm is not None:
+                            mm.flush()
+                    finally:
+                        if mm is not None:
+                            mm.close()
+        except Exception as e:
+            dap_err("Failed to write patched binary.", str(e))
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
 
-            if not self.patched_bytes_db_lock.acquire(False):
-                return
-            else:
-                try:
-                    was_empty = False
-                    if len(self.patched_bytes_db) < 1:
-                        was_empty = True
-                    patches = self.visit_patched_bytes()
-                    self.patched_bytes_db = patches
-                    if len(patches) > 0 and was_empty:
-                        dap_msg("Byte patch buffer populated!")
-                finally:
-                    self.patched_bytes_db_lock.release()
+        finished = time.time()
+        dap_msg("Wrote [{}] patched bytes in [{}] runs to: {}".format(written, run_count, path))
+        dap_msg("Copied [{:.1f}] MB in [{:.1f}] ms ([{:.1f}] MB/s), patched in [{:.1f}] ms.".format(
+            size / 1048576.0, (copied - start) * 1000.0, size / 1048576.0 / max(copied - start, 1e-6),
+            (finished - copied) * 1000.0))
+        if skipped:
+            dap_warn("[{}] patched bytes are not backed by the input file and were skipped.".format(skipped))
+        if mismatched:
+            dap_warn("[{}] runs did not match their original bytes -- is this the same input file the database "
+                     "was created from?".format(mismatched))
+        return written
+
+    def get_input_file_path(self):
+        """Returns the path of the input file the database was created from."""
+        try:
+            if not self.old_ida:
+                return idaapi.get_input_file_path()
+            return idc.GetInputFilePath()
         except:
-            pass
+            return None
 
-    def enable_patching(self):
-        """Enables automatic patching."""
-        self.cfg[DapCfg.Enabled] = True
-        dap_msg("Automatic patching enabled.")
-        pass
+    def locate_file_run(self, fpos, patched, link_base):
+        """Maps a run addressed by file offset to the database, one lookup for the whole run unless it crosses a
+        section boundary.
 
-    def disable_patching(self):
-        """Disables automatic patching."""
-        self.cfg[DapCfg.Enabled] = False
-        dap_msg("Automatic patching disabled.")
-        pass
+        Returns:
+            tuple: ((RVA, file offset, bytes) runs, number of bytes not loaded in the database)
+        """
+        size = len(patched)
+        ea = self.file_offset_to_ea(fpos)
+        if ea != idaapi.BADADDR and self.file_offset_to_ea(fpos + size - 1) == ea + size - 1:
+            return [((ea - link_base) & DAP_ADDR_MASK, fpos, patched)], 0
+        runs = []
+        unmapped = 0
+        prev = idaapi.BADADDR
+        for i in range(size):
+            ea = self.file_offset_to_ea(fpos + i)
+            if ea == idaapi.BADADDR:
+                unmapped += 1
+            elif runs and ea == prev + 1:
+                runs[-1][2].append(patched[i])
+            else:
+                runs.append(((ea - link_base) & DAP_ADDR_MASK, fpos + i, patched[i:i + 1]))
+            prev = ea
+        return runs, unmapped
 
-    def apply_patch_to_memory(self):
-        """Adds a new patch to database."""
-        # TODO -- Implement
-        pass
+    def file_offset_to_ea(self, fpos):
+        """Returns the database address loaded from an input file offset, or BADADDR."""
+        try:
+            ea = idaapi.get_fileregion_ea(fpos)
+        except:
+            return idaapi.BADADDR
+        return ea if ea is not None and ea >= 0 else idaapi.BADADDR
 
-    def apply_patches_to_current_proc(self):
-        """Applies patches to current process. Must first suspend process, check debugger is not active, then
-        apply them."""
-        if not self.cfg[DapCfg.Enabled]:
-            dap_msg("Not applying patches to current process - patching currently disabled.")
-            return
+    def original_file_byte(self, fpos):
+        """Returns the input file's original byte at a file offset, as loaded in the database, or None."""
+        ea = self.file_offset_to_ea(fpos)
+        if ea == idaapi.BADADDR:
+            return None
+        try:
+            return idaapi.get_original_byte(ea)
+        except:
+            return None
 
-        total_applied = 0
-        if idaapi.suspend_process():
-            self.patched_bytes_db_lock.acquire()
-            try:
-                if len(self.patched_bytes_db) < 1:
-                    dap_msg("No patched bytes currently in database, nothing to do!")
-                else:
-                    for patch in self.patched_bytes_db:
-                        total_applied += self.apply_byte_patch(patch)
-                    dap_msg("[{}] total patches applied!".format(total_applied))
-            except Exception as e:
-                dap_err("Error encountered while applying patches to current debugged process.", str(e))
-            except:
-                dap_err("Unknown error encountered while applying patches to current debugged process.")
-            finally:
-                self.patched_bytes_db_lock.release()
-        else:
-            dap_err("Could not apply patches, could not suspend process!")
-        idc.resume_process()
-        return total_applied
+    def read_database_bytes(self, ea, size):
+        """Reads bytes from the database with a single call, or returns None if they could not be read."""
+        try:
+            if not self.old_ida:
+                data = idaapi.get_bytes(ea, size)
+            else:
+                data = idaapi.get_many_bytes(ea, size)
+        except:
+            return None
+        if data is None or len(data) != size:
+            return None
+        return bytearray(data)
+
+    def ask_patch_file(self, for_saving, prompt):
+        """Asks the user for a patch set file. Returns the path, or None if cancelled."""
+        return self.ask_file(for_saving, ";".join("*" + fmt.extension for fmt in DAP_PATCH_FILE_FORMATS), prompt)
+
+    def ask_file(self, for_saving, mask, prompt):
+        """Asks the user for a file. Returns the path, or None if cancelled."""
+        try:
+            if not self.old_ida:
+                return idaapi.ask_file(for_saving, mask, prompt)
+            return idc.AskFile(1 if for_saving else 0, mask, prompt)
+        except Exception as e:
+            dap_err("Could not ask for a file.", str(e))
+        return None
 
     @staticmethod
     def about():
@@ -482,10 +4372,19 @@ class DebugAutoPatchPlugin(idaapi.plugin_t):
 
     def term(self):
         """Termination call."""
+        if self.startup_thread:
+            self.startup_thread.join(DAP_STARTUP_WAIT_TIMEOUT)
         if self.monitor_thread:
             self.monitor_thread.kill()
         self.unset_debug_hooks()
+        self.unset_idb_hooks()
+        self.save_patch_cache(force=True)
         self.save_configuration()
+        # Close the log file, if any. Module globals may already be gone if called from __del__ at shutdown.
+        try:
+            configure_logging(DAP_LOGGER.level)
+        except:
+            pass
 
     def set_debug_hooks(self):
         """Installs debugger hooks for automatic patching."""
@@ -506,41 +4405,109 @@ class DebugAutoPatchPlugin(idaapi.plugin_t):
         except:
             pass
 
-    def apply_byte_patch(self, patched_byte_ojb):
-        """Applies a byte patch to current debugger memory."""
+    def set_idb_hooks(self):
+        """Installs database hooks for incremental patch tracking. Falls back to polling if unavailable."""
+        self.unset_idb_hooks()
+        try:
+            self.idb_hook = DebugAutoPatchPlugin.PatchEventHook()
+            if not self.idb_hook.hook():
+                raise RuntimeError("hook() failed")
+            dap_msg("Tracking patches from database events.")
+        except Exception as e:
+            self.idb_hook = None
+            dap_warn("Could not install database hooks -- falling back to polling.", str(e))
+
+    def unset_idb_hooks(self):
+        """Remove any installed database hooks."""
+        try:
+            if self.idb_hook:
+                self.idb_hook.unhook()
+        except:
+            pass
+        self.idb_hook = None
+
+    def apply_run_patch(self, start, data, phases=None, invalidate=True):
+        """Applies a contiguous run of patched bytes to current debugger memory with a single write. Falls back
+        to writing byte-by-byte if the bulk write fails partway through.
+
+        Args:
+            start (int): Address of the first byte.
+            data (bytearray): Bytes to write.
+            phases (dict): Optional per-session phase times, see DapStats.timer().
+            invalidate (bool): Invalidate the debugger memory cache for the run. Callers writing several runs may
+                invalidate once for all of them instead.
+
+        Returns:
+            int: Number of bytes written.
+        """
         # check if debugger is even running
         if not idaapi.is_debugger_on():
             dap_warn("Cannot apply patch - debugger is not currently on!")
             return 0
 
+        written = 0
+        try:
+            with self.stats.timer("apply.write", phases):
+                result = idaapi.dbg_write_memory(start, bytes(data))
+            # Depending on IDA version, this returns either a success flag or the number of bytes written
+            if isinstance(result, bool):
+                written = len(data) if result else 0
+            elif result is not None and result > 0:
+                written = result
+        except Exception as e:
+            dap_warn("Bulk write failed at {:#x}, falling back to byte-by-byte.".format(start), str(e),
+                     key="bulk_write_failed")
+        except:
+            dap_warn("Bulk write failed at {:#x}, falling back to byte-by-byte.".format(start),
+                     key="bulk_write_failed")
+
+        if written != len(data):
+            self.stats.count("apply.fallback_runs")
+            written = 0
+            with self.stats.timer("apply.write_fallback", phases):
+                for offset, value in enumerate(data):
+                    written += self.write_dbg_byte(start + offset, value)
+
+        if written > 0 and invalidate:
+            with self.stats.timer("apply.invalidate", phases):
+                idaapi.invalidate_dbgmem_contents(start, len(data))  # addr, size
+        return written
+
+    def write_dbg_byte(self, addr, value):
+        """Writes a single byte to debugger memory, without invalidating the memory cache."""
         try:
-            # patched byte in debugger memory
             if not self.old_ida:
-                result = idc.patch_dbg_byte(patched_byte_ojb.addr, patched_byte_ojb.patched)
+                result = idc.patch_dbg_byte(addr, value)
             else:
-                result = idc.PatchDbgByte(patched_byte_ojb.addr, patched_byte_ojb.patched)
-            if result > 0:
-                idaapi.invalidate_dbgmem_contents(patched_byte_ojb.addr, 1) # addr, size
-            return result
+                result = idc.PatchDbgByte(addr, value)
+            return 1 if result > 0 else 0
         except Exception as e:
-            dap_err("Error encountered while applying byte patch to memory!", str(e))
+            dap_err("Error encountered while applying byte patch to memory!", str(e), key="byte_write_failed")
         except:
-            dap_err("Unknown error encountered while applying byte patch to memory!")
+            dap_err("Unknown error encountered while applying byte patch to memory!", key="byte_write_failed")
         return 0
 
-    def visit_patched_bytes(self):
-        """Iterates through patched bytes and stores them in a buffer."""
+    def visit_patched_bytes(self, base=0):
+        """Iterates through patched bytes and stores them in a buffer, relative to the given image base."""
         try:
-            visitor = self.PatchVisitor()
+            visitor = self.PatchVisitor(base)
             result = idaapi.visit_patched_bytes(0, idaapi.BADADDR, visitor)
             if result != 0:
-                dap_err("visit_patched_bytes() returned unexpected result", "error code ({})".format(result))
-                return []
-            return visitor.patched_bytes
+                dap_err("visit_patched_bytes() returned unexpected result", "error code ({})".format(result),
+                        key="visit_patched_bytes")
+                return PatchStore()
+            if visitor.skipped != self.skipped_patches:
+                # Only reported when the count changes, rather than on every rescan
+                self.skipped_patches = visitor.skipped
+                if visitor.skipped:
+                    dap_msg("[{}] patches skipped -- they are not backed by the input file (fpos invalid).".format(
+                        visitor.skipped))
+            dap_debug("Visited [{}] patched bytes, [{}] skipped.", visitor.patched, visitor.skipped)
+            return visitor.patched_bytes.finalize()
         except Exception as e:
-            dap_err("Exception encountered while visiting patched bytes", str(e))
+            dap_err("Exception encountered while visiting patched bytes", str(e), key="visit_patched_bytes")
         except:
-            dap_err("Unknown")
+            dap_err("Unknown", key="visit_patched_bytes")
 
     def load_configuration(self):
         """Loads configuration from disk."""
@@ -560,12 +4527,61 @@ class DebugAutoPatchPlugin(idaapi.plugin_t):
         # Enables or disables patching at debug time
         if DapCfg.Enabled not in self.cfg:
             self.cfg[DapCfg.Enabled] = True
-        # Primary patched application address - set to BADADDR = use application start
+        # Primary patched application address - set to BADADDR = use application start. Deprecated, as it is global --
+        # moved to the default group's trigger of the first database it lies in, see load_patch_groups().
         if DapCfg.PrimaryPatchAddr not in self.cfg:
             self.cfg[DapCfg.PrimaryPatchAddr] = idaapi.BADADDR
+        # How the patch buffer is kept up to date -- database events, or polling on older IDA versions
+        if DapCfg.MonitorMode not in self.cfg:
+            self.cfg[DapCfg.MonitorMode] = DapMonitorMode.Events if not self.old_ida else DapMonitorMode.Polling
+        # Keeps an on-disk copy of the patch buffer for each database, for instant startup
+        if DapCfg.PatchCache not in self.cfg:
+            self.cfg[DapCfg.PatchCache] = True
+        # Collects timing statistics, and optionally dumps them to a JSON file after each debug session
+        if DapCfg.Stats not in self.cfg:
+            self.cfg[DapCfg.Stats] = False
+        if DapCfg.StatsDump not in self.cfg:
+            self.cfg[DapCfg.StatsDump] = False
+        self.stats.enabled = bool(self.cfg[DapCfg.Stats] or self.cfg[DapCfg.StatsDump])
+        # Reads back patches after applying them at process start, to confirm they landed
+        if DapCfg.Verify not in self.cfg:
+            self.cfg[DapCfg.Verify] = False
+        # Reads original bytes from process memory before patching, for exact live reverts (e.g. relocated bytes)
+        if DapCfg.CaptureOriginals not in self.cfg:
+            self.cfg[DapCfg.CaptureOriginals] = False
+        # Checks patches in the debugged process for being overwritten at debugger events, and re-applies them,
+        # reading at most the given number of bytes per event
+        if DapCfg.Watchdog not in self.cfg:
+            self.cfg[DapCfg.Watchdog] = False
+        if DapCfg.WatchdogBudget not in self.cfg:
+            self.cfg[DapCfg.WatchdogBudget] = 0x10000
+        # Patch groups of each database, keyed by module name
+        if DapCfg.Groups not in self.cfg:
+            self.cfg[DapCfg.Groups] = {}
+        # Adds temporary breakpoints at patch group trigger addresses
+        if DapCfg.TriggerBreakpoints not in self.cfg:
+            self.cfg[DapCfg.TriggerBreakpoints] = True
+        # Level of messages shown ("debug", "info", "warning" or "error"), and an optional file to also log them to
+        if DapCfg.LogLevel not in self.cfg:
+            self.cfg[DapCfg.LogLevel] = logging.getLevelName(DEBUG_MESSAGE_LEVEL).lower()
+        if DapCfg.LogFile not in self.cfg:
+            self.cfg[DapCfg.LogFile] = ""
+        self.configure_logging()
         if save_cfg:
             self.save_configuration()
 
+    def configure_logging(self):
+        """Applies the logging configuration. A relative log file path is relative to the configuration directory."""
+        level = logging.getLevelName(str(self.cfg[DapCfg.LogLevel]).upper())
+        if not isinstance(level, int):
+            dap_warn("Unknown log level [{}] -- using [{}].".format(
+                self.cfg[DapCfg.LogLevel], logging.getLevelName(DEBUG_MESSAGE_LEVEL).lower()))
+            level = DEBUG_MESSAGE_LEVEL
+        log_file = self.cfg[DapCfg.LogFile]
+        if log_file:
+            log_file = os.path.join(os.path.dirname(DAP_CONFIG_FILE_PATH), log_file)
+        configure_logging(level, log_file or None)
+
     def save_configuration(self):
         """Saves configuration to disk."""
         if self.cfg:
@@ -579,7 +4595,5 @@ class DebugAutoPatchPlugin(idaapi.plugin_t):
 
 def PLUGIN_ENTRY():
     global DAP_INSTANCE
-    logging.basicConfig(format='[%(levelname)s] %(message)s\t(%(module)s:%(funcName)s)')
-    logging.root.setLevel(logging.DEBUG)
     DAP_INSTANCE = DebugAutoPatchPlugin()
     return DAP_INSTANCE
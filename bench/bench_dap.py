@@ -0,0 +1,288 @@
+"""DebugAutoPatch benchmark suite.
+
+Runs the plugin's hot paths against the idaapi/idc stand-in in bench/fake_ida, so they can be measured on a plain
+machine without IDA:
+
+    * visit     -- PatchVisitor throughput over the whole "Patched bytes" database.
+    * monitor   -- patch_monitor_func cost for a full rescan, an idle cycle, and folding in a batch of patch deltas.
+    * apply     -- apply_patches_to_current_proc wall time, for each debugger latency profile.
+    * io        -- export_patches and import_patches throughput, for each patch set file format, and
+                   export_patched_binary throughput.
+    * variant   -- switch_patch_variant cost between two saved variants differing in a batch of patched bytes.
+
+Results are written as JSON, so regressions can be tracked between runs.
+
+Usage:
+    python bench/bench_dap.py --sizes 10,1000,100000,1000000 --output bench_results.json
+"""
+from __future__ import print_function
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, "fake_ida"))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import idaapi  # noqa: E402 -- the stand-in, from bench/fake_ida
+import idc  # noqa: E402
+
+IMAGE_BASE = 0x140000000
+FILE_OFFSET = 0x400
+# Per-call debugger latency (seconds) for each profile
+LATENCY_PROFILES = {
+    "local": 0.0,
+    "remote": 0.0001,
+}
+DEBUGGER_CALLS = ("suspend_process", "resume_process", "dbg_write_memory", "dbg_read_memory", "patch_dbg_byte",
+                  "invalidate_dbgmem_contents", "dbg_get_memory_info")
+DELTA_COUNT = 100
+
+
+def make_patches(count, run_length, seed=0):
+    """Creates a deterministic "Patched bytes" database of count bytes, in runs of about run_length bytes.
+
+    Returns:
+        tuple: (patches dict, end address of the patched area)
+    """
+    rng = random.Random(seed)
+    patches = {}
+    ea = IMAGE_BASE + 0x1000
+    while len(patches) < count:
+        length = min(rng.randint(1, 2 * run_length - 1), count - len(patches))
+        for i in range(length):
+            patches[ea + i] = (ea + i - IMAGE_BASE + FILE_OFFSET, rng.randint(0, 255), rng.randint(0, 255))
+        ea += length + rng.randint(1, 32)
+    return patches, ea
+
+
+def create_plugin(dap):
+    """Creates a plugin instance with default configuration, without starting its monitor thread."""
+    plugin = dap.DebugAutoPatchPlugin()
+    dap.DAP_INSTANCE = plugin
+    plugin.load_configuration()
+    plugin.cfg[dap.DapCfg.PatchCache] = False
+    return plugin
+
+
+def release_plugin(plugin):
+    """Terminates a plugin instance. Its configuration is dropped afterwards, so that __del__ does not try to save
+    it again during interpreter shutdown."""
+    plugin.term()
+    plugin.cfg = None
+
+
+def timed(func, repeat):
+    """Runs func repeat times and returns (min seconds, mean seconds)."""
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        times.append(time.time() - start)
+    return min(times), sum(times) / len(times)
+
+
+def result(benchmark, size, seconds, mean, **extra):
+    entry = {
+        "benchmark": benchmark,
+        "size": size,
+        "seconds": seconds,
+        "mean_seconds": mean,
+        "bytes_per_second": size / seconds if seconds > 0 else None,
+    }
+    entry.update(extra)
+    return entry
+
+
+def bench_visit(dap, size, repeat):
+    plugin = create_plugin(dap)
+    best, mean = timed(plugin.visit_patched_bytes, repeat)
+    release_plugin(plugin)
+    return [result("visit", size, best, mean)]
+
+
+def bench_monitor(dap, size, repeat):
+    results = []
+    plugin = create_plugin(dap)
+    plugin.set_idb_hooks()
+
+    def rescan():
+        plugin.rescan_needed = True
+        plugin.patch_monitor_func()
+    best, mean = timed(rescan, repeat)
+    results.append(result("monitor_rescan", size, best, mean))
+
+    best, mean = timed(plugin.patch_monitor_func, repeat)
+    results.append(result("monitor_idle", size, best, mean))
+
+    eas = sorted(idaapi.patched_bytes)[:DELTA_COUNT]
+
+    def deltas():
+        for ea in eas:
+            plugin.queue_patch_delta(ea)
+        plugin.patch_monitor_func()
+    best, mean = timed(deltas, repeat)
+    results.append(result("monitor_deltas", size, best, mean, deltas=len(eas)))
+    release_plugin(plugin)
+    return results
+
+
+def bench_apply(dap, size, repeat, profiles, end_ea):
+    results = []
+    plugin = create_plugin(dap)
+    plugin.rescan_needed = True
+    plugin.patch_monitor_func()
+    idaapi.map_region(IMAGE_BASE, end_ea - IMAGE_BASE)
+    idaapi.debugger_on = True
+    try:
+        for profile in profiles:
+            idaapi.latency.clear()
+            for name in DEBUGGER_CALLS:
+                idaapi.latency[name] = LATENCY_PROFILES[profile]
+            idaapi.call_counts.clear()
+            best, mean = timed(lambda: plugin.apply_patches_to_current_proc(pid=1), repeat)
+            calls = dict((name, count // repeat) for name, count in idaapi.call_counts.items())
+            results.append(result("apply", size, best, mean, profile=profile, debugger_calls=calls,
+                                  round_trips=sum(calls.values())))
+    finally:
+        idaapi.debugger_on = False
+        idaapi.latency.clear()
+        release_plugin(plugin)
+    return results
+
+
+def bench_io(dap, size, repeat, end_ea):
+    results = []
+    plugin = create_plugin(dap)
+    plugin.rescan_needed = True
+    plugin.patch_monitor_func()
+    idaapi.map_file_region(IMAGE_BASE, FILE_OFFSET, end_ea - IMAGE_BASE)
+    directory = tempfile.mkdtemp(prefix="dap_bench_io_")
+    try:
+        for fmt in dap.DAP_PATCH_FILE_FORMATS:
+            path = os.path.join(directory, "patches" + fmt.extension)
+            best, mean = timed(lambda: plugin.export_patches(path), repeat)
+            results.append(result("export", size, best, mean, format=fmt.extension, file_size=os.path.getsize(path)))
+            importer = create_plugin(dap)
+
+            def run_import():
+                importer.clear_imported_patches()
+                importer.import_patches(path)
+            best, mean = timed(run_import, repeat)
+            results.append(result("import", size, best, mean, format=fmt.extension))
+            release_plugin(importer)
+
+        input_path = os.path.join(directory, "target.exe")
+        with open(input_path, "wb") as f:
+            f.truncate(end_ea - IMAGE_BASE + FILE_OFFSET)
+        output_path = os.path.join(directory, "target.patched.exe")
+        best, mean = timed(lambda: plugin.export_patched_binary(output_path, input_path), repeat)
+        results.append(result("patched_binary", size, best, mean, file_size=os.path.getsize(input_path)))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+        release_plugin(plugin)
+    return results
+
+
+def bench_variant(dap, size, repeat, end_ea):
+    results = []
+    plugin = create_plugin(dap)
+    plugin.set_idb_hooks()
+    plugin.rescan_needed = True
+    plugin.patch_monitor_func()
+    idaapi.map_file_region(IMAGE_BASE, FILE_OFFSET, end_ea - IMAGE_BASE)
+    best, mean = timed(lambda: plugin.save_patch_variant("first"), repeat)
+    results.append(result("variant_save", size, best, mean))
+
+    eas = sorted(idaapi.patched_bytes)[:DELTA_COUNT]
+    for ea in eas:
+        idaapi.patch_bytes(ea, bytearray([idaapi.get_db_byte(ea) ^ 0xFF]))
+    plugin.patch_monitor_func()
+    plugin.save_patch_variant("second")
+    names = ["first", "second"]
+
+    def switch():
+        names.reverse()
+        plugin.switch_patch_variant(names[0])
+    best, mean = timed(switch, repeat)
+    results.append(result("variant_switch", size, best, mean, deltas=len(eas)))
+    release_plugin(plugin)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="DebugAutoPatch benchmark suite.")
+    parser.add_argument("--sizes", default="10,1000,100000,1000000",
+                        help="Comma-separated patched byte counts (default: %(default)s)")
+    parser.add_argument("--run-length", type=int, default=64,
+                        help="Average length of contiguous patched runs (default: %(default)s)")
+    parser.add_argument("--repeat", type=int, default=3, help="Repetitions per measurement (default: %(default)s)")
+    parser.add_argument("--benchmarks", default="visit,monitor,apply,io,variant",
+                        help="Comma-separated benchmarks to run (default: %(default)s)")
+    parser.add_argument("--profiles", default="local,remote",
+                        help="Comma-separated debugger latency profiles: {} (default: %(default)s)".format(
+                            ", ".join(sorted(LATENCY_PROFILES))))
+    parser.add_argument("--output", help="Write JSON results to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    benchmarks = args.benchmarks.split(",")
+    profiles = args.profiles.split(",")
+
+    idaapi.reset()
+    idc.ida_directory = tempfile.mkdtemp(prefix="dap_bench_")
+    os.makedirs(os.path.join(idc.ida_directory, "cfg"))
+
+    # The plugin reports progress to IDA's output window, i.e. stdout
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        import DebugAutoPatch as dap
+
+    results = []
+    for size in sizes:
+        idaapi.reset()
+        idaapi.imagebase = IMAGE_BASE
+        patches, end_ea = make_patches(size, args.run_length)
+        idaapi.set_patched_bytes(patches)
+        with contextlib.redirect_stdout(log):
+            if "visit" in benchmarks:
+                results.extend(bench_visit(dap, size, args.repeat))
+            if "monitor" in benchmarks:
+                results.extend(bench_monitor(dap, size, args.repeat))
+            if "apply" in benchmarks:
+                results.extend(bench_apply(dap, size, args.repeat, profiles, end_ea))
+            if "io" in benchmarks:
+                results.extend(bench_io(dap, size, args.repeat, end_ea))
+            if "variant" in benchmarks:
+                results.extend(bench_variant(dap, size, args.repeat, end_ea))
+        print("size={:<10} done".format(size), file=sys.stderr)
+
+    report = {
+        "dap_version": dap.DAP_VERSION,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "run_length": args.run_length,
+        "repeat": args.repeat,
+        "latency_profiles": LATENCY_PROFILES,
+        "results": results,
+    }
+    shutil.rmtree(idc.ida_directory, ignore_errors=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,382 @@
+"""Stand-in for IDA's idaapi module, for benchmarking DebugAutoPatch outside of IDA.
+
+Only the parts of the API used by the plugin are provided. The "Patched bytes" database and the memory of the
+debugged process are simulated in memory, and every debugger call can be given a fixed latency so that both local
+and remote debuggers can be modelled.
+"""
+import time
+
+IDA_SDK_VERSION = 700
+BADADDR = 0xFFFFFFFFFFFFFFFF
+PLUGIN_KEEP = 2
+BWN_DISASM = 27
+AST_ENABLE_ALWAYS = 0
+AST_ENABLE_FOR_FORM = 1
+AST_DISABLE_FOR_FORM = 5
+SETMENU_APP = 1
+PATH_TYPE_IDB = 1
+MFF_WRITE = 2
+SEGPERM_EXEC = 1
+SEGPERM_WRITE = 2
+SEGPERM_READ = 4
+BPT_EXEC = 8
+BPT_SOFT = 4
+
+#  ------------------------------------- Simulation state --------------------------------------
+# Seconds to wait on each call, keyed by function name
+latency = {}
+# Number of calls made, keyed by function name
+call_counts = {}
+# ea -> (fpos, orig, patched)
+patched_bytes = {}
+# Sorted (start, bytearray) regions of the debugged process memory
+process_regions = []
+# Region start -> SEGPERM_* flags
+region_perms = {}
+# (ea, fpos, size) regions of the database loaded from the input file
+file_regions = []
+# ea -> original byte, for bytes which are not patched (0 otherwise)
+original_bytes = {}
+# Path returned by ask_file()
+ask_file_result = None
+# Addresses of breakpoints, and the instruction pointer of the debugged process
+breakpoints = set()
+# Type of each breakpoint added through add_bpt(), keyed by address
+breakpoint_types = {}
+ip = 0
+debugger_on = False
+input_file_md5 = b"\x5a" * 16
+idb_path = "/tmp/fake_ida/target.i64"
+root_filename = "target.exe"
+input_file_path = "/tmp/fake_ida/target.exe"
+imagebase = 0x140000000
+
+_sorted_patch_eas = None
+
+
+def reset():
+    """Resets all simulation state."""
+    global debugger_on, _sorted_patch_eas
+    latency.clear()
+    call_counts.clear()
+    patched_bytes.clear()
+    del process_regions[:]
+    region_perms.clear()
+    del file_regions[:]
+    original_bytes.clear()
+    del installed_hooks[:]
+    breakpoints.clear()
+    breakpoint_types.clear()
+    debugger_on = False
+    _sorted_patch_eas = None
+
+
+def set_patched_bytes(patches):
+    """Replaces the "Patched bytes" database.
+
+    Args:
+        patches (dict): Maps ea to a (fpos, orig, patched) tuple.
+    """
+    global _sorted_patch_eas
+    patched_bytes.clear()
+    patched_bytes.update(patches)
+    _sorted_patch_eas = None
+
+
+def map_region(start, size, perm=SEGPERM_READ | SEGPERM_EXEC):
+    """Maps a zero-filled region of debugged process memory."""
+    process_regions.append((start, bytearray(size)))
+    process_regions.sort(key=lambda region: region[0])
+    region_perms[start] = perm
+
+
+def map_file_region(ea, fpos, size):
+    """Maps a region of the database to the input file."""
+    file_regions.append((ea, fpos, size))
+
+
+class _Segment(object):
+    def __init__(self, start_ea, end_ea):
+        self.start_ea = start_ea
+        self.end_ea = end_ea
+
+
+def getseg(ea):
+    """Returns the database segment containing ea -- the file regions stand in for segments."""
+    for start, _, size in file_regions:
+        if start <= ea < start + size:
+            return _Segment(start, start + size)
+    return None
+
+
+def _call(name):
+    call_counts[name] = call_counts.get(name, 0) + 1
+    delay = latency.get(name)
+    if delay:
+        time.sleep(delay)
+
+
+def _find_region(ea, size):
+    for start, data in process_regions:
+        if start <= ea and ea + size <= start + len(data):
+            return start, data
+    return None, None
+#  ---------------------------------------------------------------------------------------------
+
+
+#  ------------------------------------------- UI ----------------------------------------------
+class Form(object):
+    class FormChangeCb(object):
+        def __init__(self, callback):
+            self.callback = callback
+
+    def __init__(self, form, controls):
+        pass
+
+    def Compile(self):
+        pass
+
+    def Execute(self):
+        return 1
+
+    def Free(self):
+        pass
+
+
+class action_handler_t(object):
+    def __init__(self):
+        pass
+
+
+class action_desc_t(object):
+    def __init__(self, name, label, handler, *args):
+        self.name = name
+        self.label = label
+        self.handler = handler
+
+
+def register_action(desc):
+    return True
+
+
+def unregister_action(name):
+    return True
+
+
+def attach_action_to_menu(*args):
+    return True
+
+
+def add_menu_item(*args):
+    return True
+
+
+def ask_file(for_saving, mask, prompt):
+    return ask_file_result
+
+
+class plugin_t(object):
+    pass
+
+
+def execute_sync(callback, flags):
+    return callback()
+#  ---------------------------------------------------------------------------------------------
+
+
+#  ------------------------------------------ Hooks --------------------------------------------
+# Installed hooks, which receive the events raised by the simulation
+installed_hooks = []
+
+
+class _Hooks(object):
+    def __init__(self, *args):
+        pass
+
+    def hook(self):
+        installed_hooks.append(self)
+        return True
+
+    def unhook(self):
+        if self in installed_hooks:
+            installed_hooks.remove(self)
+        return True
+
+
+class DBG_Hooks(_Hooks):
+    pass
+
+
+class IDB_Hooks(_Hooks):
+    pass
+#  ---------------------------------------------------------------------------------------------
+
+
+#  ----------------------------------------- Database ------------------------------------------
+def visit_patched_bytes(start, end, callback):
+    global _sorted_patch_eas
+    _call("visit_patched_bytes")
+    if _sorted_patch_eas is None:
+        _sorted_patch_eas = sorted(patched_bytes)
+    for ea in _sorted_patch_eas:
+        if start <= ea < end:
+            fpos, orig, patched = patched_bytes[ea]
+            result = callback(ea, fpos, orig, patched)
+            if result:
+                return result
+    return 0
+
+
+def patch_bytes(ea, buf):
+    """Patches database bytes. Bytes patched back to their original value are no longer patched, as in IDA."""
+    global _sorted_patch_eas
+    _call("patch_bytes")
+    for offset, value in enumerate(bytearray(buf)):
+        address = ea + offset
+        fpos, orig, _ = patched_bytes.get(address, (_file_offset(address), original_bytes.get(address, 0), 0))
+        if value == orig:
+            patched_bytes.pop(address, None)
+        else:
+            patched_bytes[address] = (fpos, orig, value)
+        _sorted_patch_eas = None
+        for hook in list(installed_hooks):
+            if isinstance(hook, IDB_Hooks) and hasattr(hook, "byte_patched"):
+                hook.byte_patched(address, orig)
+    return True
+
+
+def revert_byte(ea):
+    entry = patched_bytes.get(ea)
+    if entry is not None:
+        patch_bytes(ea, bytearray([entry[1]]))
+    return entry is not None
+
+
+def _file_offset(ea):
+    for start, fpos, size in file_regions:
+        if start <= ea < start + size:
+            return fpos + ea - start
+    return -1
+
+
+def get_original_byte(ea):
+    entry = patched_bytes.get(ea)
+    return entry[1] if entry else original_bytes.get(ea, 0)
+
+
+def get_db_byte(ea):
+    entry = patched_bytes.get(ea)
+    return entry[2] if entry else original_bytes.get(ea, 0)
+
+
+def get_fileregion_offset(ea):
+    entry = patched_bytes.get(ea)
+    return entry[0] if entry else -1
+
+
+def get_fileregion_ea(offset):
+    for ea, fpos, size in file_regions:
+        if fpos <= offset < fpos + size:
+            return ea + offset - fpos
+    return BADADDR
+
+
+def get_bytes(ea, size):
+    return bytes(bytearray(get_db_byte(ea + i) for i in range(size)))
+
+
+def get_input_file_path():
+    return input_file_path
+
+
+def get_root_filename():
+    return root_filename
+
+
+def get_imagebase():
+    return imagebase
+
+
+def retrieve_input_file_md5():
+    return input_file_md5
+
+
+def get_path(path_type):
+    return idb_path
+#  ---------------------------------------------------------------------------------------------
+
+
+#  ----------------------------------------- Debugger ------------------------------------------
+def is_debugger_on():
+    return debugger_on
+
+
+def is_debugger_busy():
+    return False
+
+
+def suspend_process():
+    _call("suspend_process")
+    return True
+
+
+def resume_process():
+    _call("resume_process")
+    return True
+
+
+def dbg_write_memory(ea, buf):
+    _call("dbg_write_memory")
+    start, data = _find_region(ea, len(buf))
+    if data is None:
+        return False
+    data[ea - start:ea - start + len(buf)] = buf
+    return True
+
+
+def dbg_read_memory(ea, size):
+    _call("dbg_read_memory")
+    start, data = _find_region(ea, size)
+    if data is None:
+        return None
+    return bytes(data[ea - start:ea - start + size])
+
+
+def patch_dbg_byte(ea, value):
+    _call("patch_dbg_byte")
+    start, data = _find_region(ea, 1)
+    if data is None:
+        return 0
+    data[ea - start] = value
+    return 1
+
+
+def dbg_get_memory_info():
+    _call("dbg_get_memory_info")
+    return [(start, start + len(data), "", "", 0, 2, region_perms[start]) for start, data in process_regions]
+
+
+def invalidate_dbgmem_contents(ea, size):
+    _call("invalidate_dbgmem_contents")
+
+
+def get_ip_val():
+    return ip
+
+
+def exist_bpt(ea):
+    return ea in breakpoints
+
+
+def add_bpt(ea, size=0, bpt_type=BPT_SOFT):
+    _call("add_bpt")
+    breakpoints.add(ea)
+    breakpoint_types[ea] = bpt_type
+    return True
+
+
+def del_bpt(ea):
+    _call("del_bpt")
+    breakpoint_types.pop(ea, None)
+    return breakpoints.discard(ea) is None
+#  ---------------------------------------------------------------------------------------------
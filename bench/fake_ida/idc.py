@@ -0,0 +1,23 @@
+"""Stand-in for IDA's idc module, for benchmarking DebugAutoPatch outside of IDA."""
+import idaapi
+
+# Address reported as the cursor position
+screen_ea = 0
+# Directory reported as the IDA installation directory -- the plugin keeps its configuration in cfg/ below it
+ida_directory = "/tmp/fake_ida"
+
+
+def GetIdaDirectory():
+    return ida_directory
+
+
+def patch_dbg_byte(ea, value):
+    return idaapi.patch_dbg_byte(ea, value)
+
+
+def resume_process():
+    return idaapi.resume_process()
+
+
+def get_screen_ea():
+    return screen_ea